@@ -0,0 +1,61 @@
+"""Compares the set based folder diff with the sorted merge-join of `shared.diff`.
+
+Both sides are synthetic listings of `--entries` files where `--changed` of every thousand
+entries differ, as many are only on the local side and as many only on the remote side.
+Run from the repository root:
+
+    python -m benchmarks.diff_benchmark [--entries 1000000]
+
+The set based diff needs both listings in memory, the merge-join only the entries it's
+looking at, so peak memory (tracemalloc) is reported next to the time.
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Iterator, Tuple
+from models.data import File
+from shared.diff import diff_sorted
+
+def entries(count: int, side: str, changed: int) -> Iterator[Tuple[str, File]]:
+    for i in range(count):
+        slot = i % 1000
+        if side == "local" and 2 * changed <= slot < 3 * changed:
+            continue # deleted locally
+        if side == "remote" and changed <= slot < 2 * changed:
+            continue # new locally
+        digest = f"{i:032x}" if side == "remote" or slot >= changed else f"{i + 1:032x}"
+        yield f"dir{i // 1000:06d}/file{slot:03d}", File.model_construct(dateModified=0.0, md5=digest, hash_algorithm="md5", size=i)
+
+def set_diff(local, remote) -> int:
+    local, remote = dict(local), dict(remote)
+    new = local.keys() - remote.keys()
+    deleted = remote.keys() - local.keys()
+    changed = {key for key in local.keys() & remote.keys() if not local[key].same_content(remote[key])}
+    return len(new) + len(deleted) + len(changed)
+
+def merge_diff(local, remote) -> int:
+    return sum(1 for _ in diff_sorted(local, remote))
+
+def measure(diff, count: int, changed: int) -> Tuple[int, float, float]:
+    started = time.perf_counter()
+    actions = diff(entries(count, "local", changed), entries(count, "remote", changed))
+    elapsed = time.perf_counter() - started
+    # Second run for memory only, tracemalloc slows allocations down a lot.
+    tracemalloc.start()
+    diff(entries(count, "local", changed), entries(count, "remote", changed))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return actions, elapsed, peak / 1024 / 1024
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--changed", type=int, default=10, help="changed, new and deleted entries per thousand")
+    args = parser.parse_args()
+    print(f"{'diff':>12} {'actions':>10} {'seconds':>10} {'peak MiB':>10}")
+    for name, diff in (("set", set_diff), ("merge-join", merge_diff)):
+        actions, elapsed, peak = measure(diff, args.entries, args.changed)
+        print(f"{name:>12} {actions:>10} {elapsed:>10.2f} {peak:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Micro-benchmark of the file hashing paths, per file-size class.
+
+Compares the original 4 KiB `file.read` loop with the reused-buffer `readinto` path
+and the mmap path of `shared.hashing`. Run from the repository root:
+
+    python -m benchmarks.hash_benchmark [--algorithm md5] [--buffer-size 1048576] [--max-size 268435456]
+
+Files are written to a temporary directory and are usually still in the page cache,
+so this measures CPU/copy overhead rather than disk speed.
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from shared.hashing import get_hash_engine
+
+SIZE_CLASSES = [4 * 1024, 256 * 1024, 4 * 1024 * 1024, 64 * 1024 * 1024, 256 * 1024 * 1024, 1024 * 1024 * 1024]
+
+def legacy_md5(file_path: str, buffer_size: int) -> str:
+    hash_md5 = hashlib.md5()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(4096), b""):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+def measure(hash_func, paths, size: int) -> float:
+    started = time.perf_counter()
+    for path in paths:
+        hash_func(path)
+    elapsed = time.perf_counter() - started
+    return size * len(paths) / elapsed / 1e9
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--algorithm", default="md5")
+    parser.add_argument("--buffer-size", type=int, default=1024 * 1024)
+    parser.add_argument("--max-size", type=int, default=256 * 1024 * 1024)
+    parser.add_argument("--total-bytes", type=int, default=512 * 1024 * 1024, help="bytes hashed per size class")
+    args = parser.parse_args()
+    engine = get_hash_engine(args.algorithm)
+    implementations = {
+        "legacy 4KiB read (md5)": lambda path: legacy_md5(path, args.buffer_size),
+        f"readinto {args.buffer_size // 1024}KiB": lambda path: engine.hash_file(path, args.buffer_size),
+        "mmap": lambda path: engine.hash_file(path, args.buffer_size, use_mmap=True),
+    }
+
+    print(f"{'size':>10} " + " ".join(f"{name:>24}" for name in implementations) + "   (GB/s)")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in (size for size in SIZE_CLASSES if size <= args.max_size):
+            count = max(1, min(1000, args.total_bytes // size))
+            paths = []
+            for i in range(count):
+                path = os.path.join(directory, f"{size}_{i}")
+                with open(path, "wb") as file:
+                    file.write(os.urandom(size))
+                paths.append(path)
+            results = [measure(hash_func, paths, size) for hash_func in implementations.values()]
+            print(f"{size:>10} " + " ".join(f"{result:>24.2f}" for result in results))
+            for path in paths:
+                os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import enum
+import math
 import os
 import threading
 from nicegui import ui, run, app
@@ -7,13 +8,23 @@ from nicegui.elements.button import Button
 from nicegui.elements.spinner import Spinner
 from nicegui.elements.label import Label
 from nicegui.elements.input import Input
-from typing import Dict
+from typing import Dict, List, Optional, Set
 import asyncio
 from dataclasses import dataclass
-from client.http_client import get_target_files_state, upload_all_files, delete_all_files, UploadResult, UploadResultEnum
-from client.storage import get_config_dc, get_data_dc
-from models.config import TrackingFolder
+from client.http_client import deduplicate_uploads, get_capabilities, get_tree_nodes, have_hashes, iter_target_files, materialize_duplicates, move_files, set_upload_limits, upload_all_files, delete_all_files, UploadOptions, UploadResult, UploadResultEnum
+from client.pipeline import RemoteFiles, UploadPipeline, lazy_hashing
+from client.scheduler import QUEUED, SCANNING, WAITING_TO_SCAN, SyncScheduler
+from client.storage import get_config_dc, get_index
+from client.throttle import Throttle, TokenBucket, current_limit, format_rate
+from models.config import Bandwidth, TrackingFolder
+from models.data import File
+from models.file_ops import Move
+from models.protocol import Capabilities, TreeNode
+from shared.diff import DiffKind, Prefetch, diff_sorted_async, pair_renames
 from shared.files import FileHandler
+from shared.compression import negotiate_encoding
+from shared.hashing import negotiate_algorithm
+from shared.tree import build_tree_nodes, diff_tree
 from shared.systray import init_systray_icon
 from file_picker import local_file_picker
 from getmac import get_mac_address
@@ -37,6 +48,10 @@ class FolderRow():
         self.spinner_visible = True
         self.buttons_enabled = False
 
+    def set_queued(self, label: str):
+        self.status_label = label
+        self.buttons_enabled = False
+
     def set_idle(self):
         self.status_label = "Idle"
         self.status = FolderStatus.IDLE
@@ -48,9 +63,14 @@ systray_init_done = False
 folder_rows: Dict[str, FolderRow] = {}
 input_base_path = None
 timer = None
+# Manifest entries buffered ahead of the diff.
+MANIFEST_PREFETCH = 10000
 dest_address = get_config_dc().get().client.dest_address
 
-fh = FileHandler(get_config_dc(), get_data_dc())
+fh = FileHandler(get_config_dc(), get_index())
+# Upload bandwidth shared by all folders, and each folder's own on top of it (by folder uuid).
+upload_bucket = TokenBucket(lambda: current_limit(get_config_dc().get().bandwidth))
+folder_buckets: Dict[str, TokenBucket] = {}
 
 def remove_folder(folder_to_delete: TrackingFolder):
     global folder_rows
@@ -78,24 +98,129 @@ async def add_folder(folder: TrackingFolder):
     get_config_dc().update_data(config)
     await add_folder_row(folder)
 
-async def track_upload_status(queue: asyncio.Queue[UploadResult], total: int, folder: TrackingFolder):
+def folder_bandwidth(uuid: str) -> Optional[Bandwidth]:
+    return next((folder.bandwidth for folder in get_config_dc().get().folders.values() if folder.uuid == uuid), None)
+
+def upload_throttle(folder: TrackingFolder) -> Throttle:
+    if folder.uuid not in folder_buckets:
+        folder_buckets[folder.uuid] = TokenBucket(lambda: current_limit(folder_bandwidth(folder.uuid)))
+    return Throttle([upload_bucket, folder_buckets[folder.uuid]])
+
+def uploading_label(uploaded_count: int, total: int, throttle: Optional[Throttle]) -> str:
+    label = f"Uploading {uploaded_count}/{total}"
+    return f"{label}, {format_rate(throttle.meter.rate())}" if throttle else label
+
+async def track_upload_status(queue: asyncio.Queue[UploadResult], total: int, folder: TrackingFolder,
+                              throttle: Optional[Throttle] = None, uploading: Optional[asyncio.Task] = None) -> Dict[str, str]:
+    """Returns the hashes of the files that were hashed while they were uploaded. Stops early once
+    `uploading` is done and everything it reported was taken, should it report fewer than `total`."""
+    hashes = {}
     if total == 0:
-        return
+        return hashes
     uploaded_count = 1
+    logical_bytes = wire_bytes = 0
     while True:
-        result = await queue.get()
+        try:
+            result = await asyncio.wait_for(queue.get(), timeout=1.0)
+        except asyncio.TimeoutError:
+            if uploading is not None and uploading.done() and queue.empty():
+                print(f"Uploads ended with {total - uploaded_count + 1} of {total} files unreported")
+                return hashes
+            # Keeps the throughput current while big files are on their way.
+            folder_rows[folder.uuid].status_label = uploading_label(uploaded_count, total, throttle)
+            continue
         if result.result == UploadResultEnum.SUCCESS:
-            # TODO: Implement
-            pass
+            logical_bytes += result.logical_bytes
+            wire_bytes += result.wire_bytes
+            if result.hash:
+                hashes[result.relative_path] = result.hash
         else:
             # TODO: Implement
             pass
         
         uploaded_count += 1
-        folder_rows[folder.uuid].status_label = f"Uploading {uploaded_count}/{total}"
+        folder_rows[folder.uuid].status_label = uploading_label(uploaded_count, total, throttle)
         if uploaded_count > total:
+            print(f"Uploaded {logical_bytes} bytes of files as {wire_bytes} bytes on the wire")
             queue.task_done()
-            return
+            return hashes
+
+async def upload_tracked(folder: TrackingFolder, files: Set[str], queue: asyncio.Queue[UploadResult],
+                         upload_options: UploadOptions) -> Dict[str, str]:
+    """Uploads `files` while showing the progress, returns what `track_upload_status` does."""
+    client = get_config_dc().get().client
+    upload_task = asyncio.create_task(
+        upload_all_files(folder.base_path, files, client.dest_address, folder.name, queue, upload_options))
+    track_task = asyncio.create_task(track_upload_status(queue, len(files), folder, upload_options.throttle, upload_task))
+    try:
+        await upload_task
+    except BaseException:
+        track_task.cancel()
+        raise
+    return await track_task
+
+async def send_files(folder: TrackingFolder, capabilities: Capabilities, algorithm: str, local_files: Dict[str, File],
+                     files_to_copy: Set[str], changed_files: Set[str], files_to_delete: Set[str] = set()):
+    """Uploads `files_to_copy` (`changed_files` are the ones the target has with other content) and
+    deletes `files_to_delete` on the target, after copying what the server already has. Returns the
+    hashes of the files that were hashed while they were uploaded."""
+    client = get_config_dc().get().client
+    config = get_config_dc().get()
+    set_upload_limits(config.concurrency)
+    upload_options = UploadOptions(
+        delta_files={
+            key: local_files[key] for key in changed_files
+            if local_files[key].size >= config.delta.min_file_size
+        } if config.delta.enabled and "delta" in capabilities.features else {},
+        delta_block_size=config.delta.block_size,
+        delta_max_literal_ratio=config.delta.max_literal_ratio,
+        encoding=negotiate_encoding(capabilities.compression) if config.compression.enabled else None,
+        compression=config.compression,
+        bulk=config.bulk if config.bulk.enabled and "bulk" in capabilities.features else None,
+        chunked=config.chunked if config.chunked.enabled and "sessions" in capabilities.features else None,
+        files=local_files,
+        stream="stream" in capabilities.features,
+        algorithm=algorithm,
+        throttle=upload_throttle(folder))
+
+    files_to_copy = set(files_to_copy)
+    duplicates = {}
+    if config.dedup.enabled and "dedup" in capabilities.features and files_to_copy:
+        folder_rows[folder.uuid].status_label = "Deduplicating..."
+        materialized, duplicates, saved_bytes = await deduplicate_uploads(
+            client.dest_address, folder.name, {key: local_files[key] for key in files_to_copy}, config.dedup.min_file_size)
+        files_to_copy -= materialized | duplicates.keys()
+        print(f"Deduplicated {len(materialized) + len(duplicates)} files, {saved_bytes} bytes don't have to be sent")
+
+    queue = asyncio.Queue[UploadResult]()
+    folder_rows[folder.uuid].status_label = f"Uploading 1/{len(files_to_copy)}"
+    tasks = []
+    hashes = {}
+    
+    if len(files_to_copy) > 0:
+        tasks.append(asyncio.create_task(upload_tracked(folder, files_to_copy, queue, upload_options)))
+    if len(files_to_delete) > 0:
+        tasks.append(asyncio.create_task(delete_all_files(folder.base_path, files_to_delete, client.dest_address, folder.name)))
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    if len(files_to_copy) > 0:
+        hashes.update(results[0])
+
+    if duplicates:
+        # Copies of content uploaded above, made on the server from the uploaded file.
+        not_materialized = await materialize_duplicates(client.dest_address, folder.name, local_files, duplicates)
+        if not_materialized:
+            print(f"{len(not_materialized)} duplicates couldn't be copied on the server, uploading them")
+            hashes.update(await upload_tracked(folder, not_materialized, queue, upload_options))
+    if hashes:
+        # Hashed on the way (see hashing.lazy), indexed so the next scan doesn't read them again.
+        await run.io_bound(fh.update_files_data, folder.name, {
+            path: local_files[path].model_copy(update={"md5": digest, "hash_algorithm": algorithm}) for path, digest in hashes.items()})
+    return hashes
 
 async def sync_folder(folder: TrackingFolder):
     global folder_rows
@@ -105,37 +230,123 @@ async def sync_folder(folder: TrackingFolder):
     folder_row.set_syncing()
 
     try:
-        local_folder_state_task = run.cpu_bound(fh.get_folder_metadata, folder.name)
-        target_folder_state_task = get_target_files_state(client.dest_address, folder.name)
-        local_folder_state, target_folder_state = await asyncio.gather(local_folder_state_task, target_folder_state_task)
+        capabilities = await get_capabilities(client.dest_address)
+        algorithm = negotiate_algorithm(fh.hash_preferences(), capabilities.hash_algorithms)
+        print(f"Hash algorithm: {algorithm}")
+        config = get_config_dc().get()
+        # Start on the target's side first, so the server scans while we do.
+        use_tree = "tree" in capabilities.features
+        if use_tree:
+            target_root = asyncio.create_task(get_tree_nodes(client.dest_address, folder.name, algorithm, [""], refresh=True))
+        else:
+            target_entries = Prefetch(iter_target_files(client.dest_address, folder.name, algorithm, "manifest" in capabilities.features),
+                                      maxsize=MANIFEST_PREFETCH)
+        pipeline = skip_hashing = None
+        if use_tree:
+            # Single files are looked up in the tree nodes of their directories (see client.pipeline).
+            async def fetch_nodes(paths: List[str]) -> List[TreeNode]:
+                await target_root # the server's index is current
+                return await get_tree_nodes(client.dest_address, folder.name, algorithm, paths)
+
+            remote_files = RemoteFiles(fetch_nodes)
+            if config.hashing.lazy and "stream" in capabilities.features:
+                chunked = config.chunked.enabled and "sessions" in capabilities.features
+                skip_hashing = lazy_hashing(remote_files, algorithm, config.chunked.min_file_size if chunked else math.inf)
+            if config.concurrency.pipeline_uploads:
+                # Files are uploaded as they're hashed.
+                have = (lambda hashes: have_hashes(client.dest_address, algorithm, hashes)) if "dedup" in capabilities.features else None
+                pipeline = UploadPipeline(remote_files, lambda files, changed: send_files(folder, capabilities, algorithm, files, set(files), changed),
+                                          have)
+                pipeline_task = asyncio.create_task(pipeline.run())
+
+        def scan():
+            try:
+                return fh.get_folder_metadata(folder.name, algorithm, on_hashed=pipeline.offer if pipeline else None,
+                                              skip_hashing=skip_hashing)
+            finally:
+                if pipeline:
+                    pipeline.close()
+
+        try:
+            # Hashing runs on fh's worker pool, the scan itself only needs a thread.
+            async with scheduler.scan_slot(folder):
+                local_folder_state = await run.io_bound(scan)
+            if pipeline:
+                await pipeline_task
+        except:
+            if pipeline:
+                pipeline_task.cancel()
+            if use_tree:
+                target_root.cancel()
+            else:
+                target_entries.close()
+            raise
+        if pipeline and pipeline.sent:
+            print(f"Uploaded {len(pipeline.sent)} files while hashing")
+            for path, digest in pipeline.hashes.items():
+                local_folder_state.files[path] = local_folder_state.files[path].model_copy(update={"md5": digest, "hash_algorithm": algorithm})
+            # The server indexed them on arrival, so a fresh root leaves them out of the diff.
+            target_root = asyncio.create_task(get_tree_nodes(client.dest_address, folder.name, algorithm, [""], refresh=True))
         print("Calculating...")
-        new_files_to_copy = set(local_folder_state.files.keys()) - set(target_folder_state.files.keys())
-        old_files_to_delete = set(set(target_folder_state.files.keys() - local_folder_state.files.keys()))
-        
-        changed_files_to_copy = {
-            key for key in local_folder_state.files.keys() & target_folder_state.files.keys()
-            if local_folder_state.files[key].md5 != target_folder_state.files[key].md5
-        }
-        
-        queue = asyncio.Queue[UploadResult]()
-        files_to_copy = new_files_to_copy.union(changed_files_to_copy)
-        folder_rows[folder.uuid].status_label = f"Uploading 1/{len(files_to_copy)}"
-        tasks = []
-        
-        if len(files_to_copy) > 0:
-            upload_task = upload_all_files(folder.base_path, files_to_copy, client.dest_address, folder.name, queue)
-            track_task = track_upload_status(queue, len(files_to_copy), folder)
-            tasks.extend([upload_task, track_task])
-        if len(old_files_to_delete) > 0:
-            delete_task = delete_all_files(folder.base_path, old_files_to_delete, client.dest_address, folder.name)
-            tasks.append(delete_task)
-        await asyncio.gather(*tasks)
+        if use_tree:
+            # Only directories whose hash tree digests differ are listed.
+            local_nodes = build_tree_nodes(local_folder_state.files, await run.io_bound(fh.get_directories, folder.name))
+            fetch = lambda paths: get_tree_nodes(client.dest_address, folder.name, algorithm, paths)
+            actions = diff_tree(local_nodes, (await target_root)[0], fetch)
+        else:
+            actions = diff_sorted_async(sorted(local_folder_state.files.items()), target_entries)
+        new_actions, changed_files_to_copy, delete_actions = [], set(), []
+        async for action in actions:
+            if action.kind == DiffKind.COPY_NEW:
+                new_actions.append(action)
+            elif action.kind == DiffKind.COPY_CHANGED:
+                changed_files_to_copy.add(action.path)
+            elif action.kind == DiffKind.DELETE:
+                delete_actions.append(action)
+        renames, new_actions, delete_actions = pair_renames(new_actions, delete_actions)
+        new_files_to_copy = {action.path for action in new_actions}
+        old_files_to_delete = {action.path for action in delete_actions}
+        if renames and "move" in capabilities.features:
+            folder_row.status_label = f"Moving {len(renames)} files"
+            moves = [Move(source=action.source, destination=action.path, hash=action.local.md5, hash_algorithm=action.local.hash_algorithm)
+                     for action in renames]
+            failed = [result for result in await move_files(client.dest_address, folder.name, moves) if not result.success]
+            print(f"Moved {len(renames) - len(failed)} files on the target, {len(failed)} have to be uploaded")
+            # Whatever couldn't be moved is sent the usual way.
+            new_files_to_copy.update(result.destination for result in failed)
+            old_files_to_delete.update(result.source for result in failed)
+        else:
+            new_files_to_copy.update(action.path for action in renames)
+            old_files_to_delete.update(action.source for action in renames)
+
+        scheduler.record_bytes(folder, sum(local_folder_state.files[path].size
+                                           for path in new_files_to_copy | changed_files_to_copy | (pipeline.sent if pipeline else set())))
+        await send_files(folder, capabilities, algorithm, local_folder_state.files, new_files_to_copy | changed_files_to_copy,
+                         changed_files_to_copy, old_files_to_delete)
         folder_row.set_idle()
     except:
         pass
     finally:
         folder_row.set_idle()
 
+def queue_changed():
+    position = 0
+    for entry in scheduler.entries():
+        folder_row = folder_rows.get(entry.folder.uuid)
+        if entry.state == QUEUED:
+            position += 1
+            if folder_row:
+                folder_row.set_queued(f"Queued ({position})")
+        elif folder_row and entry.state in (WAITING_TO_SCAN, SCANNING):
+            folder_row.status_label = f"{entry.state}..."
+    display_queue.refresh()
+
+scheduler = SyncScheduler(sync_folder, get_config_dc().get().concurrency, on_change=queue_changed)
+
+def sync_all():
+    for folder in get_config_dc().get().folders.values():
+        scheduler.submit(folder)
+
 async def add_folder_row(folder: TrackingFolder):
     global folder_rows
     folder_rows[folder.uuid] = FolderRow("Idle", folder)
@@ -191,11 +402,23 @@ def display_folders():
                     spinner.set_visibility(folder_row.status == FolderStatus.SYNCING)
                     # ui.label(folder_row.status_label)
                     ui.label().bind_text_from(folder_row, 'status_label')
-                    sync = ui.button("Sync", on_click=lambda folder=folder: sync_folder(folder)).bind_enabled_from(folder_row, 'buttons_enabled')
+                    sync = ui.button("Sync", on_click=lambda folder=folder: scheduler.submit(folder)).bind_enabled_from(folder_row, 'buttons_enabled')
                     sync.tooltip("Sync folder to remote system.")
                     delete = ui.button("Delete", on_click=lambda folder=folder: remove_folder(folder)).bind_enabled_from(folder_row, 'buttons_enabled')
                     delete.tooltip("Delete tracked folder from list. (Does not delete any files at all.)")
 
+@ui.refreshable
+def display_queue():
+    entries = scheduler.entries()
+    if not entries:
+        ui.label("No syncs running or queued.")
+        return
+    for entry in entries:
+        with ui.row().classes('items-center'):
+            ui.label(entry.folder.name).style("width: 150px")
+            ui.label(entry.state).style("width: 150px")
+            ui.label(f"Priority {entry.folder.priority}")
+
 def handle_exit():
     app.shutdown()
 
@@ -256,6 +479,9 @@ def index():
         folder_list_container = ui.column().classes('w-full')
         folders_panel.open()
         display_folders()
+        ui.button("Sync All", on_click=sync_all).tooltip("Queue a sync of every folder.")
+    with ui.expansion('Queue', icon='work').classes('w-full'):
+        display_queue()
 
 ui.timer(0.1, handle_queue_messages, once = True)
 ui.timer(0.5, add_tray_icon, once = True)
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+class UploadSlot():
+    def __init__(self) -> None:
+        self.succeeded: Optional[bool] = None
+        self.transferred = 0
+
+    def success(self, transferred: int):
+        self.succeeded = True
+        self.transferred = transferred
+
+    def failure(self):
+        self.succeeded = False
+
+class AdaptiveLimiter():
+    """Limits in-flight uploads, adapting the limit to what the link can take.
+
+    Additive increase while throughput keeps improving, a step back when adding uploads made
+    things slower and multiplicative decrease on errors and timeouts.
+    """
+
+    def __init__(self, minimum: int, maximum: int, initial: int) -> None:
+        self.limit = 0.0
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+        self.set_bounds(minimum, maximum, initial)
+
+    def set_bounds(self, minimum: int, maximum: int, initial: int):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self._reset_window()
+        self._last_throughput = 0.0
+
+    def _reset_window(self):
+        self._window_started = time.monotonic()
+        self._window_bytes = 0
+        self._window_count = 0
+
+    def throughput(self) -> float:
+        """Bytes per second the uploads got through in the last window judged, 0 before there was one."""
+        return self._last_throughput
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        slot = UploadSlot()
+        try:
+            yield slot
+        except Exception:
+            slot.failure()
+            raise
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._record(slot)
+                self._condition.notify_all()
+
+    def _record(self, slot: UploadSlot):
+        if slot.succeeded is None:
+            return
+        if not slot.succeeded:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_throughput = 0.0
+            self._reset_window()
+            print(f"Upload failed, concurrency down to {int(self.limit)}")
+            return
+
+        self._window_bytes += slot.transferred
+        self._window_count += 1
+        # Judge a window of about one completion per slot, shorter ones are mostly noise.
+        if self._window_count < int(self.limit):
+            return
+        elapsed = time.monotonic() - self._window_started
+        throughput = self._window_bytes / elapsed if elapsed > 0 else 0.0
+        if throughput >= self._last_throughput * 1.05:
+            self.limit = min(self.maximum, self.limit + 1)
+        elif throughput < self._last_throughput * 0.8:
+            self.limit = max(self.minimum, self.limit - 1)
+        self._last_throughput = throughput
+        self._reset_window()
@@ -1,19 +1,61 @@
 import asyncio
+import io
 import os
 import urllib.parse
 import httpx
 import urllib
-from models.data import Folder
-from models.file_ops import Delete
+from typing import AsyncIterator, BinaryIO, Dict, Iterable, List, Optional, Set, Tuple
+from models.config import Bulk, Chunked, Compression, Concurrency
+from models.data import File, Folder
+from models.file_ops import BulkResult, Delete, DeleteResult, Have, Materialize, MaterializeRequest, MaterializeResult, Move, MoveResult, Moves, Signatures, UploadSession, UploadSessionCreate
+from models.protocol import Capabilities, ManifestEntry, TreeNode, TreeRequest
 from enum import Enum
-from dataclasses import dataclass
+from client.concurrency import AdaptiveLimiter
+from client.storage import get_config_dc
+from client.throttle import Throttle
+from dataclasses import dataclass, field
+from shared.bulk import encode_header
+from shared.compression import CompressingReader, new_compressor, worth_compressing
+from shared.delta import DeltaNotWorthIt, write_delta
+from shared.hashing import HashingReader, get_hash_engine
+
+try:
+    import h2 # noqa: F401 - HTTP/2 is only used when the optional h2 package is installed
+    http2 = True
+except ImportError:
+    http2 = False
 
 timeout = httpx.Timeout(240.0, connect=5)
-client = httpx.AsyncClient(timeout=timeout)
+# Connection limits are read once at startup, the upload limits again for every sync (set_upload_limits).
+startup_concurrency = get_config_dc().get().concurrency
+# One shared client so connections are kept alive and reused across uploads and syncs.
+client = httpx.AsyncClient(timeout=timeout, http2=http2, limits=httpx.Limits(
+    max_connections=startup_concurrency.max_connections,
+    max_keepalive_connections=startup_concurrency.max_keepalive if startup_concurrency.max_keepalive is not None else startup_concurrency.max_uploads))
 files_endpoint = 'files'
+# Directories per tree request.
+TREE_BATCH = 500
+# Moves (or materialized files) per request.
+MOVE_BATCH = 1000
+# Hashes per have request.
+HAVE_BATCH = 5000
+# Files per delete request, and delete requests at a time.
+DELETE_BATCH = 5000
+DELETE_PARALLEL = 4
+# Deltas computed (and sent while they're computed) at a time.
+DELTA_ENCODERS = 2
+# A delta is handed from its encoder to the request in pieces of this size, with this many waiting at most.
+DELTA_PIECE_SIZE = 256 * 1024
+DELTA_PIECES = 4
+# Upload bodies are sent in pieces this big while a bandwidth limit applies, for an even rate.
+THROTTLED_CHUNK = 64 * 1024
+
+limiter = AdaptiveLimiter(startup_concurrency.min_uploads, startup_concurrency.max_uploads, startup_concurrency.initial_uploads)
+delta_encoders = asyncio.Semaphore(DELTA_ENCODERS)
 
-MAX_CONCURRENT_UPLOADS = 3
-semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+def set_upload_limits(concurrency: Concurrency):
+    if (limiter.minimum, limiter.maximum) != (concurrency.min_uploads, concurrency.max_uploads):
+        limiter.set_bounds(concurrency.min_uploads, concurrency.max_uploads, concurrency.initial_uploads)
 
 class UploadResultEnum(Enum):
     SUCCESS = "Success"
@@ -24,45 +66,531 @@ class UploadResultEnum(Enum):
 class UploadResult():
     result: UploadResultEnum
     relative_path: str
+    logical_bytes: int = 0 # size of the file
+    wire_bytes: int = 0 # what was actually sent after compression / delta encoding
+    hash: str = "" # of a file that only got hashed while it was uploaded
 
-async def upload_file(relative_path: str, local_full_path: str, target_url: str, queue: asyncio.Queue[UploadResult]):
-    async with semaphore:
-        with open(local_full_path, 'rb') as f:
-            files = {'file': (relative_path, f, 'application/octet-stream')}
-            try:
-                response = await client.post(target_url, files=files)
+@dataclass
+class UploadOptions():
+    delta_files: Dict[str, File] = field(default_factory=dict) # changed files worth sending as a block delta
+    delta_block_size: int = 0
+    delta_max_literal_ratio: float = 1.0
+    encoding: Optional[str] = None # negotiated compression, None sends files as-is
+    compression: Compression = field(default_factory=Compression)
+    bulk: Optional[Bulk] = None # None when the server can't take bulk uploads
+    chunked: Optional[Chunked] = None # None when the server can't take resumable uploads
+    files: Dict[str, File] = field(default_factory=dict) # entries of the files to upload, for their hashes
+    stream: bool = False # the server takes raw PUT uploads, checked against the hash and given the mtime
+    algorithm: str = "" # files that weren't hashed yet are hashed with it while they're sent
+    throttle: Optional[Throttle] = None # bandwidth limits for the upload bodies, also measures their throughput
+
+def content_params(local_file: Optional[File]) -> dict:
+    """What the server checks the received content against. The mtime only goes along with the hash,
+    so a file that changed since it was hashed doesn't end up with the old mtime."""
+    if local_file is None or not local_file.md5:
+        return {}
+    return {"hash": local_file.md5, "algorithm": local_file.hash_algorithm, "mtime_ns": local_file.mtime_ns}
+
+async def upload_file(relative_path: str, local_full_path: str, target_url: str, queue: asyncio.Queue[UploadResult],
+                      options: UploadOptions = UploadOptions()):
+    async with limiter.slot() as slot:
+        try:
+            with open(local_full_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                local_file = options.files.get(relative_path)
+                # Not hashed yet (see hashing.lazy): hashed on the way, the server answers with its own hash to compare.
+                reader = HashingReader(f, options.algorithm) if options.stream and options.algorithm and local_file and not local_file.md5 else None
+                encoding = options.encoding if options.encoding and worth_compressing(local_full_path, size, options.compression) else None
+                body = CompressingReader(reader or f, encoding, options.compression.level) if encoding else reader or f
+                params = {"encoding": encoding} if encoding else {}
+                if options.stream:
+                    params.update(path=relative_path, **content_params(local_file))
+                    if reader:
+                        params.update(algorithm=options.algorithm, mtime_ns=local_file.mtime_ns)
+                    response = await client.put(target_url, params=params, content=read_chunks(body, throttle=options.throttle))
+                else:
+                    # Older servers only take multipart uploads, which httpx reads on its own (not throttled).
+                    files = {'file': (relative_path, body, 'application/octet-stream')}
+                    response = await client.post(target_url, files=files, params=params)
                 print(f"Got response: {response.status_code}")
-                if response.status_code == 200:
-                    await queue.put(UploadResult(UploadResultEnum.SUCCESS, relative_path))
+                if response.status_code == 200 and reader and response.json().get("hash") != reader.hexdigest():
+                    print(f"{relative_path} arrived with another hash than it was sent with")
+                    slot.failure()
+                    await queue.put(UploadResult(UploadResultEnum.FAILURE, relative_path))
+                elif response.status_code == 200:
+                    wire_bytes = body.wire_bytes if encoding else size
+                    slot.success(wire_bytes)
+                    await queue.put(UploadResult(UploadResultEnum.SUCCESS, relative_path, size, wire_bytes,
+                                                 reader.hexdigest() if reader else ""))
                 else:
+                    slot.failure()
                     await queue.put(UploadResult(UploadResultEnum.FAILURE, relative_path))
-            except httpx.HTTPStatusError as e:
-                print(f"Failed to upload {relative_path}: {e}")
+        except httpx.HTTPError as e:
+            print(f"Failed to upload {relative_path}: {e}")
+            slot.failure()
+            await queue.put(UploadResult(UploadResultEnum.ERROR, relative_path))
+        except OSError as e:
+            # Gone or unreadable since the scan, nothing the connection is to blame for.
+            print(f"Failed to read {relative_path}: {e}")
+            await queue.put(UploadResult(UploadResultEnum.ERROR, relative_path))
+
+async def get_signatures(target_address: str, name: str, relative_path: str, block_size: int) -> Optional[Signatures]:
+    url = build_base_url(target_address=target_address, path=f"files/{name}/signatures")
+    r = await client.get(url, params={"path": relative_path, "block_size": block_size})
+    if r.status_code == 404:
+        return None
+    r.raise_for_status()
+    return Signatures.model_validate(r.json())
+
+class DeltaStream():
+    """`out` for write_delta on a worker thread, its output is handed to the event loop in pieces and sent
+    as it comes (`chunks()`). Once the sending side stopped, further writes raise BrokenPipeError."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.size = 0 # bytes sent
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue(DELTA_PIECES)
+        self._buffer = bytearray()
+        self._stopped = False
+
+    def write(self, data: bytes):
+        self._buffer += data
+        if len(self._buffer) >= DELTA_PIECE_SIZE:
+            self._hand_over(bytes(self._buffer))
+            self._buffer.clear()
+
+    def encode(self, *args, **kwargs) -> int:
+        """Runs write_delta(..., out=self, ...) on the calling thread, the stream ends with it."""
+        try:
+            literal_bytes = write_delta(*args, out=self, **kwargs)
+            if self._buffer:
+                self._hand_over(bytes(self._buffer))
+            self._hand_over(None)
+            return literal_bytes
+        except Exception as e:
+            if not self._stopped:
+                self._hand_over(e)
+            raise
+
+    def _hand_over(self, item):
+        if self._stopped:
+            raise BrokenPipeError("Delta upload stopped")
+        asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop).result()
+
+    def stop(self):
+        """Lets the encoder run into BrokenPipeError, should it still be writing."""
+        self._stopped = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    async def chunks(self, throttle: Optional[Throttle] = None):
+        try:
+            while (item := await self._queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                if throttle:
+                    await throttle.acquire(len(item))
+                self.size += len(item)
+                yield item
+        finally:
+            self.stop()
+
+def link_rate(throttle: Optional[Throttle]) -> float:
+    """About the bytes per second a file is sent at, 0 when that isn't known yet."""
+    rates = [rate for rate in (limiter.throughput(), throttle.limit() if throttle else 0) if rate]
+    return min(rates, default=0)
+
+async def upload_delta(relative_path: str, local_full_path: str, local_file: File, target_address: str, name: str,
+                       block_size: int, max_literal_ratio: float = 1.0, throttle: Optional[Throttle] = None) -> Optional[int]:
+    """Sends only the blocks the server doesn't already have, while they're being worked out.
+
+    Returns the number of bytes sent, None if a full upload is needed instead. That's also the
+    case when encoding is slower than the link: the file is sent whole instead.
+    """
+    try:
+        async with delta_encoders:
+            signatures = await get_signatures(target_address, name, relative_path, block_size)
+            if signatures is None:
+                return None
+            stream = DeltaStream(asyncio.get_running_loop())
+            encoder = asyncio.create_task(asyncio.to_thread(
+                stream.encode, local_full_path, signatures.blocks, block_size,
+                max_literal_ratio=max_literal_ratio, min_rate=link_rate(throttle)))
+            url = build_base_url(target_address=target_address, path=f"files/{name}/delta")
+            params = {"path": relative_path, "block_size": block_size, **content_params(local_file)}
+            try:
+                async with limiter.slot() as slot:
+                    try:
+                        response = await client.post(url, params=params, content=stream.chunks(throttle))
+                    except DeltaNotWorthIt:
+                        # The encoder gave up (re-raised below), nothing the connection is to blame for.
+                        response = None
+                    if response is not None and response.status_code == 200:
+                        slot.success(stream.size)
+            finally:
+                stream.stop()
+                # Raises what the encoder ran into (also what made the request fail).
+                literal_bytes = await encoder
+        print(f"Delta for {relative_path}: {literal_bytes} literal bytes, {stream.size} bytes sent for {local_file.size} bytes file")
+        return stream.size if response.status_code == 200 else None
+    except DeltaNotWorthIt as e:
+        print(f"Sending {relative_path} whole, {e}")
+        return None
+    except OSError as e:
+        # The full upload reports it, should the file still be unreadable.
+        print(f"Delta of {relative_path} failed, falling back to full upload: {e}")
+        return None
+    except httpx.HTTPError as e:
+        print(f"Delta upload of {relative_path} failed, falling back to full upload: {e}")
+        return None
+
+def read_range(local_full_path: str, offset: int, length: int) -> bytes:
+    with open(local_full_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+async def upload_chunked(relative_path: str, local_full_path: str, queue: asyncio.Queue[UploadResult], target_address: str,
+                         name: str, options: UploadOptions):
+    """Resumable upload in chunks, several at a time. Whatever the server already received in an
+    earlier attempt (same path and content) isn't sent again."""
+    local_file = options.files[relative_path]
+    chunked = options.chunked
+    sessions_url = build_base_url(target_address=target_address, path=f"files/{name}/sessions")
+    request = UploadSessionCreate(path=relative_path, size=local_file.size, hash=local_file.md5,
+                                  hash_algorithm=local_file.hash_algorithm, chunk_size=chunked.chunk_size)
+    wire_bytes = 0
+    try:
+        r = await client.post(sessions_url, json=request.model_dump())
+        r.raise_for_status()
+        session = UploadSession.model_validate(r.json())
+        session_url = f"{sessions_url}/{session.id}"
+        received = set(session.received)
+        missing = [index for index in range(session.chunk_count()) if index not in received]
+        if session.received:
+            print(f"Resuming upload of {relative_path}, {len(missing)}/{session.chunk_count()} chunks left")
+        parallel = asyncio.Semaphore(chunked.parallel_chunks)
+
+        async def send_chunk(index: int):
+            nonlocal wire_bytes
+            async with parallel:
+                for attempt in range(chunked.retries + 1):
+                    async with limiter.slot() as slot:
+                        data = await asyncio.to_thread(read_range, local_full_path, index * session.chunk_size, session.chunk_length(index))
+                        try:
+                            response = await client.put(f"{session_url}/chunks/{index}", content=read_chunks(io.BytesIO(data), throttle=options.throttle))
+                            response.raise_for_status()
+                            slot.success(len(data))
+                            wire_bytes += len(data)
+                            return
+                        except httpx.HTTPError as e:
+                            slot.failure()
+                            if attempt == chunked.retries:
+                                raise
+                            print(f"Chunk {index} of {relative_path} failed, retrying: {e}")
+
+        chunk_tasks = [asyncio.create_task(send_chunk(index)) for index in missing]
+        try:
+            await asyncio.gather(*chunk_tasks)
+        except BaseException:
+            for task in chunk_tasks:
+                task.cancel()
+            raise
+        r = await client.post(f"{session_url}/commit", params={"mtime_ns": local_file.mtime_ns}, timeout=httpx.Timeout(None, connect=5))
+        r.raise_for_status()
+        await queue.put(UploadResult(UploadResultEnum.SUCCESS, relative_path, local_file.size, wire_bytes))
+    except Exception as e:
+        # HTTP errors, or the file couldn't be read. The chunks that made it stay on the server for the next sync.
+        print(f"Chunked upload of {relative_path} failed: {e}")
+        await queue.put(UploadResult(UploadResultEnum.ERROR, relative_path))
+
+async def upload_whole_file(relative_path: str, local_full_path: str, target_url: str, queue: asyncio.Queue[UploadResult],
+                            target_address: str, name: str, options: UploadOptions):
+    local_file = options.files.get(relative_path)
+    if options.chunked and local_file and local_file.md5 and local_file.size >= options.chunked.min_file_size:
+        await upload_chunked(relative_path, local_full_path, queue, target_address, name, options)
+    else:
+        await upload_file(relative_path, local_full_path, target_url, queue, options)
 
-async def upload_all_files(base_path: str, files_to_copy: set[str], target_address: str, name: str, queue: asyncio.Queue[UploadResult]):
+async def upload_changed_file(relative_path: str, local_full_path: str, target_url: str, queue: asyncio.Queue[UploadResult],
+                              target_address: str, name: str, options: UploadOptions):
+    local_file = options.delta_files[relative_path]
+    sent = await upload_delta(relative_path, local_full_path, local_file, target_address, name, options.delta_block_size,
+                              options.delta_max_literal_ratio, options.throttle)
+    if sent is not None:
+        await queue.put(UploadResult(UploadResultEnum.SUCCESS, relative_path, local_file.size, sent))
+        return
+    await upload_whole_file(relative_path, local_full_path, target_url, queue, target_address, name, options)
+
+async def upload_bulk(base_path: str, relative_paths: List[str], target_url: str, queue: asyncio.Queue[UploadResult],
+                      options: UploadOptions):
+    """Packs many small files into one request, the server answers with a result line per file."""
+    async with limiter.slot() as slot:
+        sizes: Dict[str, int] = {}
+        hashes: Dict[str, str] = {}
+        wire_bytes = 0
+        compressor = new_compressor(options.encoding, options.compression.level) if options.encoding else None
+
+        def read_frame(relative_path: str) -> Optional[bytes]:
+            try:
+                with open(os.path.join(base_path, relative_path), 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                print(f"Failed to read {relative_path}: {e}")
+                return None
+            sizes[relative_path] = len(data)
+            local_file = options.files.get(relative_path)
+            if options.algorithm and local_file and not local_file.md5:
+                # Not hashed yet (see hashing.lazy), the whole file is at hand anyway.
+                hasher = get_hash_engine(options.algorithm).new()
+                hasher.update(data)
+                hashes[relative_path] = hasher.hexdigest()
+                local_file = local_file.model_copy(update={"md5": hashes[relative_path], "hash_algorithm": options.algorithm})
+            frame = encode_header(relative_path, len(data), **content_params(local_file)) + data
+            return compressor.compress(frame) if compressor else frame
+
+        async def body():
+            nonlocal wire_bytes
+            for relative_path in relative_paths:
+                # Reading, hashing and compressing stay off the event loop, one frame after the other.
+                frame = await asyncio.to_thread(read_frame, relative_path)
+                if frame is None:
+                    continue
+                wire_bytes += len(frame)
+                if options.throttle:
+                    await options.throttle.acquire(len(frame))
+                yield frame
+            if compressor:
+                frame = await asyncio.to_thread(compressor.flush)
+                wire_bytes += len(frame)
+                if options.throttle:
+                    await options.throttle.acquire(len(frame))
+                yield frame
+
+        reported = set()
+        params = {"encoding": options.encoding} if options.encoding else {}
+        try:
+            async with client.stream("POST", target_url, params=params, content=body()) as response:
+                response.raise_for_status()
+                # The whole body has been sent by now, so the compression ratio is known.
+                slot.success(wire_bytes)
+                ratio = wire_bytes / max(1, sum(sizes.values()))
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    result = BulkResult.model_validate_json(line)
+                    reported.add(result.path)
+                    size = sizes.get(result.path, 0)
+                    status = UploadResultEnum.SUCCESS if result.success else UploadResultEnum.FAILURE
+                    await queue.put(UploadResult(status, result.path, size, int(size * ratio), hashes.get(result.path, "")))
+        except httpx.HTTPError as e:
+            print(f"Bulk upload of {len(relative_paths)} files failed: {e}")
+            slot.failure()
+        for relative_path in relative_paths:
+            if relative_path not in reported:
+                await queue.put(UploadResult(UploadResultEnum.FAILURE, relative_path))
+
+def make_bulk_batches(base_path: str, relative_paths: Iterable[str], bulk: Bulk) -> List[List[str]]:
+    batches = []
+    batch, batch_bytes = [], 0
+    for relative_path in relative_paths:
+        try:
+            size = os.stat(os.path.join(base_path, relative_path)).st_size
+        except OSError:
+            continue
+        if size > bulk.max_file_size:
+            continue
+        if batch and (len(batch) >= bulk.max_files or batch_bytes + size > bulk.max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(relative_path)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def read_chunks(file: BinaryIO, chunk_size: int = 1024 * 1024, throttle: Optional[Throttle] = None):
+    if throttle and throttle.limited():
+        chunk_size = min(chunk_size, THROTTLED_CHUNK)
+    while chunk := file.read(chunk_size):
+        if throttle:
+            await throttle.acquire(len(chunk))
+        yield chunk
+
+async def upload_all_files(base_path: str, files_to_copy: set[str], target_address: str, name: str, queue: asyncio.Queue[UploadResult],
+                           options: UploadOptions = UploadOptions()):
     target_url = build_base_url(target_address=target_address, path=f"files/{name}/upload")
-    tasks = [
-        upload_file(relative_path, os.path.join(base_path, relative_path), target_url, queue)
-        for relative_path in files_to_copy
-    ]
+    bulk_url = build_base_url(target_address=target_address, path=f"files/{name}/bulk")
+    bulk_batches = make_bulk_batches(base_path, (path for path in files_to_copy if path not in options.delta_files), options.bulk) \
+        if options.bulk else []
+    in_bulk = {relative_path for batch in bulk_batches for relative_path in batch}
+    tasks = [upload_bulk(base_path, batch, bulk_url, queue, options) for batch in bulk_batches]
+    tasks.extend(
+        upload_changed_file(relative_path, os.path.join(base_path, relative_path), target_url, queue, target_address, name, options)
+        if relative_path in options.delta_files else
+        upload_whole_file(relative_path, os.path.join(base_path, relative_path), target_url, queue, target_address, name, options)
+        for relative_path in files_to_copy if relative_path not in in_bulk
+    )
     await asyncio.gather(*tasks)
 
-async def delete_all_files(base_path: str, old_files_to_delete: set[str], target_address: str, name: str):
-    target_url = build_base_url(target_address=target_address, path=f"files/{name}/delete")
-    delete_body = Delete(files_to_delete=list(old_files_to_delete))
+async def move_files(target_address: str, name: str, moves: List[Move]) -> List[MoveResult]:
+    """Moves files that are already on the server, a failed move comes back with success=False."""
+    url = build_base_url(target_address=target_address, path=f"files/{name}/move")
+    results = []
+    for start in range(0, len(moves), MOVE_BATCH):
+        batch = moves[start:start + MOVE_BATCH]
+        try:
+            r = await client.post(url, json=Moves(moves=batch).model_dump())
+            r.raise_for_status()
+            results.extend(MoveResult.model_validate(result) for result in r.json())
+        except httpx.HTTPError as e:
+            print(f"Failed to move files: {e}")
+            results.extend(MoveResult(source=move.source, destination=move.destination, success=False, error=str(e)) for move in batch)
+    return results
+
+async def have_hashes(target_address: str, hash_algorithm: str, hashes: List[str]) -> Set[str]:
+    url = build_base_url(target_address=target_address, path="have")
+    found = set()
+    for start in range(0, len(hashes), HAVE_BATCH):
+        r = await client.post(url, json=Have(hash_algorithm=hash_algorithm, hashes=hashes[start:start + HAVE_BATCH]).model_dump())
+        r.raise_for_status()
+        found.update(r.json())
+    return found
+
+async def materialize_files(target_address: str, name: str, entries: List[Materialize]) -> List[MaterializeResult]:
+    url = build_base_url(target_address=target_address, path=f"files/{name}/materialize")
+    results = []
+    for start in range(0, len(entries), MOVE_BATCH):
+        batch = entries[start:start + MOVE_BATCH]
+        try:
+            r = await client.post(url, json=MaterializeRequest(files=batch).model_dump(), timeout=httpx.Timeout(500.0, connect=5))
+            r.raise_for_status()
+            results.extend(MaterializeResult.model_validate(result) for result in r.json())
+        except httpx.HTTPError as e:
+            print(f"Failed to materialize files: {e}")
+            results.extend(MaterializeResult(path=entry.path, success=False, error=str(e)) for entry in batch)
+    return results
+
+def _materialize_entry(relative_path: str, file: File, source: Optional[str] = None) -> Materialize:
+    return Materialize(path=relative_path, hash=file.md5, hash_algorithm=file.hash_algorithm, size=file.size, source=source)
+
+async def deduplicate_uploads(target_address: str, name: str, files: Dict[str, File], min_file_size: int) -> Tuple[Set[str], Dict[str, str], int]:
+    """Before uploading `files`: has the server create the ones whose content it already has, and picks a
+    single path to upload for content that appears several times.
+
+    Returns the paths done on the server, the duplicates to materialize from their uploaded
+    twin (path -> uploaded path, see materialize_duplicates) and the bytes that won't be sent.
+    """
+    by_content: Dict[Tuple[str, str, int], List[str]] = {}
+    for relative_path, file in sorted(files.items()):
+        if file.size >= min_file_size and file.md5:
+            by_content.setdefault((file.hash_algorithm, file.md5, file.size), []).append(relative_path)
+    present: Set[Tuple[str, str]] = set()
+    for hash_algorithm in {key[0] for key in by_content}:
+        hashes = [key[1] for key in by_content if key[0] == hash_algorithm]
+        present.update((hash_algorithm, digest) for digest in await have_hashes(target_address, hash_algorithm, hashes))
+
+    entries = [_materialize_entry(relative_path, files[relative_path])
+               for key, paths in by_content.items() if key[:2] in present for relative_path in paths]
+    done = {result.path for result in await materialize_files(target_address, name, entries) if result.success}
+    duplicates = {}
+    for key, paths in by_content.items():
+        remaining = [relative_path for relative_path in paths if relative_path not in done]
+        duplicates.update((relative_path, remaining[0]) for relative_path in remaining[1:])
+    saved = sum(files[relative_path].size for relative_path in done | duplicates.keys())
+    return done, duplicates, saved
+
+async def materialize_duplicates(target_address: str, name: str, files: Dict[str, File], duplicates: Dict[str, str]) -> Set[str]:
+    """After the upload: creates the duplicates from their uploaded twins, returns the ones that still need an upload."""
+    entries = [_materialize_entry(relative_path, files[relative_path], source) for relative_path, source in duplicates.items()]
+    return {result.path for result in await materialize_files(target_address, name, entries) if not result.success}
+
+async def delete_batch(target_url: str, relative_paths: List[str]) -> Set[str]:
+    """Returns the paths the server failed to delete."""
     try:
-        r = await client.post(target_url, json=delete_body.model_dump())
-        print(f"Got response: {r.status_code}")
-    except httpx.HTTPStatusError as e:
-        print(f"Failed to delete files: {e}")
+        async with client.stream("POST", target_url, json=Delete(files_to_delete=relative_paths).model_dump()) as response:
+            response.raise_for_status()
+            if not response.headers.get("content-type", "").startswith("application/x-ndjson"):
+                return set() # older servers only answer with a message
+            deleted = set()
+            async for line in response.aiter_lines():
+                if line:
+                    result = DeleteResult.model_validate_json(line)
+                    if result.success:
+                        deleted.add(result.path)
+                    else:
+                        print(f"Failed to delete {result.path}: {result.error}")
+            return set(relative_paths) - deleted
+    except httpx.HTTPError as e:
+        print(f"Failed to delete {len(relative_paths)} files: {e}")
+        return set(relative_paths)
+
+async def delete_all_files(base_path: str, old_files_to_delete: set[str], target_address: str, name: str) -> Set[str]:
+    """Deletes in batches of DELETE_BATCH files, DELETE_PARALLEL requests at a time. Returns the paths that weren't deleted."""
+    target_url = build_base_url(target_address=target_address, path=f"files/{name}/delete")
+    paths = sorted(old_files_to_delete)
+    parallel = asyncio.Semaphore(DELETE_PARALLEL)
+
+    async def send(batch: List[str]) -> Set[str]:
+        async with parallel:
+            return await delete_batch(target_url, batch)
+
+    failed = await asyncio.gather(*(send(paths[i:i + DELETE_BATCH]) for i in range(0, len(paths), DELETE_BATCH)))
+    print(f"Deleted {len(paths) - sum(map(len, failed))}/{len(paths)} files from {name}")
+    return set().union(*failed)
 
-async def get_target_files_state(target_address: str, name: str) -> Folder:
+async def get_capabilities(target_address: str) -> Capabilities:
+    url = build_base_url(target_address=target_address, path="capabilities")
+    r = await client.get(url)
+    if r.status_code == 404:
+        return Capabilities()
+    r.raise_for_status()
+    return Capabilities.model_validate(r.json())
+
+async def iter_target_manifest(target_address: str, name: str, algorithm: str, page_size: int = 10000) -> AsyncIterator[Tuple[str, File]]:
+    """Yields the server's files sorted by path, page by page, as the NDJSON lines arrive."""
+    url = build_base_url(target_address=target_address, path=f"files/{name}/manifest")
+    t = httpx.Timeout(500.0, connect=5)
+    params = {"algorithm": algorithm, "limit": page_size}
+    while True:
+        async with client.stream("GET", url, params=params, timeout=t) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if line:
+                    entry = ManifestEntry.model_validate_json(line)
+                    yield entry.path, entry.file
+            cursor = r.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return
+        params["cursor"] = urllib.parse.unquote(cursor)
+
+async def get_target_files_state(target_address: str, name: str, algorithm: str) -> Folder:
     url = build_base_url(target_address=target_address, path=f"files/{name}")
     t = httpx.Timeout(500.0, connect=5)
-    r = await client.get(url, timeout=t)
+    r = await client.get(url, params={"algorithm": algorithm}, timeout=t)
     r.raise_for_status()
     print(f"Got response: {r.status_code}")
     return Folder.model_validate(r.json())
 
+async def iter_target_files(target_address: str, name: str, algorithm: str, use_manifest: bool = False) -> AsyncIterator[Tuple[str, File]]:
+    """The server's files sorted by path, streamed when it serves a manifest."""
+    if use_manifest:
+        async for entry in iter_target_manifest(target_address, name, algorithm):
+            yield entry
+        return
+    folder = await get_target_files_state(target_address, name, algorithm)
+    for entry in sorted(folder.files.items()):
+        yield entry
+
+async def get_tree_nodes(target_address: str, name: str, algorithm: str, paths: List[str], refresh: bool = False) -> List[TreeNode]:
+    url = build_base_url(target_address=target_address, path=f"files/{name}/tree")
+    t = httpx.Timeout(500.0, connect=5)
+    nodes = []
+    for start in range(0, len(paths), TREE_BATCH):
+        r = await client.post(url, params={"algorithm": algorithm, "refresh": refresh},
+                              json=TreeRequest(paths=paths[start:start + TREE_BATCH]).model_dump(), timeout=t)
+        r.raise_for_status()
+        nodes.extend(TreeNode.model_validate(node) for node in r.json())
+    return nodes
+
 def build_base_url(target_address: str, path: str):
     return urllib.parse.urljoin(f"http://{target_address}/", path)
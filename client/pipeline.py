@@ -0,0 +1,145 @@
+"""Uploading while the local scan is still hashing.
+
+The scan thread hands over every file it had to hash, as soon as it's hashed. Those are
+collected into batches, looked up on the target (the tree nodes of their directories) and the
+ones that differ are uploaded right away, while hashing goes on. When uploads fall behind,
+the scan waits for them. Whatever the pipeline didn't take care of is left to the diff that
+runs once the scan is done.
+
+With `hashing.lazy`, files aren't even hashed when the server's copy already tells: one of a
+different size has changed, one with the same size and mtime is taken to be the same (the
+server keeps the mtime of what it receives). Files only get hashed up front when the size
+matches but the mtime doesn't, the others are hashed while they're uploaded.
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from models.data import File
+from models.protocol import TreeNode
+
+# Hashed files per batch, a batch is handed over earlier once its files add up to BATCH_BYTES.
+BATCH_FILES = 256
+BATCH_BYTES = 64 * 1024 * 1024
+# Batches waiting to be uploaded before the scan is held up.
+MAX_PENDING_BATCHES = 2
+
+class RemoteFiles():
+    """The target's entries of single files, from the tree nodes of their directories (each fetched once)."""
+
+    def __init__(self, fetch_nodes: Callable[[List[str]], Awaitable[List[TreeNode]]]) -> None:
+        self.fetch_nodes = fetch_nodes
+        self._directories: Dict[str, Dict[str, File]] = {} # directory -> its files on the target
+
+    async def get(self, relative_paths: Iterable[str]) -> Dict[str, Optional[File]]:
+        relative_paths = list(relative_paths)
+        directories = sorted({os.path.dirname(path) for path in relative_paths} - self._directories.keys())
+        if directories:
+            for node in await self.fetch_nodes(directories):
+                self._directories[node.path] = node.files
+        return {path: self._directories.get(os.path.dirname(path), {}).get(os.path.basename(path)) for path in relative_paths}
+
+def lazy_hashing(remote: RemoteFiles, algorithm: str, always_hash_from: int) -> Callable[[Dict[str, File]], Dict[str, File]]:
+    """FileHandler's `skip_hashing` for hashing.lazy, must be created on the event loop. Files of at
+    least `always_hash_from` bytes are hashed anyway (e.g. for resumable uploads, which need the hash up front)."""
+    loop = asyncio.get_running_loop()
+
+    def skip_hashing(files: Dict[str, File]) -> Dict[str, File]:
+        candidates = {path: file for path, file in files.items() if file.size < always_hash_from}
+        # Runs on the scan thread.
+        entries = asyncio.run_coroutine_threadsafe(remote.get(candidates), loop).result() if candidates else {}
+        skipped = {}
+        for path, file in candidates.items():
+            entry = entries[path]
+            if entry is None or entry.size != file.size:
+                skipped[path] = file # is sent anyway
+            elif entry.mtime_ns == file.mtime_ns and entry.md5 and entry.hash_algorithm == algorithm:
+                skipped[path] = file.model_copy(update={"md5": entry.md5, "hash_algorithm": entry.hash_algorithm})
+        print(f"Lazy hashing: {sum(not file.md5 for file in skipped.values())} files hashed while sent, "
+              f"{sum(bool(file.md5) for file in skipped.values())} taken from the server, {len(files) - len(skipped)} to hash")
+        return skipped
+
+    return skip_hashing
+
+class UploadPipeline():
+    """`remote` has the target's entries, `send` uploads files (all of the given entries, the second
+    argument are the ones that exist on the target with other content) and returns the hashes of
+    those it hashed on the way.
+
+    A new file may be the new path of a renamed one, which only the diff after the scan can tell
+    (it pairs renames up and moves them on the server). New files are therefore left to the diff,
+    unless `have` (which of the hashes the server has content for, None when it can't tell) says
+    the server doesn't have their content: then they can't be a rename of anything there. New
+    files that aren't hashed (see hashing.lazy) can't be paired up anyway and are always sent.
+    """
+
+    def __init__(self, remote: RemoteFiles, send: Callable[[Dict[str, File], Set[str]], Awaitable[Dict[str, str]]],
+                 have: Optional[Callable[[List[str]], Awaitable[Set[str]]]] = None) -> None:
+        self.remote = remote
+        self.send = send
+        self.have = have
+        self.sent: Set[str] = set()
+        self.hashes: Dict[str, str] = {} # of the files that were hashed while they were sent
+        self._loop = asyncio.get_running_loop()
+        self._batches: asyncio.Queue[Optional[Dict[str, File]]] = asyncio.Queue(MAX_PENDING_BATCHES)
+        self._batch: Dict[str, File] = {}
+        self._batch_bytes = 0
+        self._stopped = False
+
+    def offer(self, relative_path: str, file: File):
+        """Called on the scan thread, blocks while MAX_PENDING_BATCHES batches wait for their upload."""
+        if self._stopped:
+            return
+        self._batch[relative_path] = file
+        self._batch_bytes += file.size
+        if len(self._batch) >= BATCH_FILES or self._batch_bytes >= BATCH_BYTES:
+            self._hand_over(self._batch)
+            self._batch, self._batch_bytes = {}, 0
+
+    def close(self):
+        """Called on the scan thread once it's done."""
+        if self._batch:
+            self._hand_over(self._batch)
+            self._batch, self._batch_bytes = {}, 0
+        self._hand_over(None)
+
+    def _hand_over(self, batch: Optional[Dict[str, File]]):
+        if not self._stopped:
+            asyncio.run_coroutine_threadsafe(self._batches.put(batch), self._loop).result()
+
+    async def run(self):
+        """Uploads the batches until the scan is done."""
+        try:
+            while (batch := await self._batches.get()) is not None:
+                try:
+                    changed, new = await self._classify(batch)
+                    to_send = changed | await self._unknown_content(batch, new)
+                    if to_send:
+                        self.hashes.update(await self.send({path: batch[path] for path in to_send}, changed))
+                        self.sent |= to_send
+                except Exception as e:
+                    # Left to the diff after the scan.
+                    print(f"Early upload of {len(batch)} files failed: {e}")
+        finally:
+            # Unblocks the scan thread if this stops early.
+            self._stopped = True
+            while not self._batches.empty():
+                self._batches.get_nowait()
+
+    async def _unknown_content(self, batch: Dict[str, File], new: Set[str]) -> Set[str]:
+        """The new files whose content the server doesn't have."""
+        unhashed = {path for path in new if not batch[path].md5}
+        hashed = new - unhashed
+        if not hashed or self.have is None:
+            return unhashed
+        known = await self.have(sorted({batch[path].md5 for path in hashed}))
+        return unhashed | {path for path in hashed if batch[path].md5 not in known}
+
+    async def _classify(self, batch: Dict[str, File]) -> Tuple[Set[str], Set[str]]:
+        """Splits the batch into files the target has with other content and files it doesn't have."""
+        changed, new = set(), set()
+        for path, remote in (await self.remote.get(batch)).items():
+            if remote is None:
+                new.add(path)
+            elif not batch[path].same_content(remote):
+                changed.add(path)
+        return changed, new
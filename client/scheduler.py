@@ -0,0 +1,94 @@
+"""Folder syncs from a single queue, within budgets shared by all folders.
+
+Hashing already runs on the one worker pool of the client's FileHandler (`concurrency.max_workers`)
+and uploads share one adaptive limiter (`concurrency.max_uploads`). On top of that at most
+`concurrency.max_syncs` folders sync at once and at most `concurrency.max_scans` of them read
+their files for hashing at the same time. Waiting folders start by priority, then those whose
+last sync had the fewest bytes to send, then in the order they were queued.
+"""
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+from models.config import Concurrency, TrackingFolder
+
+QUEUED = "Queued"
+WAITING_TO_SCAN = "Waiting to scan"
+SCANNING = "Scanning"
+SYNCING = "Syncing"
+
+@dataclass
+class QueuedSync():
+    folder: TrackingFolder
+    queued: float
+    state: str = QUEUED
+
+class SyncScheduler():
+    """`run_sync` syncs a folder, it takes its scan_slot() for the part that reads the folder.
+    `on_change` is called whenever a sync is queued, changes state or is done."""
+
+    def __init__(self, run_sync: Callable[[TrackingFolder], Awaitable[None]], concurrency: Concurrency,
+                 on_change: Callable[[], None] = lambda: None) -> None:
+        self.run_sync = run_sync
+        self.on_change = on_change
+        self.max_syncs = concurrency.max_syncs
+        self._scans = asyncio.Semaphore(concurrency.max_scans)
+        self._queued: List[QueuedSync] = []
+        self._running: Dict[str, QueuedSync] = {} # by folder uuid
+        self._last_bytes: Dict[str, int] = {} # bytes the folder's last sync had to send, by folder uuid
+
+    def submit(self, folder: TrackingFolder) -> bool:
+        """Queues a sync of the folder, unless it's queued or running already."""
+        if folder.uuid in self._running or any(entry.folder.uuid == folder.uuid for entry in self._queued):
+            return False
+        self._queued.append(QueuedSync(folder=folder, queued=time.time()))
+        self._start_next()
+        self.on_change()
+        return True
+
+    def record_bytes(self, folder: TrackingFolder, pending_bytes: int):
+        self._last_bytes[folder.uuid] = pending_bytes
+
+    def entries(self) -> List[QueuedSync]:
+        """Running syncs, then the queued ones in the order they'll start."""
+        return list(self._running.values()) + sorted(self._queued, key=self._order)
+
+    @asynccontextmanager
+    async def scan_slot(self, folder: TrackingFolder):
+        entry = self._running.get(folder.uuid)
+        self._set_state(entry, WAITING_TO_SCAN)
+        async with self._scans:
+            self._set_state(entry, SCANNING)
+            try:
+                yield
+            finally:
+                self._set_state(entry, SYNCING)
+
+    def _order(self, entry: QueuedSync):
+        # Folders never synced go after the known ones of the same priority.
+        return (-entry.folder.priority, self._last_bytes.get(entry.folder.uuid, math.inf), entry.queued)
+
+    def _set_state(self, entry: Optional[QueuedSync], state: str):
+        if entry:
+            entry.state = state
+            self.on_change()
+
+    def _start_next(self):
+        while self._queued and len(self._running) < self.max_syncs:
+            entry = min(self._queued, key=self._order)
+            self._queued.remove(entry)
+            entry.state = SYNCING
+            self._running[entry.folder.uuid] = entry
+            asyncio.get_running_loop().create_task(self._run(entry))
+
+    async def _run(self, entry: QueuedSync):
+        try:
+            await self.run_sync(entry.folder)
+        except Exception as e:
+            print(f"Sync of {entry.folder.name} failed: {e}")
+        finally:
+            del self._running[entry.folder.uuid]
+            self._start_next()
+            self.on_change()
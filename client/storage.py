@@ -1,6 +1,6 @@
-from models.data import Data, File, Folder
 from models.config import Configuration, TrackingFolder
 from utils.data_connector import DataConnector
+from utils.index_store import IndexStore, SqliteIndexStore
 
 default_config = Configuration(
     folders={
@@ -10,20 +10,12 @@ default_config = Configuration(
         )
     }
 )
-default_data = Data(
-    folders={
-        "Example": Folder(
-            name="Example",
-            base_path="D:\\Example",
-            files={}
-        )
-    }
-)
 config_dc: DataConnector[Configuration] = DataConnector(relative_file_path='client/config.json', cls=Configuration, default_data=default_config)
-data_dc: DataConnector[Data] = DataConnector(relative_file_path='client/data.json', cls=Data, default_data=default_data)
+index = SqliteIndexStore(relative_file_path='client/index.db')
+index.migrate_from_json('client/data.json')
 
 def get_config_dc() -> DataConnector[Configuration]:
     return config_dc
 
-def get_data_dc() -> DataConnector[Data]:
-    return data_dc
\ No newline at end of file
+def get_index() -> IndexStore:
+    return index
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""Bandwidth limits for uploads.
+
+Upload bodies are sent in pieces, each of which first takes its size in tokens from a global
+token bucket and from its folder's bucket. The buckets refill at the configured rate, which
+`bandwidth.schedule` can change by time of day (e.g. slower during business hours).
+"""
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, List, Optional, Tuple
+from models.config import Bandwidth, BandwidthWindow
+
+# A full bucket lets this many seconds worth of the rate through at once.
+BURST_SECONDS = 0.5
+MIN_BURST = 64 * 1024
+# How often a bucket looks up its rate again, schedules change it over time.
+RATE_CHECK_SECONDS = 5.0
+
+def _parse_time(value: str) -> Tuple[int, int]:
+    hours, minutes = value.split(":")
+    return int(hours), int(minutes)
+
+def _covers(window: BandwidthWindow, now: datetime) -> bool:
+    start, end, current = _parse_time(window.start), _parse_time(window.end), (now.hour, now.minute)
+    if start <= end:
+        return now.weekday() in window.days and start <= current < end
+    # Over midnight: the part after midnight belongs to the day the window started on.
+    if current >= start:
+        return now.weekday() in window.days
+    return current < end and (now.weekday() - 1) % 7 in window.days
+
+def current_limit(bandwidth: Optional[Bandwidth], now: Optional[datetime] = None) -> float:
+    """Bytes per second allowed right now, 0 for no limit."""
+    if bandwidth is None:
+        return 0
+    now = now or datetime.now()
+    for window in bandwidth.schedule:
+        if _covers(window, now):
+            return window.limit
+    return bandwidth.limit
+
+class TokenBucket():
+    """Waits callers so that on average no more than `rate()` bytes per second get through."""
+
+    def __init__(self, rate: Callable[[], float]) -> None:
+        self.rate = rate
+        self._lock = asyncio.Lock()
+        self._rate = 0.0
+        self._rate_checked = -RATE_CHECK_SECONDS
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+
+    def limit(self) -> float:
+        now = time.monotonic()
+        if now - self._rate_checked >= RATE_CHECK_SECONDS:
+            self._rate, self._rate_checked = self.rate(), now
+        return self._rate
+
+    async def consume(self, amount: int):
+        # Under the lock, waiting uploads get through in the order they asked.
+        async with self._lock:
+            rate = self.limit()
+            now = time.monotonic()
+            if not rate:
+                self._tokens, self._updated = 0.0, now
+                return
+            burst = max(MIN_BURST, rate * BURST_SECONDS)
+            self._tokens = min(burst, self._tokens + (now - self._updated) * rate) - amount
+            self._updated = now
+            if self._tokens < 0:
+                # Pieces bigger than the bucket are let through, the debt is waited off.
+                await asyncio.sleep(-self._tokens / rate)
+
+class ThroughputMeter():
+    """Bytes per second over the last `window` seconds."""
+
+    def __init__(self, window: float = 5.0) -> None:
+        self.window = window
+        self._samples: Deque[Tuple[float, int]] = deque()
+        self._started = time.monotonic()
+
+    def add(self, amount: int):
+        self._samples.append((time.monotonic(), amount))
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        while self._samples and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        # Shortly after the start, over the time there's been.
+        span = max(1.0, min(self.window, now - self._started))
+        return sum(amount for _, amount in self._samples) / span
+
+class Throttle():
+    """What the uploads of one sync go through: the buckets that apply and a meter of what got through."""
+
+    def __init__(self, buckets: List[TokenBucket]) -> None:
+        self.buckets = buckets
+        self.meter = ThroughputMeter()
+
+    def limited(self) -> bool:
+        return any(bucket.limit() for bucket in self.buckets)
+
+    def limit(self) -> float:
+        """The lowest rate of the buckets, 0 for no limit."""
+        return min((limit for limit in (bucket.limit() for bucket in self.buckets) if limit), default=0)
+
+    async def acquire(self, amount: int):
+        for bucket in self.buckets:
+            await bucket.consume(amount)
+        self.meter.add(amount)
+
+def format_rate(bytes_per_second: float) -> str:
+    for unit in ("B/s", "KiB/s", "MiB/s"):
+        if bytes_per_second < 1024:
+            return f"{bytes_per_second:.1f} {unit}"
+        bytes_per_second /= 1024
+    return f"{bytes_per_second:.1f} GiB/s"
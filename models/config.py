@@ -1,17 +1,101 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from uuid import uuid4
 from pydantic import BaseModel, Field
 
 def uuid4str() -> str:
     return str(uuid4())
 
+class BandwidthWindow(BaseModel):
+    start: str = "09:00" # local time, HH:MM
+    end: str = "18:00" # before start for windows over midnight
+    days: List[int] = [0, 1, 2, 3, 4] # Monday is 0
+    limit: float = 0 # bytes per second, 0 for unlimited
+
+class Bandwidth(BaseModel):
+    limit: float = 0 # client: bytes per second for uploads, 0 for unlimited
+    schedule: List[BandwidthWindow] = [] # the first window covering the current time replaces limit
+
 class TrackingFolder(BaseModel):
     name: str
     base_path: str
     uuid: str = Field(default_factory=uuid4str)
+    watch: bool = False # server only: keep the index up to date in the background instead of scanning on request
+    priority: int = 0 # client: queued syncs of folders with a higher priority start first
+    bandwidth: Optional[Bandwidth] = None # client: this folder's own upload limit, on top of the global one
 
 class Concurrency(BaseModel):
     max_workers: int = 4
+    large_file_workers: int = 1
+    large_file_threshold: int = 64 * 1024 * 1024 # bytes, bigger files are hashed in their own lane
+    batch_max_files: int = 256
+    batch_max_bytes: int = 16 * 1024 * 1024
+    min_uploads: int = 1
+    max_uploads: int = 16
+    initial_uploads: int = 3
+    max_connections: Optional[int] = None # client: HTTP connections to the server, None for no limit
+    max_keepalive: Optional[int] = None # client: idle connections kept open for reuse, None for max_uploads
+    scan_workers: int = 2 # server: folder scans running at the same time, on top of the hashing workers
+    delete_workers: int = 8 # server: threads removing files for a delete request
+    pipeline_uploads: bool = True # client: changed files are uploaded while the rest is still being hashed
+    max_syncs: int = 2 # client: folders syncing at once, the others wait in the queue
+    max_scans: int = 1 # client: folders reading their files for hashing at once
+
+class Scan(BaseModel):
+    prune_unchanged_dirs: bool = True
+    full_scan_interval: float = 3600.0 # seconds, a full re-list also catches what the mtime of a directory didn't show (e.g. coarse mtimes)
+    result_cache_seconds: float = 5.0 # server: scan results are reused this long while the index doesn't change
+
+class Watch(BaseModel):
+    debounce_ms: int = 1600 # changes are collected for this long before the index is refreshed
+    rescan_interval: float = 300.0 # seconds, also the polling interval when file system events aren't available
+    force_polling: bool = False # e.g. for network shares that don't report changes
+
+class Hashing(BaseModel):
+    algorithm: str = "md5" # md5, blake2b, xxh3_128, blake3 or auto (fastest available on both sides)
+    buffer_size: int = 1024 * 1024
+    use_mmap: bool = False
+    lazy: bool = False # client: trust size + mtime against the server's copy, files that are sent anyway are hashed on the way (their renames and duplicates aren't detected)
+
+class Delta(BaseModel):
+    enabled: bool = True
+    min_file_size: int = 16 * 1024 * 1024 # changed files at least this big only send the differing blocks
+    block_size: int = 128 * 1024
+    max_literal_ratio: float = 0.5 # once more than this share of the first 8 MiB encoded isn't found on the server, the file is sent whole
+
+class Compression(BaseModel):
+    enabled: bool = True
+    level: int = 3
+    min_file_size: int = 4 * 1024
+    sample_size: int = 64 * 1024
+    max_sample_ratio: float = 0.9 # files whose first sample_size bytes compress worse than this are sent as-is
+    skip_extensions: List[str] = [
+        ".7z", ".bz2", ".gz", ".rar", ".xz", ".zip", ".zst",
+        ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+        ".mp3", ".m4a", ".flac", ".ogg", ".mp4", ".mkv", ".mov", ".avi",
+        ".pdf", ".docx", ".xlsx", ".pptx",
+    ]
+
+class Bulk(BaseModel):
+    enabled: bool = True
+    max_file_size: int = 256 * 1024 # files up to this size are packed together into bulk requests
+    max_files: int = 1000 # per request
+    max_bytes: int = 32 * 1024 * 1024 # per request
+
+class Chunked(BaseModel):
+    enabled: bool = True
+    min_file_size: int = 256 * 1024 * 1024 # files at least this big are sent in chunks that survive a dropped connection
+    chunk_size: int = 16 * 1024 * 1024
+    parallel_chunks: int = 4 # per file
+    retries: int = 3 # per chunk
+    session_expiry: float = 7 * 24 * 3600.0 # server: seconds before an unfinished upload is dropped
+
+class Dedup(BaseModel):
+    enabled: bool = True
+    min_file_size: int = 1 # files the server already has a copy of (in any folder) are copied there instead of uploaded
+    allow_hardlinks: bool = False # server: when reflinks aren't supported, hard link instead of copying (both paths then share edits)
+
+class Writes(BaseModel):
+    fsync: bool = True # server: received files (and the directories they're renamed into) are on disk before an upload is confirmed
 
 class Client(BaseModel):
     dest_address: str = "127.0.0.1:8000"
@@ -20,4 +104,14 @@ class Client(BaseModel):
 class Configuration(BaseModel):
     folders: Dict[str, TrackingFolder] = {"Example": TrackingFolder(name="Example", base_path="D:\\Example")} # name -> TrackingFolder
     concurrency: Concurrency = Concurrency()
+    scan: Scan = Scan()
+    watch: Watch = Watch()
+    hashing: Hashing = Hashing()
+    delta: Delta = Delta()
+    compression: Compression = Compression()
+    bulk: Bulk = Bulk()
+    dedup: Dedup = Dedup()
+    chunked: Chunked = Chunked()
+    writes: Writes = Writes()
+    bandwidth: Bandwidth = Bandwidth()
     client: Client = Field(default_factory=Client)
\ No newline at end of file
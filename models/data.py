@@ -1,9 +1,38 @@
+from __future__ import annotations
+import os
 from pydantic import BaseModel
 from typing import Dict
 
 class File(BaseModel):
     dateModified: float
-    md5: str = ""
+    md5: str = "" # Digest made with hash_algorithm, the name is kept for compatibility with older versions
+    hash_algorithm: str = "md5"
+    size: int = 0
+    mtime_ns: int = 0
+    inode: int = 0 # 0 where the platform doesn't report it (e.g. os.scandir on Windows)
+    ctime_ns: int = 0
+
+    @classmethod
+    def from_stat(cls, stat: os.stat_result) -> File:
+        return cls(dateModified=stat.st_mtime, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                   inode=stat.st_ino, ctime_ns=stat.st_ctime_ns)
+
+    def same_stat(self, other: File) -> bool:
+        """Whether two entries describe the same file contents without hashing."""
+        if not self.mtime_ns or not other.mtime_ns:
+            # Entries indexed before stat fingerprints existed only have the float mtime.
+            return self.dateModified == other.dateModified
+        if self.inode and other.inode and self.inode != other.inode:
+            return False
+        return self.size == other.size and self.mtime_ns == other.mtime_ns
+
+    def same_content(self, other: File) -> bool:
+        return self.hash_algorithm == other.hash_algorithm and self.md5 == other.md5
+
+class Directory(BaseModel):
+    mtime_ns: int = 0 # 0 forces the directory to be listed again on the next scan
+    entry_count: int = 0
+    digest: str = "" # Merkle digest of everything below, see shared.tree
 
 class Folder(BaseModel):
     name: str
@@ -1,5 +1,85 @@
-from typing import List
-from pydantic import BaseModel
+from typing import List, Optional
+from pydantic import BaseModel, Field
 
 class Delete(BaseModel):
-    files_to_delete: List[str]
\ No newline at end of file
+    files_to_delete: List[str]
+
+class DeleteResult(BaseModel):
+    path: str
+    success: bool # also when the file was already gone
+    error: Optional[str] = None
+
+class BlockSignature(BaseModel):
+    weak: int
+    strong: str
+
+class Signatures(BaseModel):
+    block_size: int
+    blocks: List[BlockSignature]
+
+class BulkResult(BaseModel):
+    path: str
+    success: bool
+    error: Optional[str] = None
+
+class Move(BaseModel):
+    source: str
+    destination: str
+    hash: str = "" # content the client expects at source, checked against the server's index
+    hash_algorithm: str = "md5"
+    keep_source: bool = False # copy instead of move
+
+class Moves(BaseModel):
+    moves: List[Move]
+
+class MoveResult(BaseModel):
+    source: str
+    destination: str
+    success: bool
+    error: Optional[str] = None
+
+class Have(BaseModel):
+    hash_algorithm: str = "md5"
+    hashes: List[str]
+
+class Materialize(BaseModel):
+    path: str
+    hash: str
+    hash_algorithm: str = "md5"
+    size: int = 0
+    source: Optional[str] = None # a path in the same folder that should hold the content, e.g. uploaded earlier in the sync
+
+class MaterializeRequest(BaseModel):
+    files: List[Materialize]
+
+class MaterializeResult(BaseModel):
+    path: str
+    success: bool
+    method: Optional[str] = None # reflink, hardlink or copy
+    error: Optional[str] = None
+
+class UploadSessionCreate(BaseModel):
+    path: str
+    size: int
+    hash: str
+    hash_algorithm: str = "md5"
+    chunk_size: int
+
+class UploadSession(BaseModel):
+    id: str
+    path: str
+    size: int
+    hash: str
+    hash_algorithm: str = "md5"
+    chunk_size: int
+    received: List[int] = [] # indexes of the chunks the server has written
+    # Server side only.
+    folder: str = Field(default="", exclude=True)
+    temp_path: str = Field(default="", exclude=True)
+    created: float = Field(default=0.0, exclude=True)
+
+    def chunk_count(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index: int) -> int:
+        return max(0, min(self.chunk_size, self.size - index * self.chunk_size))
\ No newline at end of file
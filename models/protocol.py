@@ -0,0 +1,34 @@
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from models.data import File
+
+class Capabilities(BaseModel):
+    # Servers that predate this endpoint only speak MD5.
+    hash_algorithms: List[str] = ["md5"]
+    features: List[str] = []
+    compression: List[str] = []
+
+class ManifestEntry(BaseModel):
+    path: str
+    file: File
+
+class TreeNode(BaseModel):
+    path: str
+    digest: str = "" # "" when the directory doesn't exist
+    files: Dict[str, File] = {} # direct children, by name
+    directories: Dict[str, str] = {} # sub directory name -> digest
+
+class TreeRequest(BaseModel):
+    paths: List[str]
+
+class ScanStatus(BaseModel):
+    name: str
+    algorithm: str
+    state: str = "listing" # listing, hashing, done or failed
+    started: float = 0.0
+    finished: Optional[float] = None
+    files_to_hash: int = 0
+    files_hashed: int = 0
+    bytes_to_hash: int = 0
+    bytes_hashed: int = 0
+    waiting: int = 0 # requests waiting for this scan
\ No newline at end of file
@@ -1,50 +1,319 @@
 import os
+import urllib.parse
 import uvicorn
-from fastapi import FastAPI, Response, UploadFile, File, Request
-from models.file_ops import Delete
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Query, Response, UploadFile, File, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from models.file_ops import BulkResult, Delete, Have, MaterializeRequest, Moves, Signatures, UploadSessionCreate
+from models.protocol import Capabilities, ManifestEntry, TreeRequest
 from server.exceptions import UnicornException
-from server.storage import get_config_dc, get_data_dc
+from server.storage import get_config_dc, get_index, get_upload_session_store
+from server.scans import ScanCoordinator
+from server.uploads import UploadSessions
+from server.watcher import FolderWatchers
+from shared.bulk import BulkWriter
+from shared.compression import Decompressor, available_encodings
+from shared.delta import MAX_BLOCK_SIZE, MIN_BLOCK_SIZE, DeltaApplier, compute_signatures
 from shared.files import FileHandler
+from shared.hashing import DEFAULT_ALGORITHM, available_algorithms
+from shared.writes import AtomicWriter, DirectorySyncer, fsync_directory
 
-app = FastAPI()
-fh = FileHandler(get_config_dc(), get_data_dc())
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    watchers.update()
+    yield
+    watchers.stop_all()
+    scans.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+# Also compresses the (NDJSON) folder manifests, clients that don't accept gzip get them as-is.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+fh = FileHandler(get_config_dc(), get_index())
+watchers = FolderWatchers(fh)
+scans = ScanCoordinator(fh, watchers)
+upload_sessions = UploadSessions(fh, get_upload_session_store())
+directory_syncer = DirectorySyncer()
 
 @app.exception_handler(Exception)
 async def debug_exception_handler(request: Request, exc: Exception):
     import traceback
     return Response(
-        content=traceback.format_exc()
+        content=traceback.format_exc(),
+        status_code=500
         )
 
+FEATURES = ["delta", "bulk", "manifest", "tree", "move", "dedup", "sessions", "stream"]
+
+def get_full_path(name: str, relative_path: str) -> str:
+    return os.path.join(get_config_dc().get().folders[name].base_path, relative_path)
+
+@app.get("/capabilities")
+async def capabilities():
+    return Capabilities(hash_algorithms=available_algorithms(), features=FEATURES, compression=available_encodings())
+
+@app.get("/status")
+async def status():
+    return scans.status()
+
 @app.get("/files/{name}")
-async def files(name: str):
+async def files(name: str, algorithm: Optional[str] = None):
     print(f"Get {name}")
-    return fh.get_folder_metadata(name)
+    if algorithm and algorithm not in available_algorithms():
+        raise HTTPException(status_code=400, detail=f"Unsupported hash algorithm: {algorithm}")
+    # Clients that don't send an algorithm predate negotiation and compare MD5s.
+    folder = await scans.refresh(name, algorithm or DEFAULT_ALGORITHM)
+    return folder or await run_in_threadpool(fh.get_previous_folder_data, name, get_config_dc().get().folders[name].base_path)
+
+@app.get("/files/{name}/manifest")
+async def manifest(name: str, algorithm: str = DEFAULT_ALGORITHM, cursor: Optional[str] = None, limit: int = Query(10000, ge=1)):
+    """One page of the folder's files as NDJSON ManifestEntry lines, sorted by path.
+
+    The first page (no cursor) refreshes the index, the following ones continue from the
+    (URL-quoted) path in the X-Next-Cursor header of the previous page, absent on the last page.
+    """
+    if algorithm not in available_algorithms():
+        raise HTTPException(status_code=400, detail=f"Unsupported hash algorithm: {algorithm}")
+    if cursor is None:
+        await scans.refresh(name, algorithm)
+    page = await run_in_threadpool(fh.get_files_page, name, cursor or "", limit)
+    headers = {"X-Next-Cursor": urllib.parse.quote(page[-1][0])} if len(page) == limit else {}
+    lines = (ManifestEntry(path=path, file=file).model_dump_json() + "\n" for path, file in page)
+    return StreamingResponse(lines, media_type="application/x-ndjson", headers=headers)
+
+@app.post("/files/{name}/tree")
+async def tree(name: str, request_body: TreeRequest, algorithm: str = DEFAULT_ALGORITHM, refresh: bool = False):
+    """Hash tree nodes (see shared.tree) of the requested directories, `refresh` rescans the folder first."""
+    if algorithm not in available_algorithms():
+        raise HTTPException(status_code=400, detail=f"Unsupported hash algorithm: {algorithm}")
+    if refresh:
+        await scans.refresh(name, algorithm)
+    return await run_in_threadpool(fh.get_tree_nodes, name, request_body.paths)
 
 @app.post("/files/{name}/upload")
-def upload(name: str, request: Request, file: UploadFile = File(...)):
-    base_path = get_config_dc().get().folders[name].base_path
+def upload(name: str, request: Request, file: UploadFile = File(...), encoding: Optional[str] = None):
+    """Multipart upload, for clients without the "stream" feature."""
     print(f"Upload request for: {file.filename}")
+    fsync = get_config_dc().get().writes.fsync
     try:
-        full_path = os.path.join(base_path, file.filename)
-        dir_path = os.path.dirname(full_path)
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
-        with open(full_path, 'wb') as f:
+        # Clients without "stream" predate negotiation and compare MD5s, the content is hashed for the index on the way.
+        writer = AtomicWriter(get_full_path(name, file.filename), DEFAULT_ALGORITHM, fsync)
+        try:
+            decompressor = Decompressor(encoding) if encoding else None
             while contents := file.file.read(1024 * 1024):
-                f.write(contents)
+                writer.write(decompressor.decompress(contents) if decompressor else contents)
+            if decompressor:
+                writer.write(decompressor.flush())
+            writer.commit()
+        finally:
+            writer.abort()
+        if fsync:
+            fsync_directory(os.path.dirname(writer.full_path))
+        fh.update_file_data(name, file.filename, writer.entry())
+        scans.invalidate(name)
     except Exception:
         raise UnicornException(name=name)
     finally:
         file.file.close()
     return {"message": f"Successfully uploaded {file.filename}"}
 
+@app.put("/files/{name}/upload")
+async def upload_stream(name: str, path: str, request: Request, encoding: Optional[str] = None, hash: Optional[str] = None,
+                        algorithm: Optional[str] = None, mtime_ns: int = 0):
+    """Streams the request body into a temp file next to `path`, which only replaces `path` if the
+    content has the expected `hash`. The file gets the source's `mtime_ns` and goes into the index.
+
+    With an `algorithm` but no `hash` the content is hashed and indexed all the same, the answer
+    has the hash for the client to compare with what it sent."""
+    algorithm = algorithm or (DEFAULT_ALGORITHM if hash else None)
+    if algorithm and algorithm not in available_algorithms():
+        raise HTTPException(status_code=400, detail=f"Unsupported hash algorithm: {algorithm}")
+    fsync = get_config_dc().get().writes.fsync
+    writer = await run_in_threadpool(AtomicWriter, get_full_path(name, path), algorithm, fsync)
+    try:
+        decompressor = Decompressor(encoding) if encoding else None
+
+        def write(chunk: bytes):
+            # Decompressing and writing both stay off the event loop.
+            writer.write(decompressor.decompress(chunk) if decompressor else chunk)
+
+        async for chunk in request.stream():
+            await run_in_threadpool(write, chunk)
+        if decompressor:
+            await run_in_threadpool(writer.write, decompressor.flush())
+        committed = await run_in_threadpool(writer.commit, hash, mtime_ns)
+    finally:
+        writer.abort()
+    if not committed:
+        raise HTTPException(status_code=422, detail=f"Hash mismatch for {path}, got {writer.hexdigest()}")
+    if fsync:
+        await directory_syncer.sync([os.path.dirname(writer.full_path)])
+    if algorithm:
+        # Indexed right away, the next scan doesn't need to read the file again.
+        await run_in_threadpool(fh.update_file_data, name, path, writer.entry())
+    scans.invalidate(name)
+    return {"message": f"Successfully uploaded {path}", "hash": writer.hexdigest()}
+
+def get_upload_session(name: str, session_id: str):
+    try:
+        return upload_sessions.get(name, session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No upload session {session_id}")
+
+@app.post("/files/{name}/sessions")
+def create_upload_session(name: str, request_body: UploadSessionCreate):
+    """Opens a resumable upload (see server.uploads), or returns the open one for the same file with its received chunks."""
+    try:
+        return upload_sessions.create(name, request_body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/files/{name}/sessions/{session_id}")
+def upload_session(name: str, session_id: str):
+    return get_upload_session(name, session_id)
+
+@app.put("/files/{name}/sessions/{session_id}/chunks/{index}")
+async def upload_chunk(name: str, session_id: str, index: int, request: Request):
+    session = await run_in_threadpool(get_upload_session, name, session_id)
+    try:
+        file = await run_in_threadpool(upload_sessions.open_chunk, session, index)
+        received = 0
+        try:
+            async for piece in request.stream():
+                received += len(piece)
+                if received > session.chunk_length(index):
+                    break
+                await run_in_threadpool(file.write, piece)
+        finally:
+            await run_in_threadpool(upload_sessions.finish_chunk, session, index, file, received)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": f"Received chunk {index} of {session.path}"}
+
+@app.post("/files/{name}/sessions/{session_id}/commit")
+def commit_upload_session(name: str, session_id: str, mtime_ns: int = 0):
+    session = get_upload_session(name, session_id)
+    missing = upload_sessions.missing_chunks(session)
+    if missing:
+        raise HTTPException(status_code=409, detail=f"{missing} chunks of {session.path} are missing")
+    if not upload_sessions.commit(session, mtime_ns):
+        raise HTTPException(status_code=422, detail=f"Hash mismatch for {session.path}, the upload has to start over")
+    scans.invalidate(name)
+    return {"message": f"Successfully uploaded {session.path}"}
+
+def check_block_size(block_size: int):
+    if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        raise HTTPException(status_code=400, detail=f"Block size must be between {MIN_BLOCK_SIZE} and {MAX_BLOCK_SIZE} bytes")
+
+@app.get("/files/{name}/signatures")
+def signatures(name: str, path: str, block_size: int):
+    check_block_size(block_size)
+    full_path = get_full_path(name, path)
+    if not os.path.isfile(full_path):
+        raise HTTPException(status_code=404, detail=f"{path} not found")
+    return Signatures(block_size=block_size, blocks=compute_signatures(full_path, block_size))
+
+def finish_delta(applier: DeltaApplier, writer: AtomicWriter, hash: Optional[str], mtime_ns: int) -> bool:
+    applier.finish()
+    return writer.commit(hash, mtime_ns)
+
+@app.post("/files/{name}/delta")
+async def delta(name: str, path: str, block_size: int, request: Request, hash: Optional[str] = None, algorithm: str = DEFAULT_ALGORITHM,
+                mtime_ns: int = 0):
+    """Rebuilds `path` from its current content plus the delta in the request body, then swaps it in."""
+    check_block_size(block_size)
+    fsync = get_config_dc().get().writes.fsync
+    full_path = get_full_path(name, path)
+    try:
+        base_file = await run_in_threadpool(open, full_path, 'rb')
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"{path} not found")
+    try:
+        writer = await run_in_threadpool(AtomicWriter, full_path, algorithm if hash else None, fsync)
+        try:
+            applier = DeltaApplier(base_file, block_size, writer)
+            async for chunk in request.stream():
+                await run_in_threadpool(applier.feed, chunk)
+            committed = await run_in_threadpool(finish_delta, applier, writer, hash, mtime_ns)
+        finally:
+            writer.abort()
+    finally:
+        base_file.close()
+    if not committed:
+        raise HTTPException(status_code=422, detail=f"Hash mismatch after applying delta to {path}")
+    if fsync:
+        await directory_syncer.sync([os.path.dirname(full_path)])
+    if writer.entry():
+        await run_in_threadpool(fh.update_file_data, name, path, writer.entry())
+    scans.invalidate(name)
+    return {"message": f"Successfully patched {path}"}
+
+@app.post("/files/{name}/bulk")
+async def bulk(name: str, request: Request, encoding: Optional[str] = None):
+    """Unpacks a stream of many small files (see shared.bulk), answers with one NDJSON result line per file."""
+    fsync = get_config_dc().get().writes.fsync
+    writer = BulkWriter(get_config_dc().get().folders[name].base_path, fsync)
+    decompressor = Decompressor(encoding) if encoding else None
+    results = []
+
+    def feed(chunk: bytes) -> List[BulkResult]:
+        # Decompressing and writing both stay off the event loop.
+        return writer.feed(decompressor.decompress(chunk) if decompressor else chunk)
+
+    try:
+        async for chunk in request.stream():
+            results.extend(await run_in_threadpool(feed, chunk))
+        if decompressor:
+            results.extend(await run_in_threadpool(lambda: writer.feed(decompressor.flush())))
+        # Drops the temp file of one the stream broke off in.
+        results.extend(await run_in_threadpool(writer.finish))
+        if fsync:
+            await directory_syncer.sync(writer.directories)
+        await run_in_threadpool(fh.update_files_data, name, writer.received)
+    finally:
+        # Also when the request broke off, the files before that are written.
+        scans.invalidate(name)
+    print(f"Bulk upload of {len(results)} files to {name}")
+    return StreamingResponse((result.model_dump_json() + "\n" for result in results), media_type="application/x-ndjson")
+
+@app.post("/files/{name}/move")
+def move(name: str, request_body: Moves):
+    """Moves or copies files that are already on the server, answers with one MoveResult per move."""
+    results = fh.move_files(name, request_body.moves)
+    scans.invalidate(name)
+    print(f"Moved {sum(result.success for result in results)}/{len(results)} files in {name}")
+    return results
+
+@app.post("/have")
+def have(request_body: Have):
+    """Which of the hashes the server already has a file for, in any folder."""
+    return fh.have_hashes(request_body.hash_algorithm, request_body.hashes)
+
+@app.post("/files/{name}/materialize")
+def materialize(name: str, request_body: MaterializeRequest):
+    """Creates files from content already on the server, answers with one MaterializeResult per file."""
+    results = fh.materialize_files(name, request_body.files)
+    scans.invalidate(name)
+    print(f"Materialized {sum(result.success for result in results)}/{len(results)} files in {name}")
+    return results
+
 @app.post("/files/{name}/delete")
 def delete(name: str, request_body: Delete):
-    base_path = get_config_dc().get().folders[name].base_path
-    for file in request_body.files_to_delete:
-        os.remove(os.path.join(base_path, file))
-    return {"message": f"Successfully delete files."}
+    """Deletes the files (and the directories left empty), answers with one NDJSON DeleteResult line per file."""
+    def results():
+        deleted = 0
+        try:
+            for result in fh.iter_delete_files(name, request_body.files_to_delete):
+                deleted += result.success
+                yield result.model_dump_json() + "\n"
+        finally:
+            # Also when the client went away, the files deleted until then are gone.
+            scans.invalidate(name)
+            print(f"Deleted {deleted}/{len(request_body.files_to_delete)} files in {name}")
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""Folder scans for requests, off the event loop.
+
+Scans run on their own executor so they neither block the event loop nor take threads from
+uploads. Requests for a folder that is already being scanned wait for that scan instead of
+starting another one, and a scan's result is reused for `scan.result_cache_seconds` as long
+as the folder's index didn't change and nothing was written to the folder in the meantime
+(endpoints that write call invalidate()).
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from models.data import Folder
+from models.protocol import ScanStatus
+from server.watcher import FolderWatchers
+from shared.files import FileHandler
+
+@dataclass
+class _CachedScan():
+    generation: int
+    finished: float
+    folder: Folder
+
+class ScanCoordinator():
+    def __init__(self, fh: FileHandler, watchers: FolderWatchers) -> None:
+        self.fh = fh
+        self.watchers = watchers
+        self._executor = ThreadPoolExecutor(max_workers=fh.config_dc.get().concurrency.scan_workers, thread_name_prefix="scan")
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._cache: Dict[Tuple[str, str], _CachedScan] = {}
+        self._waiting: Dict[str, int] = {}
+        self._writes: Dict[str, int] = {} # invalidate() calls per folder
+
+    async def refresh(self, name: str, algorithm: str) -> Optional[Folder]:
+        """Brings the index of `name` up to date, returns the fresh folder if that took a scan.
+
+        Watched folders are answered from the index their watcher keeps current.
+        """
+        self.watchers.update()
+        if self.watchers.is_current(name, algorithm):
+            return None
+        key = (name, algorithm)
+        cached = self._cache.pop(key, None)
+        if cached and cached.generation == self.fh.generation(name) and \
+                time.time() - cached.finished < self.fh.config_dc.get().scan.result_cache_seconds:
+            self._cache[key] = cached
+            return cached.folder
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, self._scan, name, algorithm)
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        self._waiting[name] = self._waiting.get(name, 0) + 1
+        try:
+            # Shielded, one caller going away doesn't cancel the scan for everyone else.
+            return await asyncio.shield(future)
+        finally:
+            self._waiting[name] -= 1
+
+    def invalidate(self, name: str):
+        """Files of the folder were written, cached results (and those of scans running right now) are stale."""
+        self._writes[name] = self._writes.get(name, 0) + 1
+        for key in list(self._cache):
+            if key[0] == name:
+                self._cache.pop(key, None)
+
+    def _scan(self, name: str, algorithm: str) -> Folder:
+        writes = self._writes.get(name, 0)
+        folder = self.fh.get_folder_metadata(name, algorithm)
+        self.watchers.scanned(name, algorithm)
+        if self._writes.get(name, 0) == writes:
+            self._cache[(name, algorithm)] = _CachedScan(generation=self.fh.generation(name), finished=time.time(), folder=folder)
+        return folder
+
+    def status(self) -> List[ScanStatus]:
+        """The running or last scan of every folder."""
+        return [status.model_copy(update={"waiting": self._waiting.get(name, 0)}) for name, status in self.fh.scan_status.items()]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
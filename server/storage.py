@@ -1,6 +1,7 @@
-from models.data import Data, Folder
 from models.config import Configuration, TrackingFolder
 from utils.data_connector import DataConnector
+from utils.index_store import IndexStore, SqliteIndexStore
+from utils.upload_session_store import SqliteUploadSessionStore, UploadSessionStore
 
 default_config = Configuration(
     folders={
@@ -11,21 +12,16 @@ default_config = Configuration(
     }
 )
 
-default_data = Data(
-    folders={
-        "Example": Folder(
-            name="Example",
-            base_path="D:\\Example",
-            files={}
-        )
-    }
-)
-
 config_dc: DataConnector[Configuration] = DataConnector(relative_file_path='server/config.json', cls=Configuration, default_data=default_config)
-data_dc: DataConnector[Data] = DataConnector(relative_file_path='server/data.json', cls=Data, default_data=default_data)
+index = SqliteIndexStore(relative_file_path='server/index.db')
+index.migrate_from_json('server/data.json')
+upload_sessions = SqliteUploadSessionStore(relative_file_path='server/index.db')
 
 def get_config_dc() -> DataConnector[Configuration]:
     return config_dc
 
-def get_data_dc() -> DataConnector[Data]:
-    return data_dc
\ No newline at end of file
+def get_index() -> IndexStore:
+    return index
+
+def get_upload_session_store() -> UploadSessionStore:
+    return upload_sessions
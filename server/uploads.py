@@ -0,0 +1,98 @@
+"""Resumable uploads of big files.
+
+A session is opened per file, its chunks can arrive in any order and over several
+connections, each is written in place into a temp file next to the target. Received chunks
+are recorded in the index's database, so a client that lost its connection (or a restarted server)
+carries on with the missing ones. Committing checks the whole file's hash before the temp
+file is renamed over the target.
+"""
+import os
+import time
+from typing import BinaryIO
+from uuid import uuid4
+from models.file_ops import UploadSession, UploadSessionCreate
+from shared.files import FileHandler, temp_path_for
+from shared.writes import fsync_directory, received_entry
+from utils.upload_session_store import UploadSessionStore
+
+# Upper bound on the chunk size a client may ask for.
+MAX_CHUNK_SIZE = 256 * 1024 * 1024
+
+class UploadSessions():
+    def __init__(self, fh: FileHandler, store: UploadSessionStore) -> None:
+        self.fh = fh
+        self.store = store
+
+    def create(self, name: str, request: UploadSessionCreate) -> UploadSession:
+        """Open a session, or continue the one already open for the same file and content."""
+        self._expire()
+        if not 0 < request.chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"Chunk size has to be between 1 and {MAX_CHUNK_SIZE}")
+        existing = self.store.find_upload_session(name, request.path, request.size, request.hash, request.hash_algorithm)
+        if existing and existing.chunk_size == request.chunk_size and os.path.exists(existing.temp_path):
+            return existing
+        if existing:
+            self._drop(existing)
+        full_path = os.path.join(self.fh.config_dc.get().folders[name].base_path, request.path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        session = UploadSession(id=uuid4().hex, folder=name, temp_path=temp_path_for(full_path), created=time.time(),
+                                **request.model_dump())
+        with open(session.temp_path, "wb") as file:
+            file.truncate(session.size)
+        self.store.save_upload_session(session)
+        return session
+
+    def get(self, name: str, session_id: str) -> UploadSession:
+        session = self.store.get_upload_session(session_id)
+        if session is None or session.folder != name:
+            raise KeyError(session_id)
+        return session
+
+    def open_chunk(self, session: UploadSession, index: int) -> BinaryIO:
+        if not 0 <= index < session.chunk_count():
+            raise ValueError(f"No chunk {index} in a {session.size} bytes file")
+        file = open(session.temp_path, "r+b")
+        file.seek(index * session.chunk_size)
+        return file
+
+    def finish_chunk(self, session: UploadSession, index: int, file: BinaryIO, received: int):
+        """Closes the chunk's file, it only counts as received once it's on disk and complete."""
+        try:
+            if received != session.chunk_length(index):
+                raise ValueError(f"Chunk {index} should be {session.chunk_length(index)} bytes, got {received}")
+            file.flush()
+            os.fsync(file.fileno())
+        finally:
+            file.close()
+        self.store.add_upload_chunk(session.id, index)
+
+    def missing_chunks(self, session: UploadSession) -> int:
+        return session.chunk_count() - len(session.received)
+
+    def commit(self, session: UploadSession, mtime_ns: int = 0) -> bool:
+        """Moves the file (with the source's mtime) into place and indexes it if it has the expected hash.
+        Otherwise the session is dropped, there's no telling which chunk is wrong so the client has to start over."""
+        if self.fh.get_file_hash(session.temp_path, session.hash_algorithm) != session.hash:
+            self._drop(session)
+            return False
+        if mtime_ns:
+            os.utime(session.temp_path, ns=(mtime_ns, mtime_ns))
+        entry = received_entry(os.stat(session.temp_path), session.hash, session.hash_algorithm)
+        full_path = os.path.join(self.fh.config_dc.get().folders[session.folder].base_path, session.path)
+        os.replace(session.temp_path, full_path)
+        if self.fh.config_dc.get().writes.fsync:
+            fsync_directory(os.path.dirname(full_path))
+        self.store.delete_upload_session(session.id)
+        self.fh.update_file_data(session.folder, session.path, entry)
+        return True
+
+    def _drop(self, session: UploadSession):
+        if os.path.exists(session.temp_path):
+            os.remove(session.temp_path)
+        self.store.delete_upload_session(session.id)
+
+    def _expire(self):
+        expiry = self.fh.config_dc.get().chunked.session_expiry
+        for session in self.store.expired_upload_sessions(time.time() - expiry):
+            print(f"Dropping unfinished upload of {session.path}")
+            self._drop(session)
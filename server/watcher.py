@@ -0,0 +1,109 @@
+"""Background index maintenance for folders configured with `"watch": true`.
+
+Each watched folder gets a thread that scans it once, then waits for file system events
+(inotify / ReadDirectoryChangesW through watchfiles) and lists only the directories they
+touched again. Without watchfiles, or with `watch.force_polling`, it rescans with directory
+pruning every `watch.rescan_interval` seconds instead.
+"""
+import os
+import threading
+from typing import Dict, Set
+from shared.files import TEMP_PREFIX, FileHandler
+
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+class FolderWatcher():
+    def __init__(self, fh: FileHandler, name: str, base_path: str) -> None:
+        self.fh = fh
+        self.name = name
+        self.base_path = base_path
+        self.algorithm = fh.default_algorithm()
+        # Set once the index reflects the folder, cleared while a refresh is failing.
+        self.current = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"watch-{name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def is_current(self, algorithm: str) -> bool:
+        return self.current.is_set() and algorithm == self.algorithm
+
+    def _refresh(self, dirty_dirs: Set[str]):
+        algorithm = self.algorithm
+        try:
+            self.fh.get_folder_metadata(self.name, algorithm, dirty_dirs)
+            if algorithm == self.algorithm:
+                self.current.set()
+        except Exception as e:
+            self.current.clear()
+            print(f"Watcher of {self.name} failed to refresh the index: {e}")
+
+    def _relative_dir(self, path: str) -> str:
+        relative_path = os.path.relpath(path, self.base_path)
+        return "" if relative_path == os.curdir else os.path.dirname(relative_path)
+
+    def _run(self):
+        self._refresh(set())
+        config = self.fh.config_dc.get().watch
+        if watchfiles and not config.force_polling:
+            try:
+                self._watch(config.debounce_ms, config.rescan_interval)
+                return
+            except Exception as e:
+                print(f"Watching {self.base_path} failed, polling instead: {e}")
+        while not self._stop.wait(config.rescan_interval):
+            self._refresh(set())
+
+    def _watch(self, debounce_ms: int, rescan_interval: float):
+        changes_iter = watchfiles.watch(
+            self.base_path, stop_event=self._stop, debounce=debounce_ms, yield_on_timeout=True,
+            rust_timeout=int(rescan_interval * 1000), raise_interrupt=False,
+            watch_filter=lambda change, path: not os.path.basename(path).startswith(TEMP_PREFIX))
+        for changes in changes_iter:
+            # Also runs on timeouts (no changes) as a safety net, e.g. for dropped events.
+            self._refresh({self._relative_dir(path) for _, path in changes})
+
+class FolderWatchers():
+    """The watchers of every folder with `watch` enabled, kept in line with the (reloadable) config."""
+
+    def __init__(self, fh: FileHandler) -> None:
+        self.fh = fh
+        self._watchers: Dict[str, FolderWatcher] = {}
+        self._lock = threading.Lock()
+
+    def update(self):
+        folders = self.fh.config_dc.get().folders
+        with self._lock:
+            for name, watcher in list(self._watchers.items()):
+                folder = folders.get(name)
+                if not folder or not folder.watch or folder.base_path != watcher.base_path:
+                    watcher.stop()
+                    del self._watchers[name]
+            for name, folder in folders.items():
+                if folder.watch and name not in self._watchers:
+                    self._watchers[name] = FolderWatcher(self.fh, name, folder.base_path)
+                    self._watchers[name].start()
+
+    def is_current(self, name: str, algorithm: str) -> bool:
+        watcher = self._watchers.get(name)
+        return bool(watcher) and watcher.is_current(algorithm)
+
+    def scanned(self, name: str, algorithm: str):
+        """The folder was just scanned with `algorithm` for a client, keep it that way."""
+        watcher = self._watchers.get(name)
+        if watcher:
+            watcher.algorithm = algorithm
+            watcher.current.set()
+
+    def stop_all(self):
+        with self._lock:
+            for watcher in self._watchers.values():
+                watcher.stop()
+            self._watchers.clear()
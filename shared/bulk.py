@@ -0,0 +1,104 @@
+"""Framing for sending many small files in a single request.
+
+Each file is a JSON header line followed by exactly `size` bytes of content:
+    {"path": "dir/file.txt", "size": 123}\n<123 bytes>
+The header can also carry the file's "hash" (with its "algorithm"), checked on arrival, and
+its "mtime_ns", which the written file gets.
+"""
+import json
+import os
+from typing import Dict, List, Optional, Set
+from models.data import File
+from models.file_ops import BulkResult
+from shared.writes import AtomicWriter
+
+def encode_header(relative_path: str, size: int, hash: str = "", algorithm: str = "", mtime_ns: int = 0) -> bytes:
+    header = {"path": relative_path, "size": size}
+    if hash:
+        header.update(hash=hash, algorithm=algorithm)
+    if mtime_ns:
+        header["mtime_ns"] = mtime_ns
+    return json.dumps(header).encode() + b"\n"
+
+class BulkWriter():
+    """Incrementally decodes a bulk stream, writing each file next to its target and renaming it into place.
+
+    The directories written to are collected in `directories`, for the caller to fsync once per batch,
+    and the index entries of the files that came with a hash in `received`.
+    """
+
+    def __init__(self, base_path: str, fsync: bool = True) -> None:
+        self.base_path = base_path
+        self.fsync = fsync
+        self.directories: Set[str] = set()
+        self.received: Dict[str, File] = {}
+        self._pending = bytearray()
+        self._path: Optional[str] = None
+        self._header: dict = {}
+        self._writer: Optional[AtomicWriter] = None
+        self._remaining = 0
+        self._failed: Optional[str] = None
+
+    def feed(self, data: bytes) -> List[BulkResult]:
+        results = []
+        self._pending += data
+        while self._pending:
+            if self._path is None:
+                end = self._pending.find(b"\n")
+                if end < 0:
+                    return results
+                header = json.loads(bytes(self._pending[:end]))
+                del self._pending[:end + 1]
+                self._start(header)
+                if self._remaining == 0:
+                    results.append(self._complete())
+                continue
+            piece = bytes(self._pending[:self._remaining])
+            del self._pending[:len(piece)]
+            self._remaining -= len(piece)
+            self._write(piece)
+            if self._remaining == 0:
+                results.append(self._complete())
+        return results
+
+    def finish(self) -> List[BulkResult]:
+        """Fails whatever file the stream stopped in the middle of."""
+        if self._path is None:
+            return []
+        self._failed = self._failed or "Stream ended before the whole file was received"
+        return [self._complete()]
+
+    def _start(self, header: dict):
+        self._header = header
+        self._path = header["path"]
+        self._remaining = header["size"]
+        self._failed = None
+        try:
+            self._writer = AtomicWriter(os.path.join(self.base_path, self._path), header.get("algorithm"), self.fsync)
+        except OSError as e:
+            self._failed = str(e)
+
+    def _write(self, piece: bytes):
+        if self._failed:
+            return
+        try:
+            self._writer.write(piece)
+        except OSError as e:
+            self._failed = str(e)
+
+    def _complete(self) -> BulkResult:
+        path, self._path = self._path, None
+        writer, self._writer = self._writer, None
+        if writer:
+            try:
+                if self._failed or self._remaining:
+                    writer.abort()
+                elif writer.commit(self._header.get("hash"), self._header.get("mtime_ns", 0)):
+                    self.directories.add(os.path.dirname(writer.full_path))
+                    if self._header.get("hash"):
+                        self.received[path] = writer.entry()
+                else:
+                    self._failed = f"Hash mismatch, got {writer.hexdigest()}"
+            except OSError as e:
+                self._failed = str(e)
+        return BulkResult(path=path, success=not self._failed, error=self._failed)
@@ -0,0 +1,77 @@
+import os
+import zlib
+from typing import BinaryIO, List, Optional
+from models.config import Compression
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD = "zstd"
+GZIP = "gzip"
+
+def available_encodings() -> List[str]:
+    """Preferred first, gzip needs nothing outside the standard library."""
+    return [ZSTD, GZIP] if zstandard else [GZIP]
+
+def negotiate_encoding(offered: List[str]) -> Optional[str]:
+    for encoding in available_encodings():
+        if encoding in offered:
+            return encoding
+    return None
+
+def new_compressor(encoding: str, level: int):
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+class Decompressor():
+    def __init__(self, encoding: str) -> None:
+        if encoding not in available_encodings():
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        self._flushable = encoding == GZIP
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj() if encoding == ZSTD \
+            else zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> bytes:
+        # zstd refuses any further call once its frame is complete, even an empty one.
+        return self._decompressor.decompress(data) if data else b""
+
+    def flush(self) -> bytes:
+        return self._decompressor.flush() if self._flushable else b""
+
+def worth_compressing(file_path: str, size: int, policy: Compression) -> bool:
+    """Skip tiny files, known compressed formats and anything whose first bytes barely shrink."""
+    if size < policy.min_file_size:
+        return False
+    if os.path.splitext(file_path)[1].lower() in policy.skip_extensions:
+        return False
+    with open(file_path, "rb") as file:
+        sample = file.read(policy.sample_size)
+    return len(zlib.compress(sample, 1)) <= len(sample) * policy.max_sample_ratio
+
+class CompressingReader():
+    """File-like wrapper that yields the compressed content of `file` and counts bytes on both sides."""
+
+    def __init__(self, file: BinaryIO, encoding: str, level: int) -> None:
+        self.file = file
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self._compressor = new_compressor(encoding, level)
+        self._done = False
+
+    def read(self, size: int = -1) -> bytes:
+        chunk_size = size if size > 0 else 1024 * 1024
+        while not self._done:
+            raw = self.file.read(chunk_size)
+            if raw:
+                self.raw_bytes += len(raw)
+                out = self._compressor.compress(raw)
+            else:
+                self._done = True
+                out = self._compressor.flush()
+            if out:
+                self.wire_bytes += len(out)
+                return out
+        return b""
@@ -0,0 +1,179 @@
+"""rsync style delta encoding.
+
+The receiver describes the file it already has as per-block signatures (a weak rolling
+checksum plus a strong hash), the sender walks its own version with the rolling checksum
+and emits references to blocks the receiver has and literal bytes for everything else.
+
+Delta stream format, repeated until the end of the stream:
+    b"C" + uint64 block index              copy a block from the receiver's existing file
+    b"L" + uint32 length + <length bytes>  literal data
+"""
+import hashlib
+import struct
+import time
+import zlib
+from typing import BinaryIO, Dict, List, Optional
+from models.file_ops import BlockSignature
+
+_MOD_ADLER = 65521
+_COPY = b"C"
+_LITERAL = b"L"
+_COPY_FORMAT = struct.Struct(">Q")
+_LITERAL_FORMAT = struct.Struct(">I")
+MAX_LITERAL = 1024 * 1024
+# Block sizes the server accepts.
+MIN_BLOCK_SIZE = 512
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+# Encoded bytes before the literal ratio and the encoding rate are judged (see write_delta).
+LITERAL_PROBE_BYTES = 8 * 1024 * 1024
+
+class DeltaNotWorthIt(Exception):
+    """Too much of the file is literal or encoding is too slow, sending it whole is cheaper than encoding the rest."""
+
+def strong_hash(data) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def compute_signatures(file_path: str, block_size: int) -> List[BlockSignature]:
+    signatures = []
+    with open(file_path, "rb") as file:
+        while block := file.read(block_size):
+            signatures.append(BlockSignature(weak=zlib.adler32(block), strong=strong_hash(block)))
+    return signatures
+
+def write_delta(file_path: str, signatures: List[BlockSignature], block_size: int, out: BinaryIO,
+                max_literal_ratio: float = 1.0, min_rate: float = 0) -> int:
+    """Write the delta that turns the receiver's file into file_path, returns the number of literal bytes.
+
+    Literal bytes go through the rolling checksum one byte at a time, which is slow. Once
+    LITERAL_PROBE_BYTES have been encoded, DeltaNotWorthIt is raised when more than
+    `max_literal_ratio` of them were literal, or when they were encoded at less than `min_rate`
+    bytes per second (e.g. the rate the link would send the whole file at, 0 to not check).
+    """
+    by_weak: Dict[int, Dict[str, int]] = {}
+    for index, signature in enumerate(signatures):
+        by_weak.setdefault(signature.weak, {}).setdefault(signature.strong, index)
+
+    literal_bytes = copied_bytes = 0
+    started = time.monotonic()
+
+    def emit_literal(data, last: bool = False):
+        nonlocal literal_bytes
+        for offset in range(0, len(data), MAX_LITERAL):
+            piece = data[offset:offset + MAX_LITERAL]
+            out.write(_LITERAL + _LITERAL_FORMAT.pack(len(piece)))
+            out.write(piece)
+        literal_bytes += len(data)
+        encoded = literal_bytes + copied_bytes
+        if last or encoded < LITERAL_PROBE_BYTES:
+            return
+        if literal_bytes > max_literal_ratio * encoded:
+            raise DeltaNotWorthIt(f"{literal_bytes} of the first {encoded} bytes are literal")
+        rate = encoded / max(time.monotonic() - started, 1e-9)
+        if rate < min_rate:
+            raise DeltaNotWorthIt(f"encoding at {rate:.0f} bytes/s, slower than the {min_rate:.0f} bytes/s it would be sent at")
+
+    def find_block(weak: int, start: int) -> Optional[int]:
+        candidates = by_weak.get(weak)
+        if not candidates:
+            return None
+        return candidates.get(strong_hash(buffer[start:start + block_size]))
+
+    read_size = max(block_size * 16, 4 * 1024 * 1024)
+    with open(file_path, "rb") as file:
+        buffer = file.read(read_size)
+        eof = len(buffer) < read_size
+        position = 0
+        literal_start = 0
+        a = b = None
+
+        while True:
+            if len(buffer) - position < block_size + 1 and not eof:
+                # Keep the pending literal and the current window, drop everything before them.
+                if position - literal_start >= MAX_LITERAL:
+                    emit_literal(buffer[literal_start:position])
+                    literal_start = position
+                more = file.read(read_size)
+                eof = len(more) < read_size
+                buffer = buffer[literal_start:] + more
+                position -= literal_start
+                literal_start = 0
+            if len(buffer) - position < block_size:
+                break
+
+            if a is None:
+                weak = zlib.adler32(buffer[position:position + block_size])
+                a, b = weak & 0xffff, weak >> 16
+            block_index = find_block((b << 16) | a, position)
+            if block_index is not None:
+                if literal_start < position:
+                    emit_literal(buffer[literal_start:position])
+                out.write(_COPY + _COPY_FORMAT.pack(block_index))
+                copied_bytes += block_size
+                position += block_size
+                literal_start = position
+                a = b = None
+                continue
+
+            if position + block_size >= len(buffer):
+                # Nothing left to roll into, the rest is literal.
+                break
+            out_byte, in_byte = buffer[position], buffer[position + block_size]
+            a = (a - out_byte + in_byte) % _MOD_ADLER
+            b = (b - block_size * out_byte + a - 1) % _MOD_ADLER
+            position += 1
+
+            if position - literal_start >= MAX_LITERAL:
+                emit_literal(buffer[literal_start:position])
+                literal_start = position
+
+        if literal_start < len(buffer):
+            emit_literal(buffer[literal_start:], last=True)
+    return literal_bytes
+
+class DeltaApplier():
+    """Incrementally decodes a delta stream, writing the reconstructed file to `out`."""
+
+    def __init__(self, base_file: BinaryIO, block_size: int, out: BinaryIO, hasher=None) -> None:
+        self.base_file = base_file
+        self.block_size = block_size
+        self.out = out
+        self.hasher = hasher
+        self._pending = bytearray()
+        self._literal_left = 0
+
+    def _write(self, data):
+        self.out.write(data)
+        if self.hasher:
+            self.hasher.update(data)
+
+    def feed(self, data: bytes):
+        self._pending += data
+        while self._pending:
+            if self._literal_left:
+                piece = bytes(self._pending[:self._literal_left])
+                del self._pending[:len(piece)]
+                self._literal_left -= len(piece)
+                self._write(piece)
+                continue
+            op = self._pending[:1]
+            if op == _COPY:
+                if len(self._pending) < 1 + _COPY_FORMAT.size:
+                    return
+                (block_index,) = _COPY_FORMAT.unpack_from(self._pending, 1)
+                del self._pending[:1 + _COPY_FORMAT.size]
+                self.base_file.seek(block_index * self.block_size)
+                block = self.base_file.read(self.block_size)
+                if not block:
+                    raise ValueError(f"Delta references block {block_index} past the end of the base file")
+                self._write(block)
+            elif op == _LITERAL:
+                if len(self._pending) < 1 + _LITERAL_FORMAT.size:
+                    return
+                (self._literal_left,) = _LITERAL_FORMAT.unpack_from(self._pending, 1)
+                del self._pending[:1 + _LITERAL_FORMAT.size]
+            else:
+                raise ValueError(f"Unknown delta op: {op!r}")
+
+    def finish(self):
+        if self._pending or self._literal_left:
+            raise ValueError("Delta stream ended in the middle of an op")
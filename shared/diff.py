@@ -0,0 +1,132 @@
+"""Single pass diff of two path-sorted streams of (path, File).
+
+Both sides have to be sorted by path with plain string ordering, which is also the order
+of the index (SQLite's default BINARY collation on UTF-8 text). Only the current entry of
+each side is held, so memory doesn't grow with the size of the tree.
+"""
+import asyncio
+from dataclasses import dataclass
+from enum import Enum
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from models.data import File
+
+Entry = Tuple[str, File]
+
+class DiffKind(Enum):
+    COPY_NEW = "copy-new"
+    COPY_CHANGED = "copy-changed"
+    DELETE = "delete"
+    RENAME_CANDIDATE = "rename-candidate"
+    UNCHANGED = "unchanged"
+
+@dataclass
+class DiffAction():
+    kind: DiffKind
+    path: str
+    local: Optional[File] = None
+    remote: Optional[File] = None
+    source: Optional[str] = None # RENAME_CANDIDATE: the remote path holding the same content
+
+def _same_content(local: File, remote: File) -> bool:
+    return local.same_content(remote)
+
+def _compare(local: Optional[Entry], remote: Optional[Entry], same: Callable[[File, File], bool]) -> Tuple[DiffAction, bool, bool]:
+    """The action for the current heads of both streams, and which of the heads it consumed."""
+    if remote is None or (local is not None and local[0] < remote[0]):
+        return DiffAction(DiffKind.COPY_NEW, local[0], local=local[1]), True, False
+    if local is None or remote[0] < local[0]:
+        return DiffAction(DiffKind.DELETE, remote[0], remote=remote[1]), False, True
+    kind = DiffKind.UNCHANGED if same(local[1], remote[1]) else DiffKind.COPY_CHANGED
+    return DiffAction(kind, local[0], local=local[1], remote=remote[1]), True, True
+
+def diff_sorted(local: Iterable[Entry], remote: Iterable[Entry], same: Callable[[File, File], bool] = _same_content,
+                emit_unchanged: bool = False) -> Iterator[DiffAction]:
+    local_iter, remote_iter = iter(local), iter(remote)
+    local_head, remote_head = next(local_iter, None), next(remote_iter, None)
+    while local_head is not None or remote_head is not None:
+        action, used_local, used_remote = _compare(local_head, remote_head, same)
+        if used_local:
+            local_head = next(local_iter, None)
+        if used_remote:
+            remote_head = next(remote_iter, None)
+        if emit_unchanged or action.kind != DiffKind.UNCHANGED:
+            yield action
+
+async def diff_sorted_async(local: Iterable[Entry], remote: AsyncIterable[Entry], same: Callable[[File, File], bool] = _same_content,
+                            emit_unchanged: bool = False) -> AsyncIterator[DiffAction]:
+    """Same as diff_sorted, for a remote side that arrives over the network."""
+    local_iter, remote_iter = iter(local), remote.__aiter__()
+
+    async def next_remote() -> Optional[Entry]:
+        try:
+            return await remote_iter.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    local_head, remote_head = next(local_iter, None), await next_remote()
+    while local_head is not None or remote_head is not None:
+        action, used_local, used_remote = _compare(local_head, remote_head, same)
+        if used_local:
+            local_head = next(local_iter, None)
+        if used_remote:
+            remote_head = await next_remote()
+        if emit_unchanged or action.kind != DiffKind.UNCHANGED:
+            yield action
+
+def pair_renames(new: List[DiffAction], deleted: List[DiffAction]) -> Tuple[List[DiffAction], List[DiffAction], List[DiffAction]]:
+    """Match new local paths with deleted remote paths holding the same (size, hash).
+
+    Returns (renames, remaining new, remaining deleted). Only the change set is held here, not the tree.
+    """
+    by_content: Dict[Tuple[int, str, str], List[DiffAction]] = {}
+    for action in deleted:
+        if action.remote.md5:
+            by_content.setdefault((action.remote.size, action.remote.hash_algorithm, action.remote.md5), []).append(action)
+    renames, remaining_new = [], []
+    for action in new:
+        candidates = by_content.get((action.local.size, action.local.hash_algorithm, action.local.md5))
+        if candidates:
+            source = candidates.pop()
+            renames.append(DiffAction(DiffKind.RENAME_CANDIDATE, action.path, local=action.local, remote=source.remote, source=source.path))
+        else:
+            remaining_new.append(action)
+    renamed_sources = {action.source for action in renames}
+    remaining_deleted = [action for action in deleted if action.path not in renamed_sources]
+    return renames, remaining_new, remaining_deleted
+
+class Prefetch():
+    """Starts consuming `source` right away into a bounded buffer, so a slow producer (e.g. the server
+    scanning its folder) works while the caller is still busy with something else.
+
+    Has to be created inside a running event loop, call close() if it's never iterated to the end.
+    """
+
+    _DONE = object()
+
+    def __init__(self, source: AsyncIterable, maxsize: int) -> None:
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._task = asyncio.create_task(self._produce(source))
+
+    async def _produce(self, source: AsyncIterable):
+        try:
+            async for item in source:
+                await self._queue.put((item, None))
+        except Exception as e:
+            await self._queue.put((self._DONE, e))
+            return
+        await self._queue.put((self._DONE, None))
+
+    async def __aiter__(self) -> AsyncIterator:
+        try:
+            while True:
+                item, error = await self._queue.get()
+                if error:
+                    raise error
+                if item is self._DONE:
+                    return
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self._task.cancel()
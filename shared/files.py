@@ -1,113 +1,441 @@
 import os
-from typing import Dict, Set
+import time
+from uuid import uuid4
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from models.config import Configuration
-from models.data import Data, File, Folder
-import hashlib
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from models.data import Directory, File, Folder
+from models.file_ops import DeleteResult, Materialize, MaterializeResult, Move, MoveResult
+from models.protocol import ScanStatus, TreeNode
 
 from utils.data_connector import DataConnector
+from utils.index_store import IndexStore
+from shared.clone import clone_file
+from shared.diff import DiffKind, diff_sorted
+from shared.hashing import algorithm_preferences, available_algorithms, get_hash_engine, negotiate_algorithm
+from shared.tree import tree_node, update_digests
+from shared.workers import HashWorkerPool, hash_file_entry
+
+# Files being written by the server before they are atomically renamed into place, never indexed.
+TEMP_PREFIX = ".folder-sync-tmp-"
+
+def temp_path_for(full_path: str) -> str:
+    """Temp file in the same directory as full_path, so os.replace onto it is atomic."""
+    directory, file_name = os.path.split(full_path)
+    return os.path.join(directory, f"{TEMP_PREFIX}{uuid4().hex}-{file_name}")
+
+def _remove_file(full_path: str) -> Optional[str]:
+    try:
+        os.remove(full_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        return str(e)
+    return None
+
+def _ancestors(relative_path: str) -> List[str]:
+    """The directories above relative_path, up to the folder itself ("")."""
+    ancestors = []
+    while relative_path:
+        relative_path = os.path.dirname(relative_path)
+        ancestors.append(relative_path)
+    return ancestors
+
+def prune_empty_directories(base_path: str, directories: Iterable[str]) -> List[str]:
+    """Removes those of `directories` that are empty, deepest first, and their parents that end up
+    empty because of that. The folder itself is kept. Returns the removed ones."""
+    by_depth: Dict[int, set] = defaultdict(set)
+    for path in directories:
+        if path:
+            by_depth[path.count(os.sep) + 1].add(path)
+    removed = []
+    for depth in range(max(by_depth, default=0), 0, -1):
+        for path in by_depth.pop(depth, ()):
+            try:
+                os.rmdir(os.path.join(base_path, path))
+            except OSError:
+                continue # not empty (or already gone)
+            removed.append(path)
+            if os.path.dirname(path):
+                by_depth[depth - 1].add(os.path.dirname(path))
+    return removed
 
 class FileHandler():
-    def __init__(self, config_dc: DataConnector[Configuration], data_dc: DataConnector[Data]) -> None:
-        self.num_workers = config_dc.get().concurrency.max_workers
+    def __init__(self, config_dc: DataConnector[Configuration], index: IndexStore) -> None:
         self.config_dc = config_dc
-        self.data_dc = data_dc
+        self.index = index
+        self.pool = HashWorkerPool(config_dc.get().concurrency)
+        self._folder_locks: Dict[str, Lock] = {}
+        self._folder_locks_lock = Lock()
+        # Bumped whenever a folder's index changes, so results computed from it can be cached.
+        self._generations: Dict[str, int] = defaultdict(int)
+        self.scan_status: Dict[str, ScanStatus] = {}
     
-    def consolidate_folder_data(self, folder: Folder) -> Folder:
-        existing_files_from_disk = self.get_existing_files_metadata(folder.base_path)
-        
-        new_files_on_disk = set(existing_files_from_disk.keys()) - set(folder.files.keys())
-        
-        changed_files = {
-            key for key in existing_files_from_disk.keys() & folder.files.keys()
-            if existing_files_from_disk[key].dateModified != folder.files[key].dateModified
-        }
+    def _folder_lock(self, name: str) -> Lock:
+        with self._folder_locks_lock:
+            return self._folder_locks.setdefault(name, Lock())
+
+    def generation(self, name: str) -> int:
+        return self._generations[name]
+
+    def consolidate_folder_data(self, folder: Folder, algorithm: str, dirty_dirs: Iterable[str] = (),
+                                status: Optional[ScanStatus] = None, on_hashed: Optional[Callable[[str, File], None]] = None,
+                                skip_hashing: Optional[Callable[[Dict[str, File]], Dict[str, File]]] = None) -> Folder:
+        """Refresh the index of `folder` from disk. `dirty_dirs` are listed again even if their mtime
+        didn't change, e.g. because a watcher saw a file inside them being modified. `on_hashed` is
+        called (on the scanning thread) with every file that had to be hashed, as soon as it is.
+
+        `skip_hashing` gets the new and modified files (stat only) before they're hashed and returns
+        those that shouldn't be: with a hash from elsewhere, which is indexed, or without one. Files
+        left without a hash aren't indexed and are passed to `on_hashed` right away; their directories
+        are listed again on the next scan, which would otherwise take them to be gone."""
+        scan_config = self.config_dc.get().scan
+        scan_started = time.time()
+        indexed_directories = self.index.get_directories(folder.name)
+        full_scan = not scan_config.prune_unchanged_dirs or \
+            scan_started - self.index.get_last_full_scan(folder.name) >= scan_config.full_scan_interval
+        dirty_dirs = set(dirty_dirs)
+        existing_files_from_disk, directories = self.scan_folder(
+            folder.base_path, {} if full_scan else folder.files,
+            {} if full_scan else {path: directory.model_copy(update={"mtime_ns": 0}) if path in dirty_dirs else directory
+                                  for path, directory in indexed_directories.items()})
         
-        unchanged_files = {
-            key for key in existing_files_from_disk.keys() & folder.files.keys()
-            if existing_files_from_disk[key].dateModified == folder.files[key].dateModified
-        }
+        files_to_hash: Dict[str, int] = {}
+        deleted_files = []
+        refreshed_dict = {}
+        new_dict = {}
 
-        new_dict = {key: file for key, file in folder.files.items() if key in unchanged_files}
+        def unchanged(on_disk: File, indexed: File) -> bool:
+            return on_disk.same_stat(indexed) and indexed.hash_algorithm == algorithm
 
-        changed_files.update(new_files_on_disk)
-        processed_dict = self.process_files(folder.base_path, changed_files)
+        for action in diff_sorted(sorted(existing_files_from_disk.items()), sorted(folder.files.items()), unchanged, emit_unchanged=True):
+            if action.kind == DiffKind.DELETE:
+                deleted_files.append(action.path)
+            elif action.kind != DiffKind.UNCHANGED:
+                files_to_hash[action.path] = action.local.size
+            elif not action.remote.mtime_ns:
+                # Legacy entry: keep its hash but record the stat fingerprint from now on.
+                refreshed_dict[action.path] = action.local.model_copy(
+                    update={"md5": action.remote.md5, "hash_algorithm": action.remote.hash_algorithm})
+                new_dict[action.path] = refreshed_dict[action.path]
+            else:
+                new_dict[action.path] = action.remote
+
+        skipped = {}
+        if skip_hashing and files_to_hash:
+            skipped = skip_hashing({path: existing_files_from_disk[path] for path in files_to_hash})
+            for path, file in skipped.items():
+                del files_to_hash[path]
+                new_dict[path] = file
+                if file.md5:
+                    refreshed_dict[path] = file
+                    continue
+                parent = os.path.dirname(path)
+                directories[parent] = directories[parent].model_copy(update={"mtime_ns": 0})
+                if on_hashed:
+                    on_hashed(path, file)
+
+        if status:
+            status.state = "hashing"
+            status.files_to_hash, status.bytes_to_hash = len(files_to_hash), sum(files_to_hash.values())
+
+        def on_result(path: str, file: File):
+            if status:
+                status.files_hashed += 1
+                status.bytes_hashed += file.size
+            if on_hashed:
+                on_hashed(path, file)
+
+        processed_dict = self.process_files(folder.base_path, files_to_hash, algorithm, on_result)
         new_dict.update(processed_dict)
-        
-        return Folder(name=folder.name, base_path=folder.base_path, files=new_dict)
+        refreshed_dict.update(processed_dict)
 
-    def process_files(self, base_path: str, file_paths: Set[str]) -> Dict[str, Dict]:
-        result_dict = {}
-        if not file_paths:
-            return result_dict
-        
-        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
-            future_to_path = {executor.submit(self.process_file, base_path, path): path for path in file_paths}
-            for future in as_completed(future_to_path):
-                path = future_to_path[future]
-                file = future.result()
-                result_dict[path] = file
+        # Only the entries that actually changed are written back to the index.
+        self.index.upsert_files(folder.name, folder.base_path, refreshed_dict)
+        self.index.delete_files(folder.name, deleted_files)
+        update_digests(new_dict, directories, files_to_hash.keys() | skipped.keys() | set(deleted_files),
+                       indexed_directories.keys() ^ directories.keys())
+        changed_directories = {
+            path: directory for path, directory in directories.items() if indexed_directories.get(path) != directory
+        }
+        removed_directories = indexed_directories.keys() - directories.keys()
+        self.index.upsert_directories(folder.name, changed_directories)
+        self.index.delete_directories(folder.name, removed_directories)
+        if refreshed_dict or deleted_files or changed_directories or removed_directories:
+            self._generations[folder.name] += 1
+        if full_scan:
+            self.index.set_last_full_scan(folder.name, scan_started)
         
-        return result_dict
+        return Folder(name=folder.name, base_path=folder.base_path, files=new_dict)
 
-    def process_file(self, base_path: str, file_path: str) -> File:
-        last_modified = self.get_file_last_modified(os.path.join(base_path, file_path))
-        md5 = self.get_file_md5(os.path.join(base_path, file_path))
-        return File(dateModified=last_modified, md5=md5)
+    def process_files(self, base_path: str, file_sizes: Dict[str, int], algorithm: str,
+                      on_result: Optional[Callable[[str, File], None]] = None) -> Dict[str, File]:
+        return self.pool.hash_files(base_path, file_sizes, algorithm, self.config_dc.get().hashing, on_result)
 
-    def get_file_last_modified(self, file_path: str) -> float:
-        return os.path.getmtime(file_path)
+    def process_file(self, base_path: str, file_path: str, algorithm: str) -> File:
+        return hash_file_entry(base_path, file_path, algorithm, self.config_dc.get().hashing)
 
-    def get_file_md5(self, file_path: str) -> str:
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as file:
-            for chunk in iter(lambda: file.read(4096), b""):
-                hash_md5.update(chunk)
-        digest = hash_md5.hexdigest()
-        print(f"MD5 for: {file_path} - {digest}")
-        return digest
+    def get_file_hash(self, file_path: str, algorithm: str) -> str:
+        hashing = self.config_dc.get().hashing
+        return get_hash_engine(algorithm).hash_file(file_path, hashing.buffer_size, hashing.use_mmap)
 
     def get_existing_files_metadata(self, parentPath: str) -> Dict[str, File]:
-        """Recursively get all files within parentPath with their modified timestamps.
+        """Recursively get all files within parentPath with their stat fingerprint.
         
         Args:
             parentPath (str): The path of the directory to scan.
             
         Returns:
-            Dict[str, float]: A dictionary where the keys are relative file paths
-                            and values are their last modified timestamps.
+            Dict[str, File]: A dictionary where the keys are relative file paths
+                            and values hold size, mtime and inode of each file (no hash).
         """
-        files_with_timestamps: Dict[str, File] = {}
-
-        # Walk through directory tree
-        for root, _, files in os.walk(parentPath):
-            for file in files:
-                # Full file path
-                full_path = os.path.join(root, file)
-                # Relative file path
-                relative_path = os.path.relpath(full_path, parentPath)
-                # Modified time
-                modified_time = os.path.getmtime(full_path)
-                # Store in dictionary
-                files_with_timestamps[relative_path] = File(dateModified=modified_time)
+        files, _ = self.scan_folder(parentPath, {}, {})
+        return files
+
+    def scan_folder(self, parentPath: str, indexed_files: Dict[str, File],
+                    indexed_directories: Dict[str, Directory]) -> Tuple[Dict[str, File], Dict[str, Directory]]:
+        """Scan parentPath, skipping the listing of directories whose mtime matches the index.
+
+        A directory's mtime only changes when entries are added, removed or renamed, so the
+        indexed files and sub directories of an unchanged directory are taken from the index
+        instead of listing it. Its files are still stat'ed, editing a file in place doesn't
+        change its directory's mtime. Pass empty indexes to list every directory.
+        """
+        files_by_dir: Dict[str, List[str]] = defaultdict(list)
+        for path in indexed_files.keys():
+            files_by_dir[os.path.dirname(path)].append(path)
+        dirs_by_parent: Dict[str, List[str]] = defaultdict(list)
+        for path in indexed_directories.keys():
+            if path:
+                dirs_by_parent[os.path.dirname(path)].append(path)
+
+        # Directories touched this close to the scan may change again within the same mtime tick.
+        racy_mtime_ns = time.time_ns() - 2 * 10**9
+        files_with_stats: Dict[str, File] = {}
+        directories: Dict[str, Directory] = {}
+        pending_dirs = [""]
+
+        while pending_dirs:
+            relative_dir = pending_dirs.pop()
+            full_dir = os.path.join(parentPath, relative_dir)
+            try:
+                dir_mtime_ns = os.stat(full_dir).st_mtime_ns
+            except OSError as e:
+                print(f"Skipping {relative_dir}: {e}")
+                continue
+            indexed_directory = indexed_directories.get(relative_dir)
+            if indexed_directory and indexed_directory.mtime_ns == dir_mtime_ns:
+                directories[relative_dir] = indexed_directory
+                for path in files_by_dir[relative_dir]:
+                    try:
+                        files_with_stats[path] = File.from_stat(os.stat(os.path.join(parentPath, path)))
+                    except OSError:
+                        pass # removed since the directory's stat, the next scan lists the directory again
+                pending_dirs.extend(dirs_by_parent[relative_dir])
+                continue
+
+            entry_count = 0
+            with os.scandir(full_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith(TEMP_PREFIX):
+                        continue
+                    relative_path = os.path.join(relative_dir, entry.name)
+                    try:
+                        # Names that aren't valid in the file system's encoding (kept as surrogate escapes) can't be indexed.
+                        entry.name.encode("utf-8")
+                    except UnicodeEncodeError:
+                        print(f"Skipping {relative_path!r}: its name isn't valid UTF-8")
+                        continue
+                    entry_count += 1
+                    try:
+                        if entry.is_dir():
+                            # Same as os.walk: symlinked directories are not followed.
+                            if not entry.is_symlink():
+                                pending_dirs.append(relative_path)
+                            continue
+                        files_with_stats[relative_path] = File.from_stat(entry.stat())
+                    except OSError as e:
+                        print(f"Skipping {relative_path}: {e}")
+            directories[relative_dir] = Directory(
+                mtime_ns=dir_mtime_ns if dir_mtime_ns < racy_mtime_ns else 0, entry_count=entry_count)
         
-        return files_with_timestamps
+        return files_with_stats, directories
     
-    def get_folder_metadata(self, name: str) -> Folder:
+    def get_folder_metadata(self, name: str, algorithm: Optional[str] = None, dirty_dirs: Iterable[str] = (),
+                            on_hashed: Optional[Callable[[str, File], None]] = None,
+                            skip_hashing: Optional[Callable[[Dict[str, File]], Dict[str, File]]] = None) -> Folder:
         if not name in self.config_dc.get().folders.keys():
             raise FileNotFoundError(f"{name} not configured in config.json")
         print("Get Folder Metadata - Calculating")
         base_path = self.config_dc.get().folders.get(name).base_path
-        folder = self.get_previous_folder_data(name=name, base_path=base_path)
-        fresh_folder_data = self.consolidate_folder_data(folder=folder)
-        self.update_folder_data(fresh_folder_data)
+        algorithm = algorithm or self.default_algorithm()
+        # One scan of a folder at a time, e.g. a request and the folder's watcher.
+        with self._folder_lock(name):
+            status = self.scan_status[name] = ScanStatus(name=name, algorithm=algorithm, started=time.time())
+            try:
+                folder = self.get_previous_folder_data(name=name, base_path=base_path)
+                fresh_folder_data = self.consolidate_folder_data(folder=folder, algorithm=algorithm, dirty_dirs=dirty_dirs, status=status,
+                                                                 on_hashed=on_hashed, skip_hashing=skip_hashing)
+                status.state = "done"
+            except Exception:
+                status.state = "failed"
+                raise
+            finally:
+                status.finished = time.time()
         print("Get Folder Metadata - Done")
         return fresh_folder_data
 
+    def hash_preferences(self) -> List[str]:
+        return algorithm_preferences(self.config_dc.get().hashing.algorithm)
+
+    def default_algorithm(self) -> str:
+        return negotiate_algorithm(self.hash_preferences(), available_algorithms())
+
     def get_previous_folder_data(self, name: str, base_path: str) -> Folder:
-        return self.data_dc.get().folders.get(name) if name in self.data_dc.get().folders.keys() else Folder(base_path=base_path, name=name, files={})
+        return self.index.get_folder(name=name, base_path=base_path)
+
+    def get_files_page(self, name: str, after: str, limit: int) -> List[Tuple[str, File]]:
+        return self.index.get_files_page(name, after, limit)
+
+    def get_directories(self, name: str) -> Dict[str, Directory]:
+        return self.index.get_directories(name)
+
+    def get_tree_nodes(self, name: str, paths: List[str]) -> List[TreeNode]:
+        """Nodes of the last scan's hash tree, TreeNode(path=path) for directories that don't exist."""
+        nodes = []
+        for path in paths:
+            directory, files, directories = self.index.get_children(name, path)
+            nodes.append(tree_node(path, directory, files, directories) if directory else TreeNode(path=path))
+        return nodes
+
+    def get_file_data(self, name: str, relative_path: str) -> Optional[File]:
+        return self.index.get_file(name, relative_path)
+
+    def update_file_data(self, name: str, relative_path: str, file: File):
+        self.update_files_data(name, {relative_path: file})
 
-    def update_folder_data(self, folder: Folder):
-        data = self.data_dc.get()
-        data.folders[folder.name] = folder
-        self.data_dc.update_data(data)
+    def update_files_data(self, name: str, files: Dict[str, File]):
+        """Index files written with a known hash (e.g. just received), the next scan finds their stat unchanged and doesn't read them."""
+        if not files:
+            return
+        base_path = self.config_dc.get().folders.get(name).base_path
+        self.index.upsert_files(name, base_path, files)
+        self._changed_outside_scan(name, files)
+
+    def _changed_outside_scan(self, name: str, relative_paths: Iterable[str]):
+        """Files were written or removed (and their entries updated) outside a scan: the digests of
+        their directories are outdated until the next scan, the tree mustn't claim them unchanged."""
+        self.index.clear_digests(name, {directory for path in relative_paths for directory in _ancestors(path)})
+        self._generations[name] += 1
+
+    def move_files(self, name: str, moves: List[Move]) -> List[MoveResult]:
+        """Move (or copy) files within a folder. Their index entries move along, so they aren't hashed again."""
+        base_path = self.config_dc.get().folders.get(name).base_path
+        results, moved, removed = [], {}, []
+        for move in moves:
+            source, destination = os.path.join(base_path, move.source), os.path.join(base_path, move.destination)
+            temp_path = None
+            try:
+                indexed = self.index.get_file(name, move.source)
+                if move.hash and not (indexed and indexed.same_stat(File.from_stat(os.stat(source))) and
+                                      indexed.hash_algorithm == move.hash_algorithm and indexed.md5 == move.hash):
+                    results.append(MoveResult(source=move.source, destination=move.destination, success=False,
+                                              error="Source doesn't hold the expected content"))
+                    continue
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                if move.keep_source:
+                    temp_path = temp_path_for(destination)
+                    clone_file(source, temp_path, self.config_dc.get().dedup.allow_hardlinks)
+                    os.replace(temp_path, destination)
+                else:
+                    os.replace(source, destination)
+                    removed.append(move.source)
+                if indexed:
+                    moved[move.destination] = File.from_stat(os.stat(destination)).model_copy(
+                        update={"md5": indexed.md5, "hash_algorithm": indexed.hash_algorithm})
+                results.append(MoveResult(source=move.source, destination=move.destination, success=True))
+            except OSError as e:
+                results.append(MoveResult(source=move.source, destination=move.destination, success=False, error=str(e)))
+            finally:
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+        self.index.upsert_files(name, base_path, moved)
+        self.index.delete_files(name, removed)
+        self._changed_outside_scan(name, [result.destination for result in results if result.success] + removed)
+        return results
+
+    def have_hashes(self, hash_algorithm: str, hashes: Iterable[str]) -> List[str]:
+        """The hashes that some file of a configured folder has, according to the index."""
+        folders = self.config_dc.get().folders
+        found = self.index.find_by_hash(hash_algorithm, hashes)
+        return [digest for digest, entries in found.items() if any(folder in folders for folder, _, _ in entries)]
+
+    def materialize_files(self, name: str, entries: List[Materialize]) -> List[MaterializeResult]:
+        """Create files from content that's already on the server (in any folder) instead of receiving it.
+
+        Indexed copies are used when their stat still matches the index, an entry's `source` hint
+        (not indexed yet) only after hashing it.
+        """
+        config = self.config_dc.get()
+        base_path = config.folders.get(name).base_path
+        found = {}
+        for hash_algorithm in {entry.hash_algorithm for entry in entries}:
+            found[hash_algorithm] = self.index.find_by_hash(hash_algorithm, {entry.hash for entry in entries if entry.hash_algorithm == hash_algorithm})
+        results, materialized = [], {}
+        for entry in entries:
+            destination = os.path.join(base_path, entry.path)
+            candidates = [(os.path.join(config.folders[folder].base_path, path), file)
+                          for folder, path, file in found[entry.hash_algorithm].get(entry.hash, [])
+                          if folder in config.folders and file.size == entry.size and (folder, path) != (name, entry.path)]
+            if entry.source:
+                candidates.append((os.path.join(base_path, entry.source), None))
+            result = MaterializeResult(path=entry.path, success=False, error="No copy of the content on the server")
+            for source, file in candidates:
+                temp_path = None
+                try:
+                    if file is not None and not File.from_stat(os.stat(source)).same_stat(file):
+                        continue
+                    if file is None and self.get_file_hash(source, entry.hash_algorithm) != entry.hash:
+                        continue
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    temp_path = temp_path_for(destination)
+                    method = clone_file(source, temp_path, config.dedup.allow_hardlinks)
+                    os.replace(temp_path, destination)
+                    materialized[entry.path] = File.from_stat(os.stat(destination)).model_copy(
+                        update={"md5": entry.hash, "hash_algorithm": entry.hash_algorithm})
+                    result = MaterializeResult(path=entry.path, success=True, method=method)
+                    break
+                except OSError as e:
+                    result.error = str(e)
+                finally:
+                    if temp_path and os.path.exists(temp_path):
+                        os.remove(temp_path)
+            results.append(result)
+        if materialized:
+            self.index.upsert_files(name, base_path, materialized)
+            self._changed_outside_scan(name, materialized)
+        return results
+
+    def delete_files(self, name: str, relative_paths: List[str]) -> List[DeleteResult]:
+        return list(self.iter_delete_files(name, relative_paths))
+
+    def iter_delete_files(self, name: str, relative_paths: List[str]) -> Iterator[DeleteResult]:
+        """Delete files on a pool of threads, yielding each result as soon as it's known (in no particular
+        order), then the directories left empty. Their index entries go in the same transaction, also when
+        the caller stops early. A file that's already gone counts as deleted."""
+        base_path = self.config_dc.get().folders.get(name).base_path
+        executor = ThreadPoolExecutor(max_workers=self.config_dc.get().concurrency.delete_workers)
+        futures = {executor.submit(_remove_file, os.path.join(base_path, path)): path for path in relative_paths}
+        try:
+            for future in as_completed(futures):
+                error = future.result()
+                yield DeleteResult(path=futures[future], success=error is None, error=error)
+        finally:
+            # Deletes that didn't start yet are dropped when stopped early, the ones that did are recorded.
+            executor.shutdown(cancel_futures=True)
+            deleted = [path for future, path in futures.items() if not future.cancelled() and future.result() is None]
+            removed_directories = prune_empty_directories(base_path, {os.path.dirname(path) for path in deleted})
+            self.index.delete_paths(name, deleted, removed_directories)
+            self._changed_outside_scan(name, deleted)
@@ -0,0 +1,117 @@
+import hashlib
+import mmap
+import os
+import threading
+from typing import BinaryIO, Callable, Dict, List
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_ALGORITHM = "md5"
+AUTO = "auto"
+
+_buffers = threading.local()
+
+def _get_buffer(buffer_size: int) -> bytearray:
+    # One buffer per thread, reused for every file hashed on it.
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None or len(buffer) != buffer_size:
+        buffer = _buffers.buffer = bytearray(buffer_size)
+    return buffer
+
+def _fadvise(fd: int, advice_name: str, length: int = 0):
+    # Linux only: read-ahead for sequential hashing, and dropping the pages afterwards
+    # so hashing a big tree doesn't evict everything else from the page cache.
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, length, getattr(os, advice_name))
+        except OSError:
+            pass
+
+class HashEngine():
+    def __init__(self, name: str, factory: Callable, releases_gil: bool) -> None:
+        self.name = name
+        self.factory = factory
+        self.releases_gil = releases_gil
+
+    def new(self):
+        return self.factory()
+
+    def hash_file(self, file_path: str, buffer_size: int, use_mmap: bool = False) -> str:
+        hasher = self.new()
+        with open(file_path, "rb", buffering=0) as file:
+            fd = file.fileno()
+            size = os.fstat(fd).st_size
+            # Not worth the extra syscalls for files that fit in a single read.
+            advise = size > buffer_size
+            if advise:
+                _fadvise(fd, "POSIX_FADV_SEQUENTIAL")
+            if use_mmap and size > 0:
+                self._update_from_mmap(hasher, fd, size, buffer_size)
+            else:
+                buffer = _get_buffer(buffer_size)
+                view = memoryview(buffer)
+                while read := file.readinto(buffer):
+                    hasher.update(view[:read])
+            if advise:
+                _fadvise(fd, "POSIX_FADV_DONTNEED")
+        return hasher.hexdigest()
+
+    def _update_from_mmap(self, hasher, fd: int, size: int, buffer_size: int):
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for offset in range(0, size, buffer_size):
+                    hasher.update(view[offset:offset + buffer_size])
+
+class HashingReader():
+    """File-like wrapper that hashes whatever is read through it, e.g. a file while it's uploaded."""
+
+    def __init__(self, file: BinaryIO, algorithm: str) -> None:
+        self.file = file
+        self._hasher = get_hash_engine(algorithm).new()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self._hasher.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
+
+# Ordered fastest first, this is also the preference order of the "auto" setting.
+_engines: Dict[str, HashEngine] = {}
+if blake3:
+    _engines["blake3"] = HashEngine("blake3", lambda: blake3.blake3(), releases_gil=True)
+if xxhash:
+    _engines["xxh3_128"] = HashEngine("xxh3_128", lambda: xxhash.xxh3_128(), releases_gil=False)
+_engines["blake2b"] = HashEngine("blake2b", lambda: hashlib.blake2b(), releases_gil=True)
+_engines["md5"] = HashEngine("md5", lambda: hashlib.md5(), releases_gil=True)
+
+def available_algorithms() -> List[str]:
+    return list(_engines.keys())
+
+def get_hash_engine(algorithm: str) -> HashEngine:
+    if algorithm not in _engines:
+        raise ValueError(f"Hash algorithm {algorithm} is not available, choose one of: {available_algorithms()}")
+    return _engines[algorithm]
+
+def algorithm_preferences(configured: str) -> List[str]:
+    if configured == AUTO:
+        return available_algorithms()
+    return [configured, DEFAULT_ALGORITHM] if configured != DEFAULT_ALGORITHM else [DEFAULT_ALGORITHM]
+
+def negotiate_algorithm(preferences: List[str], offered: List[str]) -> str:
+    """First locally available preference the other side offers, MD5 is the common ground for older versions."""
+    for algorithm in preferences:
+        if algorithm in _engines and algorithm in offered:
+            return algorithm
+    return DEFAULT_ALGORITHM
@@ -0,0 +1,125 @@
+"""Merkle tree over a folder.
+
+A directory's digest covers the names and hashes of its files and the names and digests of
+its sub directories, so two directories with the same digest hold the same files and the
+sync only has to look inside the ones that differ.
+"""
+import hashlib
+import os
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Set
+from models.data import Directory, File
+from models.protocol import TreeNode
+from shared.diff import DiffAction, DiffKind, diff_sorted
+
+_FILE = b"F"
+_DIRECTORY = b"D"
+
+def _encode(name: str) -> bytes:
+    # Undecodable file names come back from os.scandir as surrogate escapes.
+    return name.encode("utf-8", "surrogateescape")
+
+def directory_digest(files: Dict[str, File], directories: Dict[str, str]) -> str:
+    """Digest of one directory from its files and sub directory digests, both keyed by name."""
+    hasher = hashlib.blake2b(digest_size=16)
+    for name, file in sorted(files.items()):
+        hasher.update(_FILE + _encode(name) + b"\0" + f"{file.hash_algorithm}:{file.md5}".encode() + b"\0")
+    for name, digest in sorted(directories.items()):
+        hasher.update(_DIRECTORY + _encode(name) + b"\0" + digest.encode() + b"\0")
+    return hasher.hexdigest()
+
+def _depth(path: str) -> int:
+    return path.count(os.sep) + 1 if path else 0
+
+def _mark(dirty: Set[str], directory: str):
+    while directory not in dirty:
+        dirty.add(directory)
+        if not directory:
+            return
+        directory = os.path.dirname(directory)
+
+def update_digests(files: Dict[str, File], directories: Dict[str, Directory], changed_files: Iterable[str],
+                   changed_directories: Iterable[str]) -> None:
+    """Recompute, in place, the digests of the directories above the changed (added, modified or
+    removed) paths and of directories that don't have one yet. Everything else keeps its digest."""
+    dirty: Set[str] = set()
+    for path in changed_files:
+        _mark(dirty, os.path.dirname(path))
+    for path in changed_directories:
+        _mark(dirty, path if path in directories else os.path.dirname(path))
+    for path, directory in directories.items():
+        if not directory.digest:
+            _mark(dirty, path)
+    if not dirty:
+        return
+
+    files_by_dir: Dict[str, Dict[str, File]] = defaultdict(dict)
+    for path, file in files.items():
+        parent = os.path.dirname(path)
+        if parent in dirty:
+            files_by_dir[parent][os.path.basename(path)] = file
+    dirs_by_parent: Dict[str, List[str]] = defaultdict(list)
+    for path in directories.keys():
+        if path and os.path.dirname(path) in dirty:
+            dirs_by_parent[os.path.dirname(path)].append(path)
+
+    # Children before their parents.
+    for path in sorted(dirty & directories.keys(), key=_depth, reverse=True):
+        digest = directory_digest(files_by_dir[path], {os.path.basename(child): directories[child].digest
+                                                       for child in dirs_by_parent[path]})
+        # Copied, the caller compares against the objects it read from the index.
+        directories[path] = directories[path].model_copy(update={"digest": digest})
+
+def tree_node(path: str, directory: Directory, files: Dict[str, File], directories: Dict[str, Directory]) -> TreeNode:
+    """`files` and `directories` are the direct children of `path`, keyed by relative path."""
+    return TreeNode(path=path, digest=directory.digest,
+                    files={os.path.basename(child): file for child, file in files.items()},
+                    directories={os.path.basename(child): sub.digest for child, sub in directories.items()})
+
+def build_tree_nodes(files: Dict[str, File], directories: Dict[str, Directory]) -> Dict[str, TreeNode]:
+    nodes = {path: TreeNode(path=path, digest=directory.digest) for path, directory in directories.items()}
+    for path, file in files.items():
+        parent = nodes.get(os.path.dirname(path))
+        if parent:
+            parent.files[os.path.basename(path)] = file
+    for path, directory in directories.items():
+        parent = nodes.get(os.path.dirname(path)) if path else None
+        if parent:
+            parent.directories[os.path.basename(path)] = directory.digest
+    return nodes
+
+def _local_subtree(nodes: Dict[str, TreeNode], path: str) -> Iterator[DiffAction]:
+    node = nodes[path]
+    for name, file in sorted(node.files.items()):
+        yield DiffAction(DiffKind.COPY_NEW, os.path.join(path, name), local=file)
+    for name in sorted(node.directories.keys()):
+        yield from _local_subtree(nodes, os.path.join(path, name))
+
+async def diff_tree(local_nodes: Dict[str, TreeNode], remote_root: TreeNode,
+                    fetch: Callable[[List[str]], Awaitable[List[TreeNode]]]):
+    """Yields the same actions as diff_sorted, descending only into directories whose digests differ.
+
+    `fetch` returns the remote nodes for a list of directory paths, it's called once per level
+    of the tree that has differences. Sub trees missing on the remote are listed locally.
+    """
+    remote_nodes = [remote_root]
+    while remote_nodes:
+        pending = []
+        for remote in remote_nodes:
+            local = local_nodes.get(remote.path) or TreeNode(path=remote.path)
+            if local.digest == remote.digest:
+                continue
+            files = diff_sorted(((os.path.join(remote.path, name), file) for name, file in sorted(local.files.items())),
+                                ((os.path.join(remote.path, name), file) for name, file in sorted(remote.files.items())))
+            for action in files:
+                yield action
+            for name in sorted(local.directories.keys() | remote.directories.keys()):
+                if local.directories.get(name) == remote.directories.get(name):
+                    continue
+                child = os.path.join(remote.path, name)
+                if name in remote.directories:
+                    pending.append(child)
+                else:
+                    for action in _local_subtree(local_nodes, child):
+                        yield action
+        remote_nodes = await fetch(pending) if pending else []
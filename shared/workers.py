@@ -0,0 +1,102 @@
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+from models.config import Concurrency, Hashing
+from models.data import File
+from shared.hashing import get_hash_engine
+
+def hash_file_entry(base_path: str, relative_path: str, algorithm: str, hashing: Hashing) -> File:
+    full_path = os.path.join(base_path, relative_path)
+    file = File.from_stat(os.stat(full_path))
+    file.md5 = get_hash_engine(algorithm).hash_file(full_path, hashing.buffer_size, hashing.use_mmap)
+    file.hash_algorithm = algorithm
+    return file
+
+def hash_batch(base_path: str, relative_paths: List[str], algorithm: str, hashing: Hashing) -> List[Tuple[str, File]]:
+    """Runs inside a worker, so a whole batch of small files costs a single round-trip."""
+    results = []
+    for relative_path in relative_paths:
+        try:
+            results.append((relative_path, hash_file_entry(base_path, relative_path, algorithm, hashing)))
+        except FileNotFoundError:
+            # Removed since the scan, the next scan reports it as deleted.
+            print(f"Skipping {relative_path}: file disappeared before hashing")
+    return results
+
+@dataclass
+class HashStats():
+    files: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+class HashWorkerPool():
+    """Long-lived hashing workers shared by every sync of the process.
+
+    Small files are grouped into batches, files above `large_file_threshold` go to a separate
+    lane so a single huge file doesn't hold back everything else. Threads are used when the
+    hash releases the GIL, processes otherwise.
+    """
+
+    def __init__(self, concurrency: Concurrency) -> None:
+        self.concurrency = concurrency
+        self.last_stats = HashStats()
+        self._executors: Dict[Tuple[str, bool], Executor] = {}
+        self._lock = Lock()
+
+    def _executor(self, lane: str, use_threads: bool) -> Executor:
+        with self._lock:
+            key = (lane, use_threads)
+            if key not in self._executors:
+                workers = self.concurrency.large_file_workers if lane == "large" else self.concurrency.max_workers
+                executor_cls = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+                self._executors[key] = executor_cls(max_workers=workers)
+            return self._executors[key]
+
+    def hash_files(self, base_path: str, sizes: Dict[str, int], algorithm: str, hashing: Hashing,
+                   on_result: Optional[Callable[[str, File], None]] = None) -> Dict[str, File]:
+        if not sizes:
+            return {}
+        use_threads = get_hash_engine(algorithm).releases_gil
+        executor = self._executor("small", use_threads)
+        large_executor = self._executor("large", use_threads)
+        started = time.monotonic()
+        futures = []
+        batch, batch_bytes = [], 0
+
+        for relative_path, size in sizes.items():
+            if size >= self.concurrency.large_file_threshold:
+                futures.append(large_executor.submit(hash_batch, base_path, [relative_path], algorithm, hashing))
+                continue
+            batch.append(relative_path)
+            batch_bytes += size
+            if len(batch) >= self.concurrency.batch_max_files or batch_bytes >= self.concurrency.batch_max_bytes:
+                futures.append(executor.submit(hash_batch, base_path, batch, algorithm, hashing))
+                batch, batch_bytes = [], 0
+        if batch:
+            futures.append(executor.submit(hash_batch, base_path, batch, algorithm, hashing))
+
+        result_dict: Dict[str, File] = {}
+        for future in as_completed(futures):
+            for relative_path, file in future.result():
+                result_dict[relative_path] = file
+                if on_result:
+                    on_result(relative_path, file)
+
+        self.last_stats = HashStats(files=len(result_dict), bytes=sum(file.size for file in result_dict.values()),
+                                    seconds=time.monotonic() - started)
+        print(f"Hashed {self.last_stats.files} files, {self.last_stats.bytes} bytes "
+              f"in {self.last_stats.seconds:.1f}s ({self.last_stats.bytes_per_second / 1024 / 1024:.1f} MiB/s)")
+        return result_dict
+
+    def shutdown(self):
+        with self._lock:
+            for executor in self._executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            self._executors.clear()
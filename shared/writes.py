@@ -0,0 +1,116 @@
+"""Writing received files so that readers only ever see complete ones.
+
+Content goes to a temp file next to the target, which is renamed over the target once it
+is complete and has the expected hash. A rename is only durable once its directory has been
+fsynced; DirectorySyncer does that for every directory written to by the uploads finishing at
+about the same time together, so many small files don't each pay for their own.
+"""
+import asyncio
+import os
+from typing import Iterable, Optional, Set
+from models.data import File
+from shared.files import temp_path_for
+from shared.hashing import get_hash_engine
+
+def fsync_directory(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return # Windows can't open directories, its renames don't need it
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass # some file systems don't support fsync on directories
+    finally:
+        os.close(fd)
+
+def received_entry(stat: os.stat_result, digest: str, algorithm: str) -> File:
+    """Index entry of a file that was written with known content."""
+    return File.from_stat(stat).model_copy(update={"md5": digest, "hash_algorithm": algorithm})
+
+class AtomicWriter():
+    """Writes `full_path` through a temp file, hashing the content on the way if an algorithm is given."""
+
+    def __init__(self, full_path: str, algorithm: Optional[str] = None, fsync: bool = True) -> None:
+        self.full_path = full_path
+        self.algorithm = algorithm
+        self.fsync = fsync
+        self.size = 0
+        self.stat: Optional[os.stat_result] = None # of the committed file
+        self._hasher = get_hash_engine(algorithm).new() if algorithm else None
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        self.temp_path = temp_path_for(full_path)
+        self._file = open(self.temp_path, "wb")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self.size += len(data)
+        if self._hasher:
+            self._hasher.update(data)
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest() if self._hasher else ""
+
+    def entry(self) -> Optional[File]:
+        """Index entry of the committed file, None if its content wasn't hashed."""
+        if self.stat is None or self._hasher is None:
+            return None
+        return received_entry(self.stat, self.hexdigest(), self.algorithm)
+
+    def commit(self, expected_hash: Optional[str] = None, mtime_ns: int = 0) -> bool:
+        """Renames the file into place, unless its hash isn't the expected one (then it's discarded).
+
+        The directory still has to be fsynced for the rename to survive a crash.
+        """
+        try:
+            if expected_hash and self.hexdigest() != expected_hash:
+                return False
+            self._file.flush()
+            if mtime_ns:
+                os.utime(self.temp_path, ns=(mtime_ns, mtime_ns))
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            # Taken before the rename, so it's this content's stat even if the file changes right after.
+            self.stat = os.fstat(self._file.fileno())
+            self._file.close()
+            os.replace(self.temp_path, self.full_path)
+            return True
+        finally:
+            self.abort()
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class DirectorySyncer():
+    """Group commit for directory fsyncs.
+
+    Callers add the directories they renamed files into and wait for them to be synced. While
+    one round of fsyncs runs, the directories of the next callers are collected and all of
+    them are synced once in the next round.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Set[str] = set()
+        self._next: Optional[asyncio.Task] = None
+        self._running = asyncio.Lock()
+
+    async def sync(self, directories: Iterable[str]):
+        self._pending.update(directories)
+        if not self._pending:
+            return
+        if self._next is None:
+            self._next = asyncio.get_running_loop().create_task(self._flush())
+        # Shielded, a caller going away doesn't cancel the round for the others in it.
+        await asyncio.shield(self._next)
+
+    async def _flush(self):
+        async with self._running:
+            directories, self._pending, self._next = self._pending, set(), None
+            await asyncio.to_thread(_fsync_directories, directories)
+
+def _fsync_directories(directories: Set[str]):
+    for directory in directories:
+        fsync_directory(directory)
@@ -0,0 +1,89 @@
+import importlib.util
+import os
+import sys
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.config import Configuration, TrackingFolder
+from shared.files import FileHandler
+from utils.data_connector import DataConnector
+from utils.index_store import SqliteIndexStore
+
+def set_old_mtime(path: str, seconds_ago: int = 10):
+    """Directories touched within the last seconds aren't trusted for pruning, see FileHandler.scan_folder."""
+    mtime_ns = os.stat(path).st_mtime_ns - seconds_ago * 10**9
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+@pytest.fixture
+def folder_path(tmp_path):
+    path = tmp_path / "folder"
+    path.mkdir()
+    return path
+
+@pytest.fixture
+def fh(tmp_path, folder_path):
+    config = Configuration(folders={"F": TrackingFolder(name="F", base_path=str(folder_path))})
+    config_dc = DataConnector(relative_file_path=str(tmp_path / "config.json"), cls=Configuration, default_data=config)
+    handler = FileHandler(config_dc, SqliteIndexStore(str(tmp_path / "index.db")))
+    yield handler
+    handler.pool.shutdown()
+
+@pytest.fixture(scope="session")
+def http_client(tmp_path_factory):
+    """client.http_client, imported where client.storage can create its config and index (relative to the working directory)."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("client_app"))
+    os.mkdir("client")
+    try:
+        import client.http_client as module
+    finally:
+        os.chdir(cwd)
+    return module
+
+@pytest.fixture
+def server_requests(http_client, monkeypatch):
+    """Routes the requests of http_client to `server_requests.handler`, a function of an httpx.Request."""
+    class Server():
+        handler = None
+    server = Server()
+    transport = httpx.MockTransport(lambda request: server.handler(request))
+    monkeypatch.setattr(http_client, "client", httpx.AsyncClient(transport=transport))
+    return server
+
+@pytest.fixture(scope="session")
+def server_module(tmp_path_factory):
+    """server.py (named like the server package), imported where server.storage can create its config and index."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("server_app"))
+    os.mkdir("server")
+    try:
+        spec = importlib.util.spec_from_file_location("server_app", os.path.join(os.path.dirname(os.path.dirname(__file__)), "server.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+@pytest.fixture
+def server(server_module, tmp_path, folder_path, monkeypatch):
+    """A TestClient of the server, with folder "F" at `folder_path` and its own index."""
+    from fastapi.testclient import TestClient
+    from server.scans import ScanCoordinator
+    from server.uploads import UploadSessions
+    from server.watcher import FolderWatchers
+    from utils.upload_session_store import SqliteUploadSessionStore
+    config = Configuration(folders={"F": TrackingFolder(name="F", base_path=str(folder_path))})
+    config_dc = DataConnector(relative_file_path=str(tmp_path / "config.json"), cls=Configuration, default_data=config)
+    handler = FileHandler(config_dc, SqliteIndexStore(str(tmp_path / "index.db")))
+    watchers = FolderWatchers(handler)
+    scans = ScanCoordinator(handler, watchers)
+    monkeypatch.setattr(server_module, "get_config_dc", lambda: config_dc)
+    monkeypatch.setattr(server_module, "fh", handler)
+    monkeypatch.setattr(server_module, "watchers", watchers)
+    monkeypatch.setattr(server_module, "scans", scans)
+    monkeypatch.setattr(server_module, "upload_sessions", UploadSessions(handler, SqliteUploadSessionStore(str(tmp_path / "index.db"))))
+    yield TestClient(server_module.app)
+    scans.shutdown()
+    handler.pool.shutdown()
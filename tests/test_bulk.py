@@ -0,0 +1,50 @@
+import hashlib
+import os
+from shared.bulk import BulkWriter, encode_header
+from shared.files import TEMP_PREFIX
+
+def frame(path: str, data: bytes, **header) -> bytes:
+    return encode_header(path, len(data), **header) + data
+
+def feed_in_pieces(writer: BulkWriter, stream: bytes, piece_size: int):
+    results = []
+    for offset in range(0, len(stream), piece_size):
+        results.extend(writer.feed(stream[offset:offset + piece_size]))
+    return results + writer.finish()
+
+def test_files_are_unpacked(tmp_path):
+    files = {"a.txt": b"hello", "dir/sub/b.bin": os.urandom(5000), "empty": b""}
+    stream = b"".join(frame(path, data) for path, data in files.items())
+    for piece_size in (1, 7, 4096, len(stream)):
+        base = tmp_path / str(piece_size)
+        results = feed_in_pieces(BulkWriter(str(base), fsync=False), stream, piece_size)
+        assert [(result.path, result.success) for result in results] == [(path, True) for path in files]
+        for path, data in files.items():
+            assert (base / path).read_bytes() == data
+
+def test_hash_and_mtime_from_the_header(tmp_path):
+    data = b"content"
+    digest = hashlib.md5(data).hexdigest()
+    mtime_ns = 1_600_000_000_123_456_789
+    writer = BulkWriter(str(tmp_path), fsync=False)
+    results = feed_in_pieces(writer, frame("f", data, hash=digest, algorithm="md5", mtime_ns=mtime_ns), 3)
+    assert results[0].success
+    assert os.stat(tmp_path / "f").st_mtime_ns == mtime_ns
+    assert writer.received["f"].md5 == digest
+    assert writer.received["f"].size == len(data)
+    assert writer.directories == {str(tmp_path)}
+
+def test_hash_mismatch_only_fails_that_file(tmp_path):
+    (tmp_path / "bad").write_bytes(b"old")
+    stream = frame("bad", b"new", hash="0" * 32, algorithm="md5") + frame("good", b"fine")
+    results = feed_in_pieces(BulkWriter(str(tmp_path), fsync=False), stream, 5)
+    assert [(result.path, result.success) for result in results] == [("bad", False), ("good", True)]
+    assert (tmp_path / "bad").read_bytes() == b"old"
+    assert (tmp_path / "good").read_bytes() == b"fine"
+
+def test_truncated_stream_fails_the_last_file(tmp_path):
+    stream = frame("whole", b"12345") + frame("cut", b"67890")[:-2]
+    results = feed_in_pieces(BulkWriter(str(tmp_path), fsync=False), stream, 4)
+    assert [(result.path, result.success) for result in results] == [("whole", True), ("cut", False)]
+    assert not (tmp_path / "cut").exists()
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(TEMP_PREFIX)]
@@ -0,0 +1,36 @@
+import io
+import os
+import pytest
+from models.config import Compression
+from shared.compression import GZIP, CompressingReader, Decompressor, available_encodings, negotiate_encoding, worth_compressing
+
+@pytest.mark.parametrize("encoding", available_encodings())
+def test_round_trip(encoding):
+    data = b"compressible " * 100000 + os.urandom(1000)
+    reader = CompressingReader(io.BytesIO(data), encoding, level=3)
+    decompressor = Decompressor(encoding)
+    received = b""
+    while chunk := reader.read(4096):
+        received += decompressor.decompress(chunk)
+    received += decompressor.flush()
+    assert received == data
+    assert reader.raw_bytes == len(data)
+    assert reader.wire_bytes < len(data) / 10
+
+def test_negotiation_prefers_what_the_client_can_do():
+    assert negotiate_encoding(["br", GZIP]) == GZIP
+    assert negotiate_encoding(["br"]) is None
+    assert negotiate_encoding(available_encodings()) == available_encodings()[0]
+    with pytest.raises(ValueError):
+        Decompressor("br")
+
+def test_worth_compressing(tmp_path):
+    policy = Compression(min_file_size=100)
+    (tmp_path / "text.txt").write_bytes(b"text " * 1000)
+    (tmp_path / "random.bin").write_bytes(os.urandom(5000))
+    (tmp_path / "text.zip").write_bytes(b"text " * 1000)
+    (tmp_path / "tiny.txt").write_bytes(b"text")
+    assert worth_compressing(str(tmp_path / "text.txt"), 5000, policy)
+    assert not worth_compressing(str(tmp_path / "random.bin"), 5000, policy)
+    assert not worth_compressing(str(tmp_path / "text.zip"), 5000, policy)
+    assert not worth_compressing(str(tmp_path / "tiny.txt"), 4, policy)
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from client.concurrency import AdaptiveLimiter
+
+def test_in_flight_uploads_stay_under_the_limit():
+    limiter = AdaptiveLimiter(1, 8, 3)
+    in_flight = peak = 0
+
+    async def upload():
+        nonlocal in_flight, peak
+        async with limiter.slot():
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    async def main():
+        await asyncio.gather(*(upload() for _ in range(10)))
+
+    asyncio.run(main())
+    assert peak == 3
+
+def test_failures_halve_the_limit():
+    limiter = AdaptiveLimiter(1, 8, 8)
+
+    async def main():
+        async with limiter.slot() as slot:
+            slot.failure()
+        with pytest.raises(RuntimeError):
+            async with limiter.slot():
+                raise RuntimeError()
+
+    asyncio.run(main())
+    assert limiter.limit == 2
+
+def test_limit_grows_while_throughput_improves():
+    limiter = AdaptiveLimiter(1, 8, 2)
+
+    async def main():
+        for _ in range(2):
+            async with limiter.slot() as slot:
+                slot.success(1000)
+
+    asyncio.run(main())
+    assert limiter.limit == 3
+
+def test_bounds_are_kept():
+    limiter = AdaptiveLimiter(2, 4, 10)
+    assert limiter.limit == 4
+    limiter.set_bounds(2, 4, 1)
+    assert limiter.limit == 2
@@ -0,0 +1,79 @@
+import io
+import os
+import random
+import pytest
+import shared.delta
+from shared.delta import DeltaApplier, DeltaNotWorthIt, compute_signatures, write_delta
+
+BLOCK_SIZE = 1024
+
+def round_trip(tmp_path, base: bytes, new: bytes, feed_size: int = 777) -> bytes:
+    base_path, new_path = tmp_path / "base", tmp_path / "new"
+    base_path.write_bytes(base)
+    new_path.write_bytes(new)
+    delta = io.BytesIO()
+    write_delta(str(new_path), compute_signatures(str(base_path), BLOCK_SIZE), BLOCK_SIZE, delta)
+    out = io.BytesIO()
+    with open(base_path, "rb") as base_file:
+        applier = DeltaApplier(base_file, BLOCK_SIZE, out)
+        data = delta.getvalue()
+        for offset in range(0, len(data), feed_size):
+            applier.feed(data[offset:offset + feed_size])
+        applier.finish()
+    return out.getvalue()
+
+@pytest.mark.parametrize("edit", [
+    lambda data: data,
+    lambda data: data[:5000] + b"inserted" + data[5000:],
+    lambda data: data[:3000] + data[4500:],
+    lambda data: data[:7000] + os.urandom(100) + data[7100:],
+    lambda data: data + os.urandom(333),
+    lambda data: data[:BLOCK_SIZE * 3 + 17],
+    lambda data: b"",
+])
+def test_round_trip(tmp_path, edit):
+    base = random.Random(1).randbytes(20 * BLOCK_SIZE + 123)
+    new = edit(base)
+    assert round_trip(tmp_path, base, new) == new
+
+def test_unchanged_file_is_all_copies(tmp_path):
+    data = os.urandom(16 * BLOCK_SIZE)
+    (tmp_path / "file").write_bytes(data)
+    delta = io.BytesIO()
+    literal_bytes = write_delta(str(tmp_path / "file"), compute_signatures(str(tmp_path / "file"), BLOCK_SIZE), BLOCK_SIZE, delta)
+    assert literal_bytes == 0
+    assert len(delta.getvalue()) < len(data) / 100
+
+def test_truncated_delta_is_rejected(tmp_path):
+    (tmp_path / "base").write_bytes(b"")
+    with open(tmp_path / "base", "rb") as base_file:
+        applier = DeltaApplier(base_file, BLOCK_SIZE, io.BytesIO())
+        applier.feed(b"L\x00\x00\x00\x10abc")
+        with pytest.raises(ValueError):
+            applier.finish()
+
+def test_mostly_literal_delta_gives_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared.delta, "LITERAL_PROBE_BYTES", 32 * BLOCK_SIZE)
+    monkeypatch.setattr(shared.delta, "MAX_LITERAL", 8 * BLOCK_SIZE)
+    base = os.urandom(64 * BLOCK_SIZE)
+    (tmp_path / "base").write_bytes(base)
+    (tmp_path / "new").write_bytes(os.urandom(64 * BLOCK_SIZE) + base)
+    signatures = compute_signatures(str(tmp_path / "base"), BLOCK_SIZE)
+    with pytest.raises(DeltaNotWorthIt):
+        write_delta(str(tmp_path / "new"), signatures, BLOCK_SIZE, io.BytesIO(), max_literal_ratio=0.5)
+    # Mostly copies: not given up on.
+    (tmp_path / "new").write_bytes(base[:BLOCK_SIZE] + os.urandom(BLOCK_SIZE) + base[2 * BLOCK_SIZE:])
+    assert write_delta(str(tmp_path / "new"), signatures, BLOCK_SIZE, io.BytesIO(), max_literal_ratio=0.5) == BLOCK_SIZE
+
+def test_slow_delta_gives_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared.delta, "LITERAL_PROBE_BYTES", 32 * BLOCK_SIZE)
+    monkeypatch.setattr(shared.delta, "MAX_LITERAL", 8 * BLOCK_SIZE)
+    base = os.urandom(64 * BLOCK_SIZE)
+    (tmp_path / "base").write_bytes(base)
+    # Every fourth block changed: mostly copies, judged by the encoding rate alone.
+    blocks = [os.urandom(BLOCK_SIZE) if index % 4 == 0 else base[index * BLOCK_SIZE:(index + 1) * BLOCK_SIZE] for index in range(64)]
+    (tmp_path / "new").write_bytes(b"".join(blocks))
+    signatures = compute_signatures(str(tmp_path / "base"), BLOCK_SIZE)
+    with pytest.raises(DeltaNotWorthIt):
+        write_delta(str(tmp_path / "new"), signatures, BLOCK_SIZE, io.BytesIO(), max_literal_ratio=0.5, min_rate=1024 ** 4)
+    assert write_delta(str(tmp_path / "new"), signatures, BLOCK_SIZE, io.BytesIO(), max_literal_ratio=0.5, min_rate=1) == 16 * BLOCK_SIZE
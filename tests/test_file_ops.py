@@ -0,0 +1,88 @@
+import asyncio
+import hashlib
+import os
+import httpx
+from models.data import File
+from models.file_ops import Materialize, Move
+from shared.diff import DiffAction, DiffKind, pair_renames
+
+def md5(data: bytes) -> str:
+    return hashlib.md5(data).hexdigest()
+
+def test_renames_are_paired_by_content():
+    def entry(data: bytes) -> File:
+        return File(dateModified=1, size=len(data), md5=md5(data))
+
+    new = [DiffAction(DiffKind.COPY_NEW, "renamed", local=entry(b"a")), DiffAction(DiffKind.COPY_NEW, "new", local=entry(b"b"))]
+    deleted = [DiffAction(DiffKind.DELETE, "old", remote=entry(b"a")), DiffAction(DiffKind.DELETE, "gone", remote=entry(b"c"))]
+    renames, remaining_new, remaining_deleted = pair_renames(new, deleted)
+    assert [(action.source, action.path) for action in renames] == [("old", "renamed")]
+    assert [action.path for action in remaining_new] == ["new"]
+    assert [action.path for action in remaining_deleted] == ["gone"]
+
+def test_moves_keep_their_index_entries(fh, folder_path):
+    (folder_path / "a").write_bytes(b"a")
+    (folder_path / "b").write_bytes(b"b")
+    fh.get_folder_metadata("F", "md5")
+
+    results = fh.move_files("F", [Move(source="a", destination="dir/a", hash=md5(b"a")),
+                                  Move(source="b", destination="b copy", keep_source=True),
+                                  Move(source="missing", destination="c")])
+    assert [result.success for result in results] == [True, True, False]
+    assert (folder_path / "dir" / "a").read_bytes() == b"a" and not (folder_path / "a").exists()
+    assert (folder_path / "b copy").read_bytes() == b"b" and (folder_path / "b").exists()
+    files = fh.index.get_folder("F", str(folder_path)).files
+    assert sorted(files) == ["b", "b copy", "dir/a"]
+    assert files["dir/a"].md5 == md5(b"a") and files["b copy"].md5 == md5(b"b")
+
+def test_moves_of_other_content_are_refused(fh, folder_path):
+    (folder_path / "a").write_bytes(b"a")
+    fh.get_folder_metadata("F", "md5")
+    (folder_path / "a").write_bytes(b"changed since the scan")
+
+    [result] = fh.move_files("F", [Move(source="a", destination="b", hash=md5(b"a"))])
+    assert not result.success
+    assert (folder_path / "a").exists() and not (folder_path / "b").exists()
+
+def test_move_endpoint(server, folder_path):
+    (folder_path / "a").write_bytes(b"a")
+    server.get("/files/F")
+    response = server.post("/files/F/move", json={"moves": [{"source": "a", "destination": "b", "hash": md5(b"a")}]})
+    assert [result["success"] for result in response.json()] == [True]
+    assert sorted(server.get("/files/F").json()["files"]) == ["b"]
+    assert os.listdir(folder_path) == ["b"]
+
+def test_materialize_from_indexed_copies_and_hints(fh, folder_path):
+    (folder_path / "old").write_bytes(b"known")
+    (folder_path / "stale").write_bytes(b"stale")
+    fh.get_folder_metadata("F", "md5")
+    (folder_path / "stale").write_bytes(b"edited")
+    (folder_path / "uploaded").write_bytes(b"hint")
+
+    assert set(fh.have_hashes("md5", [md5(b"known"), md5(b"stale"), md5(b"unknown")])) == {md5(b"known"), md5(b"stale")}
+    results = fh.materialize_files("F", [Materialize(path="new", hash=md5(b"known"), size=5),
+                                         Materialize(path="from stale", hash=md5(b"stale"), size=5),
+                                         Materialize(path="from hint", hash=md5(b"hint"), size=4, source="uploaded"),
+                                         Materialize(path="bad hint", hash=md5(b"other"), size=5, source="uploaded")])
+    assert [result.success for result in results] == [True, False, True, False]
+    assert (folder_path / "new").read_bytes() == b"known"
+    assert (folder_path / "from hint").read_bytes() == b"hint"
+    assert not (folder_path / "from stale").exists()
+    assert fh.index.get_file("F", "new").md5 == md5(b"known")
+
+def test_uploads_are_deduplicated(http_client, server, server_module, folder_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, "client", httpx.AsyncClient(transport=httpx.ASGITransport(app=server_module.app)))
+    (folder_path / "old").write_bytes(b"known")
+    server.get("/files/F")
+
+    def entry(data: bytes) -> File:
+        return File(dateModified=1, size=len(data), md5=md5(data))
+
+    files = {"copy": entry(b"known"), "dup1": entry(b"twice"), "dup2": entry(b"twice"), "unique": entry(b"once")}
+    done, duplicates, saved = asyncio.run(http_client.deduplicate_uploads("server", "F", files, 1))
+    assert (done, duplicates, saved) == ({"copy"}, {"dup2": "dup1"}, 10)
+    assert (folder_path / "copy").read_bytes() == b"known"
+
+    (folder_path / "dup1").write_bytes(b"twice") # uploaded
+    assert asyncio.run(http_client.materialize_duplicates("server", "F", files, duplicates)) == set()
+    assert (folder_path / "dup2").read_bytes() == b"twice"
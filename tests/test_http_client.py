@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+import io
+import os
+import httpx
+import shared.delta
+from models.config import Chunked
+from models.data import File
+from shared.bulk import BulkWriter
+from shared.delta import DeltaApplier, compute_signatures
+
+def upload_results(upload) -> list:
+    async def main():
+        queue = asyncio.Queue()
+        await upload(queue)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+    return asyncio.run(main())
+
+def test_unreadable_file_is_reported(http_client, server_requests, tmp_path):
+    server_requests.handler = lambda request: httpx.Response(200, json={})
+    results = upload_results(lambda queue: http_client.upload_file(
+        "gone", str(tmp_path / "gone"), "http://server/files/F/upload", queue, http_client.UploadOptions(stream=True)))
+    assert [(result.relative_path, result.result) for result in results] == [("gone", http_client.UploadResultEnum.ERROR)]
+
+def test_unreadable_file_is_reported_by_chunked_uploads(http_client, server_requests, tmp_path):
+    local_file = File(dateModified=1, size=100, mtime_ns=1, md5="abc", hash_algorithm="md5")
+    server_requests.handler = lambda request: httpx.Response(200, json={
+        "id": "1", "path": "gone", "size": 100, "hash": "abc", "chunk_size": 10})
+    options = http_client.UploadOptions(chunked=Chunked(chunk_size=10), files={"gone": local_file})
+    results = upload_results(lambda queue: http_client.upload_chunked(
+        "gone", str(tmp_path / "gone"), queue, "server", "F", options))
+    assert [(result.relative_path, result.result) for result in results] == [("gone", http_client.UploadResultEnum.ERROR)]
+
+def test_bulk_upload_reports_every_file(http_client, server_requests, tmp_path):
+    source, target = tmp_path / "source", tmp_path / "target"
+    source.mkdir()
+    (source / "a").write_bytes(b"aaa")
+    (source / "unhashed").write_bytes(b"lazy")
+    local_files = {"a": File(dateModified=1, size=3, md5=hashlib.md5(b"aaa").hexdigest()), "unhashed": File(dateModified=1, size=4)}
+
+    def handler(request):
+        writer = BulkWriter(str(target), fsync=False)
+        results = writer.feed(request.content) + writer.finish()
+        return httpx.Response(200, text="".join(result.model_dump_json() + "\n" for result in results))
+
+    server_requests.handler = handler
+    options = http_client.UploadOptions(files=local_files, algorithm="md5")
+    results = upload_results(lambda queue: http_client.upload_bulk(
+        str(source), ["a", "gone", "unhashed"], "http://server/files/F/bulk", queue, options))
+    assert sorted((result.relative_path, result.result, result.logical_bytes) for result in results) == [
+        ("a", http_client.UploadResultEnum.SUCCESS, 3),
+        ("gone", http_client.UploadResultEnum.FAILURE, 0),
+        ("unhashed", http_client.UploadResultEnum.SUCCESS, 4)]
+    assert next(result.hash for result in results if result.relative_path == "unhashed") == hashlib.md5(b"lazy").hexdigest()
+    assert (target / "a").read_bytes() == b"aaa"
+
+def delta_server(http_client, server_requests, base_path, received: list):
+    """Answers signature requests for `base_path` and applies the deltas it's sent to it, into `received`."""
+    def handler(request):
+        block_size = int(request.url.params["block_size"])
+        if request.method == "GET":
+            signatures = compute_signatures(str(base_path), block_size)
+            return httpx.Response(200, json={"block_size": block_size, "blocks": [signature.model_dump() for signature in signatures]})
+        out = io.BytesIO()
+        with open(base_path, "rb") as base_file:
+            applier = DeltaApplier(base_file, block_size, out)
+            applier.feed(request.content)
+            applier.finish()
+        received.append(out.getvalue())
+        return httpx.Response(200, json={})
+    server_requests.handler = handler
+
+def test_delta_is_sent_while_it_is_encoded(http_client, server_requests, tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, "DELTA_PIECE_SIZE", 1000)
+    base = os.urandom(300 * 1024)
+    (tmp_path / "base").write_bytes(base)
+    new = base[:100000] + b"edited" + base[100000:]
+    (tmp_path / "new").write_bytes(new)
+    received = []
+    delta_server(http_client, server_requests, tmp_path / "base", received)
+
+    sent = asyncio.run(http_client.upload_delta("f", str(tmp_path / "new"), File(dateModified=1, size=len(new)),
+                                                "server", "F", 1024))
+    assert received == [new]
+    assert sent < 10000
+
+def test_delta_that_is_not_worth_it_is_given_up_midway(http_client, server_requests, tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, "DELTA_PIECE_SIZE", 1000)
+    monkeypatch.setattr(shared.delta, "LITERAL_PROBE_BYTES", 64 * 1024)
+    monkeypatch.setattr(shared.delta, "MAX_LITERAL", 8 * 1024)
+    (tmp_path / "base").write_bytes(os.urandom(300 * 1024))
+    (tmp_path / "new").write_bytes(os.urandom(300 * 1024))
+    received = []
+    delta_server(http_client, server_requests, tmp_path / "base", received)
+    limit = http_client.limiter.limit
+
+    assert asyncio.run(http_client.upload_delta("f", str(tmp_path / "new"), File(dateModified=1, size=300 * 1024),
+                                                "server", "F", 1024, max_literal_ratio=0.5)) is None
+    assert received == []
+    assert http_client.limiter.limit == limit
@@ -0,0 +1,72 @@
+import sqlite3
+from models.data import Data, Directory, File, Folder
+from utils.index_store import SqliteIndexStore
+from utils.jsons import write_json
+
+def entry(size: int, md5: str = "") -> File:
+    return File(dateModified=1.5, md5=md5, size=size, mtime_ns=1_500_000_000, inode=7, ctime_ns=3)
+
+def test_new_index_gets_every_migration(tmp_path):
+    SqliteIndexStore(str(tmp_path / "index.db"))
+    connection = sqlite3.connect(tmp_path / "index.db")
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == len(SqliteIndexStore._MIGRATIONS)
+
+def test_old_index_is_migrated_in_place(tmp_path):
+    connection = sqlite3.connect(tmp_path / "index.db")
+    connection.executescript(f"BEGIN; {SqliteIndexStore._MIGRATIONS[0]} PRAGMA user_version = 1; COMMIT;")
+    connection.execute("INSERT INTO folders (name, base_path) VALUES ('F', '/base')")
+    connection.execute("INSERT INTO files (folder, path, date_modified, md5) VALUES ('F', 'a.txt', 12.5, 'abc')")
+    connection.commit()
+    connection.close()
+
+    index = SqliteIndexStore(str(tmp_path / "index.db"))
+    legacy = index.get_file("F", "a.txt")
+    assert (legacy.dateModified, legacy.md5, legacy.hash_algorithm, legacy.mtime_ns, legacy.size) == (12.5, "abc", "md5", 0, 0)
+    assert index.get_directories("F") == {}
+    # Opening it again doesn't apply anything twice.
+    SqliteIndexStore(str(tmp_path / "index.db"))
+    assert sqlite3.connect(tmp_path / "index.db").execute("PRAGMA user_version").fetchone()[0] == len(SqliteIndexStore._MIGRATIONS)
+
+def test_files_page_through_the_folder_in_path_order(tmp_path):
+    index = SqliteIndexStore(str(tmp_path / "index.db"))
+    paths = [f"dir{i % 3}/file{i:03}" for i in range(50)] + ["a", "z", "dir1 b", "dir1/sub/x"]
+    index.upsert_files("F", "/base", {path: entry(i) for i, path in enumerate(paths)})
+    index.upsert_files("Other", "/other", {"a": entry(1)})
+
+    seen, cursor = [], ""
+    while True:
+        page = index.get_files_page("F", cursor, 7)
+        seen.extend(path for path, _ in page)
+        if len(page) < 7:
+            break
+        cursor = page[-1][0]
+    assert seen == sorted(paths)
+    assert index.get_files_page("F", seen[-1], 7) == []
+
+def test_legacy_json_is_imported_once(tmp_path):
+    json_path = tmp_path / "data.json"
+    write_json(str(json_path), Data(folders={"F": Folder(name="F", base_path="/base", files={"a": entry(3, "abc")})}))
+    index = SqliteIndexStore(str(tmp_path / "index.db"))
+    index.migrate_from_json(str(json_path))
+    assert index.get_file("F", "a").md5 == "abc"
+    assert not json_path.exists()
+    assert (tmp_path / "data.json.migrated").exists()
+
+def test_children_are_direct_only(tmp_path):
+    connection = sqlite3.connect(tmp_path / "index.db")
+    for version, script in enumerate(SqliteIndexStore._MIGRATIONS[:7], start=1):
+        connection.executescript(f"BEGIN; {script} PRAGMA user_version = {version}; COMMIT;")
+    connection.execute("INSERT INTO folders (name, base_path) VALUES ('F', '/base')")
+    connection.execute("INSERT INTO files (folder, path, date_modified) VALUES ('F', 'old', 1), ('F', 'a/old', 1)")
+    connection.execute("INSERT INTO directories (folder, path, mtime_ns, entry_count) VALUES ('F', '', 1, 2), ('F', 'a', 1, 1)")
+    connection.commit()
+    connection.close()
+
+    index = SqliteIndexStore(str(tmp_path / "index.db"))
+    index.upsert_files("F", "/base", {path: entry(1) for path in ("x", "a/y", "a/b/z", "a b", "ab/w")})
+    index.upsert_directories("F", {path: Directory(mtime_ns=2) for path in ("a/b", "ab")})
+    _, files, directories = index.get_children("F", "")
+    assert sorted(files) == ["a b", "old", "x"] and sorted(directories) == ["a", "ab"]
+    _, files, directories = index.get_children("F", "a")
+    assert sorted(files) == ["a/old", "a/y"] and sorted(directories) == ["a/b"]
+    assert index.get_children("F", "missing") == (None, {}, {})
@@ -0,0 +1,87 @@
+import asyncio
+from typing import Dict, List
+from client.pipeline import RemoteFiles, UploadPipeline, lazy_hashing
+from models.data import File
+from models.protocol import TreeNode
+
+def entry(md5: str = "", size: int = 1, mtime_ns: int = 1) -> File:
+    return File(dateModified=1, md5=md5, size=size, mtime_ns=mtime_ns)
+
+def remote_files(files: Dict[str, File]) -> RemoteFiles:
+    """The target's files, all in the root directory."""
+    fetched = []
+
+    async def fetch_nodes(paths: List[str]) -> List[TreeNode]:
+        fetched.append(paths)
+        return [TreeNode(path=path, files=files if path == "" else {}) for path in paths]
+
+    remote = RemoteFiles(fetch_nodes)
+    remote.fetched = fetched
+    return remote
+
+def run_pipeline(remote: RemoteFiles, offered: Dict[str, File], have=None):
+    sent = []
+
+    async def send(files, changed):
+        sent.append((sorted(files), sorted(changed)))
+        return {path: "hashed" for path, file in files.items() if not file.md5}
+
+    async def main():
+        pipeline = UploadPipeline(remote, send, have)
+        task = asyncio.create_task(pipeline.run())
+
+        def scan():
+            for path, file in offered.items():
+                pipeline.offer(path, file)
+            pipeline.close()
+
+        await asyncio.to_thread(scan)
+        await task
+        return pipeline
+
+    pipeline = asyncio.run(main())
+    return pipeline, sent
+
+def test_changed_and_new_files_are_sent_while_scanning():
+    remote = remote_files({"same": entry("a"), "changed": entry("b")})
+    pipeline, sent = run_pipeline(remote, {"same": entry("a"), "changed": entry("B"), "new": entry("c"), "unhashed": entry()},
+                                  have=lambda hashes: asyncio.sleep(0, set()))
+    assert sent == [(["changed", "new", "unhashed"], ["changed"])]
+    assert pipeline.sent == {"changed", "new", "unhashed"}
+    assert pipeline.hashes == {"unhashed": "hashed"}
+    assert remote.fetched == [[""]]
+
+def test_new_files_the_server_has_are_left_to_the_diff():
+    pipeline, sent = run_pipeline(remote_files({"old": entry("a")}), {"renamed": entry("a"), "new": entry("c")},
+                                  have=lambda hashes: asyncio.sleep(0, {"a"}))
+    assert pipeline.sent == {"new"}
+    # Without `have`, no new hashed file can be told apart from a rename.
+    pipeline, sent = run_pipeline(remote_files({"old": entry("a")}), {"renamed": entry("a"), "new": entry("c")})
+    assert sent == [] and pipeline.sent == set()
+
+def test_failed_uploads_are_left_to_the_diff():
+    async def send(files, changed):
+        raise OSError("unreachable")
+
+    async def main():
+        pipeline = UploadPipeline(remote_files({}), send)
+        task = asyncio.create_task(pipeline.run())
+        await asyncio.to_thread(lambda: (pipeline.offer("new", entry()), pipeline.close()))
+        await task
+        return pipeline
+
+    assert asyncio.run(main()).sent == set()
+
+def test_lazy_hashing_only_hashes_what_the_server_cannot_tell():
+    remote = remote_files({"same": entry("a", size=5, mtime_ns=10), "touched": entry("b", size=5, mtime_ns=10),
+                           "resized": entry("c", size=5)})
+    files = {"same": entry(size=5, mtime_ns=10), "touched": entry(size=5, mtime_ns=20), "resized": entry(size=6),
+             "new": entry(), "big": entry(size=100)}
+
+    async def main():
+        skip_hashing = lazy_hashing(remote, "md5", always_hash_from=100)
+        # Called on the scan thread.
+        return await asyncio.to_thread(skip_hashing, files)
+
+    skipped = asyncio.run(main())
+    assert skipped == {"same": entry("a", size=5, mtime_ns=10), "resized": entry(size=6), "new": entry()}
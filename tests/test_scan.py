@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+import shared.files
+from conftest import set_old_mtime
+from models.file_ops import Move
+from server.scans import ScanCoordinator
+from server.watcher import FolderWatchers
+
+def make_tree(folder_path):
+    (folder_path / "a" / "b").mkdir(parents=True)
+    (folder_path / "a" / "b" / "x").write_bytes(b"x")
+    (folder_path / "a" / "y").write_bytes(b"y")
+    (folder_path / "z").write_bytes(b"z")
+    for directory in (folder_path, folder_path / "a", folder_path / "a" / "b"):
+        set_old_mtime(directory)
+
+def test_in_place_edit_in_pruned_directory_is_found(fh, folder_path):
+    make_tree(folder_path)
+    before = fh.get_folder_metadata("F", "md5")
+    directory_mtime = os.stat(folder_path / "a").st_mtime_ns
+
+    with open(folder_path / "a" / "y", "r+b") as file:
+        file.write(b"Y")
+    os.utime(folder_path / "a", ns=(directory_mtime, directory_mtime))
+    after = fh.get_folder_metadata("F", "md5")
+
+    assert fh.get_directories("F")["a"].mtime_ns == directory_mtime # pruned, not listed again
+    assert after.files["a/y"].md5 != before.files["a/y"].md5
+    assert after.files["a/b/x"] == before.files["a/b/x"]
+    assert fh.get_directories("F")["a"].digest != ""
+
+def test_new_and_removed_files_are_found(fh, folder_path):
+    make_tree(folder_path)
+    fh.get_folder_metadata("F", "md5")
+    os.remove(folder_path / "a" / "y")
+    (folder_path / "a" / "b" / "new").write_bytes(b"new")
+    assert sorted(fh.get_folder_metadata("F", "md5").files) == ["a/b/new", "a/b/x", "z"]
+
+def test_changes_outside_scans_clear_digests(fh, folder_path):
+    make_tree(folder_path)
+    fh.get_folder_metadata("F", "md5")
+    generation = fh.generation("F")
+
+    fh.delete_files("F", ["a/b/x"])
+    directories = fh.get_directories("F")
+    assert directories[""].digest == "" and directories["a"].digest == ""
+    assert fh.generation("F") > generation
+
+    fh.get_folder_metadata("F", "md5")
+    assert all(directory.digest for directory in fh.get_directories("F").values())
+    fh.move_files("F", [Move(source="z", destination="a/z")])
+    assert fh.get_directories("F")["a"].digest == ""
+    assert sorted(fh.get_folder_metadata("F", "md5").files) == ["a/y", "a/z"]
+
+def test_scan_results_are_cached_until_a_write(fh, folder_path):
+    make_tree(folder_path)
+    scans = ScanCoordinator(fh, FolderWatchers(fh))
+
+    async def refresh():
+        return await scans.refresh("F", "md5")
+
+    try:
+        first = asyncio.run(refresh())
+        assert asyncio.run(refresh()) is first
+        (folder_path / "written").write_bytes(b"by an upload")
+        scans.invalidate("F")
+        assert "written" in asyncio.run(refresh()).files
+    finally:
+        scans.shutdown()
+
+def test_files_left_unhashed_are_found_by_the_next_scan(fh, folder_path):
+    make_tree(folder_path)
+    fh.get_folder_metadata("F", "md5")
+    (folder_path / "a" / "new").write_bytes(b"new")
+    set_old_mtime(folder_path / "a")
+
+    def skip_hashing(files):
+        return {path: file for path, file in files.items() if path == "a/new"}
+
+    assert fh.get_folder_metadata("F", "md5", skip_hashing=skip_hashing).files["a/new"].md5 == ""
+    assert "a/new" in fh.get_folder_metadata("F", "md5", skip_hashing=skip_hashing).files
+    assert fh.get_folder_metadata("F", "md5").files["a/new"].md5
+
+def test_names_that_are_not_utf8_are_skipped(fh, folder_path):
+    (folder_path / "good").write_bytes(b"good")
+    with open(os.path.join(os.fsencode(folder_path), b"bad\xff"), "wb") as file:
+        file.write(b"bad")
+    assert sorted(fh.get_folder_metadata("F", "md5").files) == ["good"]
+
+def test_deletes_stopped_early_still_update_the_index(fh, folder_path, monkeypatch):
+    remove_file = shared.files._remove_file
+    # Slow enough that the deletes beyond the first delete_workers haven't started when stopping.
+    monkeypatch.setattr(shared.files, "_remove_file", lambda full_path: time.sleep(0.05) or remove_file(full_path))
+    (folder_path / "d").mkdir()
+    for index in range(20):
+        (folder_path / "d" / str(index)).write_bytes(b"x")
+    fh.get_folder_metadata("F", "md5")
+
+    results = fh.iter_delete_files("F", [f"d/{index}" for index in range(20)] + ["missing"])
+    first = next(results)
+    results.close()
+    assert first.success
+    remaining = sorted(os.listdir(folder_path / "d"))
+    assert 0 < len(remaining) < 20
+    assert sorted(fh.index.get_folder("F", str(folder_path)).files) == [f"d/{name}" for name in remaining]
+    assert fh.get_directories("F")["d"].digest == ""
+
+    assert all(result.success for result in fh.delete_files("F", [f"d/{name}" for name in remaining]))
+    assert not (folder_path / "d").exists()
+    assert fh.index.get_folder("F", str(folder_path)).files == {}
@@ -0,0 +1,53 @@
+import asyncio
+from client.scheduler import SCANNING, WAITING_TO_SCAN, SyncScheduler
+from models.config import Concurrency, TrackingFolder
+
+def folder(name: str, priority: int = 0) -> TrackingFolder:
+    return TrackingFolder(name=name, base_path=name, priority=priority)
+
+def test_syncs_start_by_priority_then_fewest_bytes():
+    started = []
+    release = asyncio.Event()
+
+    async def run_sync(folder):
+        started.append(folder.name)
+        await release.wait()
+
+    async def main():
+        scheduler = SyncScheduler(run_sync, Concurrency(max_syncs=1))
+        first, big, small, unknown, urgent = folder("first"), folder("big"), folder("small"), folder("unknown"), folder("urgent", 1)
+        scheduler.record_bytes(big, 1000)
+        scheduler.record_bytes(small, 10)
+        for entry in (first, unknown, big, small, urgent):
+            assert scheduler.submit(entry)
+        assert not scheduler.submit(first) and not scheduler.submit(small)
+        assert [entry.folder.name for entry in scheduler.entries()] == ["first", "urgent", "small", "big", "unknown"]
+        release.set()
+        while scheduler.entries():
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert started == ["first", "urgent", "small", "big", "unknown"]
+
+def test_scans_are_limited_separately():
+    states = {}
+
+    async def main():
+        async def run_sync(folder):
+            async with scheduler.scan_slot(folder):
+                await asyncio.sleep(0.05)
+
+        def on_change():
+            for entry in scheduler.entries():
+                states.setdefault(entry.folder.name, set()).add(entry.state)
+
+        scheduler = SyncScheduler(run_sync, Concurrency(max_syncs=2, max_scans=1), on_change)
+        scheduler.submit(folder("a"))
+        scheduler.submit(folder("b"))
+        await asyncio.sleep(0.02)
+        assert sorted(entry.state for entry in scheduler.entries()) == [SCANNING, WAITING_TO_SCAN]
+        while scheduler.entries():
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert all(SCANNING in seen for seen in states.values())
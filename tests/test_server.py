@@ -0,0 +1,26 @@
+import hashlib
+import io
+import os
+from shared.compression import GZIP, CompressingReader
+
+def test_manifest_pages(server, folder_path):
+    for name in ("a", "b", "c"):
+        (folder_path / name).write_bytes(name.encode())
+    first = server.get("/files/F/manifest", params={"limit": 2})
+    assert [line.split('"')[3] for line in first.text.splitlines()] == ["a", "b"]
+    rest = server.get("/files/F/manifest", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+    assert len(rest.text.splitlines()) == 1 and "X-Next-Cursor" not in rest.headers
+    assert server.get("/files/F/manifest", params={"limit": 0}).status_code == 422
+
+def test_compressed_upload(server, folder_path):
+    data = b"compressible " * 10000
+    reader = CompressingReader(io.BytesIO(data), GZIP, 3)
+    body = b"".join(iter(lambda: reader.read(1000), b""))
+    params = {"path": "dir/f", "encoding": GZIP, "hash": hashlib.md5(data).hexdigest(), "mtime_ns": 1_600_000_000_000_000_000}
+    assert server.put("/files/F/upload", params=params, content=body).status_code == 200
+    assert (folder_path / "dir" / "f").read_bytes() == data
+    assert os.stat(folder_path / "dir" / "f").st_mtime_ns == params["mtime_ns"]
+    # Checked against the hash after decompressing.
+    params.update(path="other", hash="0" * 32)
+    assert server.put("/files/F/upload", params=params, content=body).status_code == 422
+    assert not (folder_path / "other").exists()
@@ -0,0 +1,46 @@
+import asyncio
+import time
+from datetime import datetime
+from client.throttle import ThroughputMeter, TokenBucket, current_limit, format_rate
+from models.config import Bandwidth, BandwidthWindow
+
+def test_schedule_replaces_the_limit():
+    bandwidth = Bandwidth(limit=1000, schedule=[
+        BandwidthWindow(start="09:00", end="18:00", limit=100),
+        BandwidthWindow(start="22:00", end="06:00", days=[4], limit=0)])
+    assert current_limit(None) == 0
+    assert current_limit(bandwidth, datetime(2024, 1, 1, 12, 0)) == 100 # Monday
+    assert current_limit(bandwidth, datetime(2024, 1, 1, 18, 0)) == 1000
+    assert current_limit(bandwidth, datetime(2024, 1, 6, 12, 0)) == 1000 # Saturday
+
+def test_windows_over_midnight_belong_to_the_day_they_start():
+    bandwidth = Bandwidth(limit=1000, schedule=[BandwidthWindow(start="22:00", end="06:00", days=[4], limit=5)])
+    assert current_limit(bandwidth, datetime(2024, 1, 5, 23, 0)) == 5 # Friday night
+    assert current_limit(bandwidth, datetime(2024, 1, 6, 5, 59)) == 5 # Saturday morning
+    assert current_limit(bandwidth, datetime(2024, 1, 5, 5, 0)) == 1000 # Friday morning
+    assert current_limit(bandwidth, datetime(2024, 1, 6, 23, 0)) == 1000
+
+def test_bucket_keeps_to_its_rate():
+    rate = 1024 * 1024
+    bucket = TokenBucket(lambda: rate)
+
+    async def main():
+        for _ in range(8):
+            await bucket.consume(64 * 1024)
+
+    started = time.monotonic()
+    asyncio.run(main())
+    assert 0.4 < time.monotonic() - started < 1.5
+
+def test_unlimited_bucket_does_not_wait():
+    bucket = TokenBucket(lambda: 0)
+    started = time.monotonic()
+    asyncio.run(bucket.consume(1024 ** 3))
+    assert time.monotonic() - started < 0.1
+
+def test_meter():
+    meter = ThroughputMeter()
+    meter.add(1000)
+    meter.add(500)
+    assert meter.rate() == 1500
+    assert format_rate(1536) == "1.5 KiB/s"
@@ -0,0 +1,44 @@
+import asyncio
+import os
+from typing import Dict
+from models.data import Directory, File
+from shared.diff import diff_sorted
+from shared.tree import build_tree_nodes, diff_tree, update_digests
+
+def entry(md5: str) -> File:
+    return File(dateModified=0, md5=md5, size=len(md5))
+
+def with_digests(files: Dict[str, File]) -> Dict[str, Directory]:
+    directories = {"": Directory()}
+    for path in files:
+        while path:
+            path = os.path.dirname(path)
+            directories[path] = Directory()
+    update_digests(files, directories, files.keys(), directories.keys())
+    return directories
+
+def run_diff(local: Dict[str, File], remote: Dict[str, File]):
+    local_nodes = build_tree_nodes(local, with_digests(local))
+    remote_nodes = build_tree_nodes(remote, with_digests(remote))
+    fetched = []
+
+    async def fetch(paths):
+        fetched.extend(paths)
+        return [remote_nodes[path] for path in paths]
+
+    async def collect():
+        return [(action.kind, action.path) async for action in diff_tree(local_nodes, remote_nodes[""], fetch)]
+    return asyncio.run(collect()), fetched
+
+def test_identical_trees_have_no_actions():
+    files = {"a/x": entry("1"), "a/b/y": entry("2"), "z": entry("3")}
+    assert run_diff(files, dict(files)) == ([], [])
+
+def test_only_differing_directories_are_fetched():
+    remote = {"same/x": entry("1"), "same/deep/y": entry("2"), "changed/sub/z": entry("3"), "gone/w": entry("4")}
+    local = {"same/x": entry("1"), "same/deep/y": entry("2"), "changed/sub/z": entry("33"), "new/v": entry("5")}
+    actions, fetched = run_diff(local, remote)
+    expected = [(action.kind, action.path) for action in diff_sorted(sorted(local.items()), sorted(remote.items()))]
+    assert sorted(actions, key=lambda action: action[1]) == sorted(expected, key=lambda action: action[1])
+    assert "same" not in fetched and "same/deep" not in fetched
+    assert "changed/sub" in fetched
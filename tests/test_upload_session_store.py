@@ -0,0 +1,21 @@
+from models.file_ops import UploadSession
+from utils.index_store import SqliteIndexStore
+from utils.upload_session_store import SqliteUploadSessionStore
+
+def test_sessions_share_the_index_database(tmp_path):
+    index = SqliteIndexStore(str(tmp_path / "index.db"))
+    store = SqliteUploadSessionStore(str(tmp_path / "index.db"))
+    session = UploadSession(id="s", folder="F", path="big", size=25, hash="abc", chunk_size=10, temp_path="/tmp/x", created=5.0)
+    store.save_upload_session(session)
+    store.add_upload_chunk("s", 2)
+    store.add_upload_chunk("s", 0)
+    store.add_upload_chunk("s", 2)
+
+    found = store.find_upload_session("F", "big", 25, "abc", "md5")
+    assert found == session.model_copy(update={"received": [0, 2]})
+    assert store.find_upload_session("F", "big", 25, "other", "md5") is None
+    assert [expired.id for expired in store.expired_upload_sessions(6.0)] == ["s"]
+    assert index.get_children("F", "") == (None, {}, {})
+
+    store.delete_upload_session("s")
+    assert store.get_upload_session("s") is None
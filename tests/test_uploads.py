@@ -0,0 +1,60 @@
+import hashlib
+import os
+import pytest
+from models.file_ops import UploadSessionCreate
+from shared.files import TEMP_PREFIX
+
+DATA = os.urandom(25)
+
+def open_session(server, **overrides):
+    request = {"path": "dir/big", "size": len(DATA), "hash": hashlib.md5(DATA).hexdigest(), "chunk_size": 10, **overrides}
+    response = server.post("/files/F/sessions", json=request)
+    assert response.status_code == 200
+    return response.json()
+
+def send_chunk(server, session, index: int, data: bytes = None):
+    if data is None:
+        data = DATA[index * 10:(index + 1) * 10]
+    return server.put(f"/files/F/sessions/{session['id']}/chunks/{index}", content=data)
+
+def test_chunks_resume_and_commit(server, folder_path):
+    session = open_session(server)
+    assert session["received"] == []
+    assert send_chunk(server, session, 2).status_code == 200
+    assert send_chunk(server, session, 0).status_code == 200
+    assert server.post(f"/files/F/sessions/{session['id']}/commit").status_code == 409
+
+    # A reconnecting client gets the same session back with what already arrived.
+    resumed = open_session(server)
+    assert (resumed["id"], sorted(resumed["received"])) == (session["id"], [0, 2])
+    assert send_chunk(server, resumed, 1).status_code == 200
+    assert server.post(f"/files/F/sessions/{session['id']}/commit", params={"mtime_ns": 1_600_000_000_000_000_000}).status_code == 200
+    assert (folder_path / "dir" / "big").read_bytes() == DATA
+    assert os.stat(folder_path / "dir" / "big").st_mtime_ns == 1_600_000_000_000_000_000
+    assert server.get(f"/files/F/sessions/{session['id']}").status_code == 404
+    assert not [name for name in os.listdir(folder_path / "dir") if name.startswith(TEMP_PREFIX)]
+
+def test_bad_chunks_are_refused(server):
+    session = open_session(server)
+    assert send_chunk(server, session, 3).status_code == 400
+    assert send_chunk(server, session, 0, b"short").status_code == 400
+    assert send_chunk(server, session, 2, b"too long").status_code == 400
+    assert server.get(f"/files/F/sessions/{session['id']}").json()["received"] == []
+    assert server.post("/files/F/sessions", json={"path": "big", "size": 1, "hash": "", "chunk_size": 0}).status_code == 400
+
+def test_hash_mismatch_drops_the_session(server, folder_path):
+    session = open_session(server, hash="0" * 32)
+    for index in range(3):
+        send_chunk(server, session, index)
+    assert server.post(f"/files/F/sessions/{session['id']}/commit").status_code == 422
+    assert server.get(f"/files/F/sessions/{session['id']}").status_code == 404
+    assert os.listdir(folder_path / "dir") == []
+
+def test_unfinished_sessions_expire(server, server_module, folder_path):
+    sessions = server_module.upload_sessions
+    stale = sessions.create("F", UploadSessionCreate(path="stale", size=5, hash="", chunk_size=10))
+    sessions.fh.config_dc.get().chunked.session_expiry = 0
+    sessions.create("F", UploadSessionCreate(path="other", size=5, hash="", chunk_size=10))
+    with pytest.raises(KeyError):
+        sessions.get("F", stale.id)
+    assert not os.path.exists(stale.temp_path)
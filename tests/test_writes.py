@@ -0,0 +1,36 @@
+import hashlib
+import os
+from shared.files import TEMP_PREFIX
+from shared.writes import AtomicWriter
+
+def temp_files(directory) -> list:
+    return [name for name in os.listdir(directory) if name.startswith(TEMP_PREFIX)]
+
+def test_commit_replaces_the_target(tmp_path):
+    target = tmp_path / "sub" / "file"
+    writer = AtomicWriter(str(target), "md5", fsync=False)
+    writer.write(b"part one, ")
+    assert not target.exists()
+    writer.write(b"part two")
+    assert writer.commit(hashlib.md5(b"part one, part two").hexdigest(), mtime_ns=1_500_000_000_000_000_000)
+    assert target.read_bytes() == b"part one, part two"
+    assert os.stat(target).st_mtime_ns == 1_500_000_000_000_000_000
+    entry = writer.entry()
+    assert (entry.md5, entry.size, entry.mtime_ns) == (hashlib.md5(b"part one, part two").hexdigest(), 18, 1_500_000_000_000_000_000)
+    assert not temp_files(tmp_path / "sub")
+
+def test_hash_mismatch_keeps_the_old_file(tmp_path):
+    target = tmp_path / "file"
+    target.write_bytes(b"old")
+    writer = AtomicWriter(str(target), "md5", fsync=False)
+    writer.write(b"new")
+    assert not writer.commit("0" * 32)
+    assert target.read_bytes() == b"old"
+    assert writer.entry() is None
+    assert not temp_files(tmp_path)
+
+def test_abort_leaves_nothing_behind(tmp_path):
+    writer = AtomicWriter(str(tmp_path / "file"), fsync=False)
+    writer.write(b"data")
+    writer.abort()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,311 @@
+from __future__ import annotations
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Tuple
+from models.data import Data, Directory, File, Folder
+from utils.jsons import read_json
+
+class IndexStore(ABC):
+    """Per-file index of tracked folders.
+
+    Backends only have to persist `File` entries keyed by folder name + relative path,
+    so `FileHandler` can read and write single entries instead of the whole index.
+    """
+
+    @abstractmethod
+    def get_folder(self, name: str, base_path: str) -> Folder:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_file(self, name: str, path: str) -> Optional[File]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_files_page(self, name: str, after: str, limit: int) -> List[Tuple[str, File]]:
+        """Up to `limit` entries with paths sorted after `after` ("" for the first page)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_files(self, name: str, base_path: str, files: Dict[str, File]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_files(self, name: str, paths: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_paths(self, name: str, files: Iterable[str], directories: Iterable[str]) -> None:
+        """Drops file and directory entries together, in one transaction."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def folder_names(self) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_directories(self, name: str) -> Dict[str, Directory]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_directories(self, name: str, directories: Dict[str, Directory]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear_digests(self, name: str, paths: Iterable[str]) -> None:
+        """Marks the directories' digests as outdated, the next scan computes them again."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_directories(self, name: str, paths: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_children(self, name: str, path: str) -> Tuple[Optional[Directory], Dict[str, File], Dict[str, Directory]]:
+        """The directory at `path` ("" for the root) and its direct files and sub directories."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_by_hash(self, hash_algorithm: str, hashes: Iterable[str]) -> Dict[str, List[Tuple[str, str, File]]]:
+        """(folder, path, entry) of every indexed file, in any folder, with one of the given hashes."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_last_full_scan(self, name: str) -> float:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_last_full_scan(self, name: str, timestamp: float) -> None:
+        raise NotImplementedError
+
+class SqliteStore():
+    """One SQLite database, the stores of a process share it (and its migrations)."""
+
+    # Each entry is applied once, in order; PRAGMA user_version remembers how far we got.
+    _MIGRATIONS = [
+        """
+        CREATE TABLE folders (
+            name TEXT PRIMARY KEY,
+            base_path TEXT NOT NULL
+        );
+        CREATE TABLE files (
+            folder TEXT NOT NULL,
+            path TEXT NOT NULL,
+            date_modified REAL NOT NULL,
+            md5 TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (folder, path)
+        ) WITHOUT ROWID;
+        """,
+        """
+        ALTER TABLE files ADD COLUMN size INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE files ADD COLUMN mtime_ns INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE files ADD COLUMN inode INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE files ADD COLUMN ctime_ns INTEGER NOT NULL DEFAULT 0;
+        """,
+        """
+        CREATE TABLE directories (
+            folder TEXT NOT NULL,
+            path TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            entry_count INTEGER NOT NULL,
+            PRIMARY KEY (folder, path)
+        ) WITHOUT ROWID;
+        ALTER TABLE folders ADD COLUMN last_full_scan REAL NOT NULL DEFAULT 0;
+        """,
+        """
+        ALTER TABLE files ADD COLUMN hash_algorithm TEXT NOT NULL DEFAULT 'md5';
+        """,
+        """
+        ALTER TABLE directories ADD COLUMN digest TEXT NOT NULL DEFAULT '';
+        """,
+        """
+        CREATE INDEX files_by_hash ON files (hash_algorithm, md5);
+        """,
+        """
+        CREATE TABLE upload_sessions (
+            id TEXT PRIMARY KEY,
+            folder TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            hash_algorithm TEXT NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            temp_path TEXT NOT NULL,
+            created REAL NOT NULL
+        );
+        CREATE TABLE upload_chunks (
+            session_id TEXT NOT NULL,
+            chunk INTEGER NOT NULL,
+            PRIMARY KEY (session_id, chunk)
+        ) WITHOUT ROWID;
+        """,
+        # parent is the directory an entry is in, NULL for the root directory itself.
+        """
+        ALTER TABLE files ADD COLUMN parent TEXT;
+        ALTER TABLE directories ADD COLUMN parent TEXT;
+        UPDATE files SET parent = dirname(path);
+        UPDATE directories SET parent = dirname(path) WHERE path != '';
+        CREATE INDEX files_by_parent ON files (folder, parent);
+        CREATE INDEX directories_by_parent ON directories (folder, parent);
+        """,
+    ]
+
+    def __init__(self, relative_file_path: str) -> None:
+        self._db_path = relative_file_path
+        self._local = threading.local()
+        self._migrate()
+
+    def __getstate__(self):
+        # Connections can't cross process boundaries, every process opens its own.
+        return {"_db_path": self._db_path}
+
+    def __setstate__(self, state):
+        self._db_path = state["_db_path"]
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            # Used by the migrations, paths are split the same way everywhere.
+            connection.create_function("dirname", 1, os.path.dirname, deterministic=True)
+            self._local.connection = connection
+        return connection
+
+    def _migrate(self):
+        connection = self._connection()
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        for index, script in enumerate(self._MIGRATIONS[version:], start=version + 1):
+            connection.executescript(f"BEGIN; {script} PRAGMA user_version = {index}; COMMIT;")
+
+class SqliteIndexStore(SqliteStore, IndexStore):
+    _FILE_COLUMNS = ("date_modified", "md5", "size", "mtime_ns", "inode", "ctime_ns", "hash_algorithm")
+
+    def _row_to_file(self, row) -> File:
+        date_modified, md5, size, mtime_ns, inode, ctime_ns, hash_algorithm = row
+        return File(dateModified=date_modified, md5=md5, size=size, mtime_ns=mtime_ns, inode=inode, ctime_ns=ctime_ns,
+                    hash_algorithm=hash_algorithm)
+
+    def _file_to_row(self, file: File) -> tuple:
+        return (file.dateModified, file.md5, file.size, file.mtime_ns, file.inode, file.ctime_ns, file.hash_algorithm)
+
+    def get_folder(self, name: str, base_path: str) -> Folder:
+        columns = ", ".join(self._FILE_COLUMNS)
+        rows = self._connection().execute(f"SELECT path, {columns} FROM files WHERE folder = ?", (name,))
+        files = {row[0]: self._row_to_file(row[1:]) for row in rows}
+        return Folder(name=name, base_path=base_path, files=files)
+
+    def get_file(self, name: str, path: str) -> Optional[File]:
+        columns = ", ".join(self._FILE_COLUMNS)
+        row = self._connection().execute(f"SELECT {columns} FROM files WHERE folder = ? AND path = ?", (name, path)).fetchone()
+        return self._row_to_file(row) if row else None
+
+    def get_files_page(self, name: str, after: str, limit: int) -> List[Tuple[str, File]]:
+        columns = ", ".join(self._FILE_COLUMNS)
+        rows = self._connection().execute(
+            f"SELECT path, {columns} FROM files WHERE folder = ? AND path > ? ORDER BY path LIMIT ?", (name, after, limit))
+        return [(row[0], self._row_to_file(row[1:])) for row in rows]
+
+    def upsert_files(self, name: str, base_path: str, files: Dict[str, File]) -> None:
+        columns = ", ".join(self._FILE_COLUMNS)
+        placeholders = ", ".join("?" for _ in self._FILE_COLUMNS)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in self._FILE_COLUMNS)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO folders (name, base_path) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET base_path = excluded.base_path",
+                (name, base_path))
+            connection.executemany(
+                f"INSERT INTO files (folder, path, parent, {columns}) VALUES (?, ?, ?, {placeholders}) "
+                f"ON CONFLICT(folder, path) DO UPDATE SET {updates}",
+                ((name, path, os.path.dirname(path)) + self._file_to_row(file) for path, file in files.items()))
+
+    def delete_files(self, name: str, paths: Iterable[str]) -> None:
+        connection = self._connection()
+        with connection:
+            connection.executemany("DELETE FROM files WHERE folder = ? AND path = ?", ((name, path) for path in paths))
+
+    def delete_paths(self, name: str, files: Iterable[str], directories: Iterable[str]) -> None:
+        connection = self._connection()
+        with connection:
+            connection.executemany("DELETE FROM files WHERE folder = ? AND path = ?", ((name, path) for path in files))
+            connection.executemany("DELETE FROM directories WHERE folder = ? AND path = ?", ((name, path) for path in directories))
+
+    def folder_names(self) -> List[str]:
+        return [row[0] for row in self._connection().execute("SELECT name FROM folders")]
+
+    def get_directories(self, name: str) -> Dict[str, Directory]:
+        rows = self._connection().execute("SELECT path, mtime_ns, entry_count, digest FROM directories WHERE folder = ?", (name,))
+        return {path: Directory(mtime_ns=mtime_ns, entry_count=entry_count, digest=digest) for path, mtime_ns, entry_count, digest in rows}
+
+    def upsert_directories(self, name: str, directories: Dict[str, Directory]) -> None:
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "INSERT INTO directories (folder, path, parent, mtime_ns, entry_count, digest) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(folder, path) DO UPDATE SET mtime_ns = excluded.mtime_ns, entry_count = excluded.entry_count, "
+                "digest = excluded.digest",
+                ((name, path, os.path.dirname(path) if path else None, directory.mtime_ns, directory.entry_count, directory.digest)
+                 for path, directory in directories.items()))
+
+    def clear_digests(self, name: str, paths: Iterable[str]) -> None:
+        connection = self._connection()
+        with connection:
+            connection.executemany("UPDATE directories SET digest = '' WHERE folder = ? AND path = ?", ((name, path) for path in paths))
+
+    def delete_directories(self, name: str, paths: Iterable[str]) -> None:
+        connection = self._connection()
+        with connection:
+            connection.executemany("DELETE FROM directories WHERE folder = ? AND path = ?", ((name, path) for path in paths))
+
+    def get_children(self, name: str, path: str) -> Tuple[Optional[Directory], Dict[str, File], Dict[str, Directory]]:
+        connection = self._connection()
+        row = connection.execute("SELECT mtime_ns, entry_count, digest FROM directories WHERE folder = ? AND path = ?",
+                                 (name, path)).fetchone()
+        if row is None:
+            return None, {}, {}
+        directory = Directory(mtime_ns=row[0], entry_count=row[1], digest=row[2])
+        columns = ", ".join(self._FILE_COLUMNS)
+        rows = connection.execute(f"SELECT path, {columns} FROM files WHERE folder = ? AND parent = ?", (name, path))
+        files = {row[0]: self._row_to_file(row[1:]) for row in rows}
+        rows = connection.execute("SELECT path, mtime_ns, entry_count, digest FROM directories WHERE folder = ? AND parent = ?", (name, path))
+        directories = {child: Directory(mtime_ns=mtime_ns, entry_count=entry_count, digest=digest)
+                       for child, mtime_ns, entry_count, digest in rows}
+        return directory, files, directories
+
+    def find_by_hash(self, hash_algorithm: str, hashes: Iterable[str]) -> Dict[str, List[Tuple[str, str, File]]]:
+        hashes = list(hashes)
+        columns = ", ".join(self._FILE_COLUMNS)
+        found: Dict[str, List[Tuple[str, str, File]]] = {}
+        # Stays well below SQLite's limit on the number of parameters.
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            rows = self._connection().execute(
+                f"SELECT folder, path, {columns} FROM files WHERE hash_algorithm = ? AND md5 IN ({', '.join('?' for _ in batch)})",
+                (hash_algorithm, *batch))
+            for row in rows:
+                file = self._row_to_file(row[2:])
+                found.setdefault(file.md5, []).append((row[0], row[1], file))
+        return found
+
+    def get_last_full_scan(self, name: str) -> float:
+        row = self._connection().execute("SELECT last_full_scan FROM folders WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0.0
+
+    def set_last_full_scan(self, name: str, timestamp: float) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("UPDATE folders SET last_full_scan = ? WHERE name = ?", (timestamp, name))
+
+    def migrate_from_json(self, json_path: str) -> None:
+        """One-shot import of a legacy data.json index, which is renamed afterwards so it is never imported twice."""
+        if not os.path.exists(json_path):
+            return
+        print(f"Migrating {json_path} into {self._db_path}")
+        data = read_json(json_path, Data)
+        for folder in data.folders.values():
+            self.upsert_files(folder.name, folder.base_path, folder.files)
+        os.replace(json_path, f"{json_path}.migrated")
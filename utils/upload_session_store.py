@@ -0,0 +1,78 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import List, Optional
+from models.file_ops import UploadSession
+from utils.index_store import SqliteStore
+
+class UploadSessionStore(ABC):
+    """Resumable uploads in progress (see server.uploads) and the chunks they received."""
+
+    @abstractmethod
+    def get_upload_session(self, session_id: str) -> Optional[UploadSession]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_upload_session(self, name: str, path: str, size: int, hash: str, hash_algorithm: str) -> Optional[UploadSession]:
+        """A session for the same file and content, to resume it."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def expired_upload_sessions(self, created_before: float) -> List[UploadSession]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_upload_session(self, session: UploadSession) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_upload_chunk(self, session_id: str, chunk: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_upload_session(self, session_id: str) -> None:
+        raise NotImplementedError
+
+class SqliteUploadSessionStore(SqliteStore, UploadSessionStore):
+    """Kept in the index's database, pass it the same file as the SqliteIndexStore."""
+
+    _SESSION_COLUMNS = "id, folder, path, size, hash, hash_algorithm, chunk_size, temp_path, created"
+
+    def _row_to_session(self, row) -> UploadSession:
+        session_id, folder, path, size, hash, hash_algorithm, chunk_size, temp_path, created = row
+        received = [chunk for (chunk,) in self._connection().execute(
+            "SELECT chunk FROM upload_chunks WHERE session_id = ? ORDER BY chunk", (session_id,))]
+        return UploadSession(id=session_id, folder=folder, path=path, size=size, hash=hash, hash_algorithm=hash_algorithm,
+                             chunk_size=chunk_size, temp_path=temp_path, created=created, received=received)
+
+    def get_upload_session(self, session_id: str) -> Optional[UploadSession]:
+        row = self._connection().execute(f"SELECT {self._SESSION_COLUMNS} FROM upload_sessions WHERE id = ?", (session_id,)).fetchone()
+        return self._row_to_session(row) if row else None
+
+    def find_upload_session(self, name: str, path: str, size: int, hash: str, hash_algorithm: str) -> Optional[UploadSession]:
+        row = self._connection().execute(
+            f"SELECT {self._SESSION_COLUMNS} FROM upload_sessions WHERE folder = ? AND path = ? AND size = ? AND hash = ? AND hash_algorithm = ?",
+            (name, path, size, hash, hash_algorithm)).fetchone()
+        return self._row_to_session(row) if row else None
+
+    def expired_upload_sessions(self, created_before: float) -> List[UploadSession]:
+        rows = self._connection().execute(f"SELECT {self._SESSION_COLUMNS} FROM upload_sessions WHERE created < ?", (created_before,))
+        return [self._row_to_session(row) for row in rows.fetchall()]
+
+    def save_upload_session(self, session: UploadSession) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                f"INSERT INTO upload_sessions ({self._SESSION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (session.id, session.folder, session.path, session.size, session.hash, session.hash_algorithm,
+                 session.chunk_size, session.temp_path, session.created))
+
+    def add_upload_chunk(self, session_id: str, chunk: int) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("INSERT OR IGNORE INTO upload_chunks (session_id, chunk) VALUES (?, ?)", (session_id, chunk))
+
+    def delete_upload_session(self, session_id: str) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM upload_chunks WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM upload_sessions WHERE id = ?", (session_id,))